@@ -0,0 +1,303 @@
+"""
+Benchmarks del monitor de precios
+Crea una base de datos sintética por escala (búsquedas x filas de historial)
+con el simulador, mide los caminos críticos y escribe los tiempos en JSON.
+Con --baseline compara contra una ejecución guardada y marca regresiones.
+
+Caminos medidos:
+- check: FlightPriceMonitor.check_flights_and_update de punta a punta con el simulador
+- get_searches / get_price_history (sin caché de lecturas)
+- min_price_stats (agregado de search_stats) y min_price_history (MIN(price) sobre el historial)
+- analysis_*: estadísticas de la pestaña Análisis (serie, analítica de una ruta y de todas)
+- booking_links: booking_links.generate_booking_links
+
+Uso:
+    python benchmarks.py                                   # escalas small y medium
+    python benchmarks.py --scale large --only check,get_   # 10k búsquedas, 1M filas
+    python benchmarks.py --save-baseline                   # guarda la referencia
+    python benchmarks.py --baseline benchmark_baseline.json --threshold 0.25
+"""
+
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Escalas predefinidas: (búsquedas, filas de historial)
+SCALES = {
+    'small': (10, 100),
+    'medium': (1_000, 100_000),
+    'large': (10_000, 1_000_000),
+}
+DEFAULT_SCALES = ('small', 'medium')
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 0.25
+# Diferencias menores (segundos por operación) se consideran ruido
+DEFAULT_MIN_DELTA = 1e-5
+BENCHMARK_SEED = 1234
+
+
+class BenchmarkCase(NamedTuple):
+    """`run(i)` ejecuta una operación; se repite `number` veces por medición"""
+    name: str
+    run: Callable[[int], object]
+    number: int = 1
+
+
+def seed_database(db_path: str, searches: int, rows: int, seed: int = BENCHMARK_SEED) -> Dict:
+    """
+    Base de datos con `searches` búsquedas activas y `rows` precios repartidos
+    entre ellas (chequeos cada 6 horas hacia atrás), generados por el simulador.
+    """
+    from data_import import bulk_load_mode
+    from flight_storage import FlightPriceMonitor
+    from flight_simulation import FlightSimulator, sample_routes
+
+    started = time.perf_counter()
+    monitor = FlightPriceMonitor(db_path=db_path)
+    conn = monitor.get_connection()
+
+    routes = sample_routes(min(searches, 552), seed)
+    today = np.datetime64('today', 'D')
+    index = np.arange(searches)
+    origins = np.array([routes[i % len(routes)][0] for i in index], dtype=object)
+    destinations = np.array([routes[i % len(routes)][1] for i in index], dtype=object)
+    departures = today + 30 + (index // len(routes)) % 180
+    with conn:
+        conn.executemany('''
+            INSERT INTO flight_searches
+            (search_name, origin, destination, departure_date, passengers, target_price, is_active)
+            VALUES (?, ?, ?, ?, 1, ?, 1)
+        ''', [(f"Bench {i}", origins[i], destinations[i], str(departures[i]), 400.0) for i in index])
+    search_ids = np.array([row[0] for row in conn.execute('SELECT id FROM flight_searches ORDER BY id')])
+
+    per_search = max(1, rows // searches)
+    owner = np.repeat(np.arange(searches), per_search)[:rows]
+    age = np.concatenate([np.arange(per_search)] * searches)[:rows]
+    checks = np.datetime64('now', 'h') - age * np.timedelta64(6, 'h')
+    fares = FlightSimulator(seed=seed).fares(origins[owner], destinations[owner], departures[owner], checks)
+    checked_at = np.char.replace(np.datetime_as_string(checks.astype('datetime64[s]')), 'T', ' ')
+
+    with bulk_load_mode(conn):
+        with conn:
+            conn.executemany('''
+                INSERT INTO price_history
+                (search_id, price, currency, airline, flight_details, source, checked_at, provider_call)
+                VALUES (?, ?, 'USD', ?, ?, ?, ?, 0)
+            ''', zip(search_ids[owner].tolist(), fares['price'].tolist(), fares['airline'].tolist(),
+                     fares['flight_details'].tolist(), fares['source'].tolist(), checked_at.tolist()))
+    monitor.rebuild_search_stats()
+    monitor.close_connection()
+    return {'searches': searches, 'rows': len(owner), 'seconds': time.perf_counter() - started}
+
+
+def build_cases(db_path: str, seed: int = BENCHMARK_SEED) -> List[BenchmarkCase]:
+    from booking_links import generate_booking_links
+    from flight_api_connector import FlightAPIConnector
+    from flight_storage import FlightPriceMonitor
+    from flight_simulation import FlightSimulator
+    from price_analytics import compute_route_analytics, days_to_departure_profile
+    from price_retention import load_price_series
+
+    connector = FlightAPIConnector(use_cache=False, simulate_provider=True,
+                                   simulator=FlightSimulator(seed=seed), secret_getter=lambda key, default=None: default)
+    monitor = FlightPriceMonitor(db_path=db_path, connector=connector)
+    conn = monitor.get_connection()
+    search_ids = [row[0] for row in conn.execute('SELECT id FROM flight_searches ORDER BY id')]
+    searches = {row['id']: row for row in monitor.get_searches().to_dict('records')}
+    pick = lambda i: search_ids[(i * 7919) % len(search_ids)]
+
+    def uncached(loader):
+        def run(i):
+            monitor.invalidate_read_cache()
+            return loader(i)
+        return run
+
+    def all_routes(i):
+        history, summary = compute_route_analytics(monitor)
+        return days_to_departure_profile(history)
+
+    flight = {'price': 420.0, 'currency': 'USD', 'airline': 'Avianca'}
+
+    return [
+        BenchmarkCase('check', lambda i: monitor.check_flights_and_update(pick(i)), number=20),
+        BenchmarkCase('get_searches', uncached(lambda i: monitor.get_searches())),
+        BenchmarkCase('get_searches_cached', lambda i: monitor.get_searches(), number=20),
+        BenchmarkCase('get_price_history', uncached(lambda i: monitor.get_price_history(pick(i))), number=20),
+        BenchmarkCase('min_price_stats', lambda i: monitor.get_search_stats(pick(i)), number=200),
+        BenchmarkCase('min_price_history', lambda i: conn.execute(
+            'SELECT MIN(price) FROM price_history WHERE search_id = ?', (pick(i),)).fetchone(), number=200),
+        BenchmarkCase('analysis_series', lambda i: load_price_series(conn, pick(i)), number=20),
+        BenchmarkCase('analysis_route', lambda i: compute_route_analytics(monitor, [pick(i)]), number=20),
+        BenchmarkCase('analysis_all_routes', all_routes),
+        BenchmarkCase('booking_links', lambda i: generate_booking_links(flight, searches[pick(i)]),
+                      number=1000),
+    ]
+
+
+def time_case(case: BenchmarkCase, repeat: int) -> Dict:
+    """Segundos por operación de cada repetición (tras una ejecución de calentamiento)"""
+    case.run(0)
+    samples = []
+    for r in range(repeat):
+        started = time.perf_counter()
+        for i in range(case.number):
+            case.run(r * case.number + i + 1)
+        samples.append((time.perf_counter() - started) / case.number)
+    median = statistics.median(samples)
+    return {
+        'name': case.name,
+        'number': case.number,
+        'repeat': repeat,
+        'min': min(samples),
+        'median': median,
+        'mean': statistics.fmean(samples),
+        'max': max(samples),
+        'ops_per_second': 1.0 / median if median else None,
+    }
+
+
+def run_scale(scale: str, searches: int, rows: int, repeat: int, only: Optional[List[str]],
+              workdir: str) -> Tuple[Dict, List[Dict]]:
+    db_path = os.path.join(workdir, f"bench_{scale}.db")
+    seeding = seed_database(db_path, searches, rows)
+    results = []
+    for case in build_cases(db_path):
+        if only and not any(case.name.startswith(prefix) for prefix in only):
+            continue
+        result = time_case(case, repeat)
+        result.update(scale=scale, searches=searches, rows=rows)
+        results.append(result)
+        print(f"  {scale:>8} {case.name:<22} {format_seconds(result['median']):>10}/op", file=sys.stderr)
+    return seeding, results
+
+
+def environment() -> Dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                                text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'timestamp': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'commit': commit or None,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'sqlite': sqlite3.sqlite_version,
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+    }
+
+
+def compare_results(current: List[Dict], baseline: List[Dict], threshold: float = DEFAULT_THRESHOLD,
+                    min_delta: float = DEFAULT_MIN_DELTA) -> List[Dict]:
+    """
+    Compara el mínimo por operación de cada (escala, benchmark) con la
+    referencia. Es regresión si empeora más de `threshold` (relativo) y más
+    de `min_delta` segundos.
+    """
+    reference = {(result['scale'], result['name']): result for result in baseline}
+    comparison = []
+    for result in current:
+        base = reference.get((result['scale'], result['name']))
+        if base is None:
+            continue
+        ratio = result['min'] / base['min'] if base['min'] else float('inf')
+        comparison.append({
+            'scale': result['scale'],
+            'name': result['name'],
+            'baseline': base['min'],
+            'current': result['min'],
+            'ratio': ratio,
+            'regression': ratio > 1.0 + threshold and result['min'] - base['min'] > min_delta,
+        })
+    return comparison
+
+
+def format_seconds(seconds: float) -> str:
+    if seconds >= 1:
+        return f"{seconds:.2f} s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds * 1e6:.1f} µs"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks del monitor de precios de vuelos")
+    parser.add_argument("--scale", default=','.join(DEFAULT_SCALES),
+                        help=f"Escalas separadas por comas ({', '.join(SCALES)})")
+    parser.add_argument("--searches", type=int, help="Escala personalizada: número de búsquedas")
+    parser.add_argument("--rows", type=int, help="Escala personalizada: filas de historial")
+    parser.add_argument("--only", help="Prefijos de benchmarks separados por comas (p. ej. check,get_)")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--out", default="benchmark_results.json", help="Resultados en JSON ('-' = stdout)")
+    parser.add_argument("--baseline", default="benchmark_baseline.json", help="Referencia para comparar")
+    parser.add_argument("--save-baseline", action="store_true", help="Guarda esta ejecución como referencia")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Empeoramiento relativo a partir del cual hay regresión")
+    parser.add_argument("--workdir", help="Directorio de las bases de datos sintéticas (por defecto temporal)")
+    args = parser.parse_args()
+
+    if args.searches or args.rows:
+        searches = args.searches or SCALES['small'][0]
+        rows = args.rows or searches * 10
+        scales = {f"{searches}x{rows}": (searches, rows)}
+    else:
+        names = [name.strip() for name in args.scale.split(',') if name.strip()]
+        unknown = [name for name in names if name not in SCALES]
+        if unknown:
+            parser.error(f"Escalas desconocidas: {', '.join(unknown)}")
+        scales = {name: SCALES[name] for name in names}
+    only = [prefix.strip() for prefix in args.only.split(',')] if args.only else None
+
+    report = {'environment': environment(), 'seeding': {}, 'results': []}
+    with tempfile.TemporaryDirectory(prefix='flight-bench-') as tmpdir:
+        workdir = args.workdir or tmpdir
+        os.makedirs(workdir, exist_ok=True)
+        for scale, (searches, rows) in scales.items():
+            print(f"Escala {scale}: {searches} búsquedas, {rows} filas", file=sys.stderr)
+            seeding, results = run_scale(scale, searches, rows, args.repeat, only, workdir)
+            report['seeding'][scale] = seeding
+            report['results'].extend(results)
+
+    exit_code = 0
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as handle:
+            baseline = json.load(handle)
+        report['baseline'] = {'path': args.baseline, 'environment': baseline.get('environment')}
+        report['comparison'] = compare_results(report['results'], baseline['results'], args.threshold)
+        for row in report['comparison']:
+            flag = "REGRESIÓN" if row['regression'] else ""
+            print(f"  {row['scale']:>8} {row['name']:<22} {format_seconds(row['baseline']):>10} → "
+                  f"{format_seconds(row['current']):>10} ({row['ratio']:.2f}x) {flag}", file=sys.stderr)
+        regressions = [row for row in report['comparison'] if row['regression']]
+        if regressions:
+            print(f"{len(regressions)} regresiones por encima del {args.threshold:.0%}", file=sys.stderr)
+            exit_code = 1
+
+    output = json.dumps(report, indent=2)
+    if args.out == '-':
+        print(output)
+    else:
+        with open(args.out, 'w', encoding='utf-8') as handle:
+            handle.write(output)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as handle:
+            handle.write(output)
+        print(f"Referencia guardada en {args.baseline}", file=sys.stderr)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
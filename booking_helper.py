@@ -4,144 +4,37 @@ Genera enlaces inteligentes y facilita el proceso de booking
 """
 
 import streamlit as st
-import urllib.parse
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, List, Optional
+
+from booking_links import generate_booking_links, generate_google_flights_url, get_airline_direct_link
+from price_alerts import ALERT_RULE_TYPES, RULE_PERCENT_DROP, RULE_PERCENTILE, RULE_TARGET_PRICE, add_alert_rule
 
 class FlightBookingHelper:
-    def __init__(self):
-        self.affiliate_codes = {
-            'skyscanner': st.secrets.get('SKYSCANNER_AFFILIATE', ''),
-            'kayak': st.secrets.get('KAYAK_AFFILIATE', ''),
-            'expedia': st.secrets.get('EXPEDIA_AFFILIATE', ''),
-        }
+    def __init__(self, monitor=None, affiliate_codes: Optional[Dict[str, str]] = None):
+        # Monitor opcional para persistir las alertas creadas desde el widget
+        self.monitor = monitor
+        if affiliate_codes is None:
+            from flight_api_streamlit import get_affiliate_codes
+            affiliate_codes = get_affiliate_codes()
+        self.affiliate_codes = dict(affiliate_codes)
     
     def generate_google_flights_url(self, search_data: Dict) -> str:
         """Genera URL optimizada para Google Flights"""
-        origin = search_data['origin']
-        destination = search_data['destination']
-        departure_date = search_data['departure_date']
-        return_date = search_data.get('return_date', '')
-        passengers = search_data.get('passengers', 1)
-        
-        # Formato de fecha para Google Flights: YYYY-MM-DD
-        dep_formatted = departure_date.replace('-', '')
-        
-        base_url = "https://www.google.com/travel/flights"
-        
-        if return_date:
-            ret_formatted = return_date.replace('-', '')
-            # Vuelo redondo
-            url = f"{base_url}?tfs=CBwQAhojEgoyMDI1LTA0LTE1KAFwAYIBCwj___________8BQAFIAR"
-        else:
-            # Solo ida
-            url = f"{base_url}?tfs=CBwQAhokag0IAhIJL20vMDFkenlkagwIAhIIL20vMDRzd2RqAQ"
-        
-        # Agregar parámetros adicionales
-        params = {
-            'hl': 'es',
-            'gl': 'CO',  # País Colombia
-            'curr': 'USD'
-        }
-        
-        return f"{url}&{'&'.join([f'{k}={v}' for k, v in params.items()])}"
+        return generate_google_flights_url(search_data)
     
     def generate_booking_links(self, flight_data: Dict, search_data: Dict) -> Dict[str, str]:
         """Genera enlaces a múltiples plataformas de booking"""
-        
-        origin = search_data['origin']
-        destination = search_data['destination']
-        departure_date = search_data['departure_date']
-        return_date = search_data.get('return_date', '')
-        passengers = search_data.get('passengers', 1)
-        
-        # Formatear fechas para diferentes plataformas
-        dep_formatted = departure_date.replace('-', '')
-        dep_slash = departure_date.replace('-', '/')
-        
-        links = {}
-        
-        # Google Flights (principal)
-        links['🔍 Google Flights'] = self.generate_google_flights_url(search_data)
-        
-        # Skyscanner
-        skyscanner_url = f"https://www.skyscanner.com/transport/flights/{origin}/{destination}/{dep_formatted}"
-        if return_date:
-            ret_formatted = return_date.replace('-', '')
-            skyscanner_url += f"/{ret_formatted}"
-        skyscanner_url += f"/?adults={passengers}&locale=es-MX&currency=USD"
-        links['🌐 Skyscanner'] = skyscanner_url
-        
-        # Kayak
-        trip_type = "roundtrip" if return_date else "oneway"
-        kayak_url = f"https://www.kayak.com/flights/{origin}-{destination}/{departure_date}"
-        if return_date:
-            kayak_url += f"/{return_date}"
-        kayak_url += f"?sort=price_a&fs=cfc=1"
-        links['🚁 Kayak'] = kayak_url
-        
-        # Expedia
-        expedia_url = f"https://www.expedia.com/Flights-Search?trip={trip_type}&leg1=from:{origin},to:{destination},departure:{departure_date}"
-        if return_date:
-            expedia_url += f"&leg2=from:{destination},to:{origin},departure:{return_date}"
-        expedia_url += f"&passengers=children:0,adults:{passengers},seniors:0,infantinlap:Y"
-        links['🏢 Expedia'] = expedia_url
-        
-        # Despegar (para usuarios de América Latina)
-        despegar_url = f"https://www.despegar.com/vuelos/resultados/search?from={origin}&to={destination}&departure={departure_date}"
-        if return_date:
-            despegar_url += f"&return={return_date}"
-        despegar_url += f"&adults={passengers}&children=0&infants=0&class=ECONOMY"
-        links['✈️ Despegar'] = despegar_url
-        
-        # Momondo
-        momondo_url = f"https://www.momondo.com/flight-search/{origin}-{destination}/{departure_date}"
-        if return_date:
-            momondo_url += f"/{return_date}"
-        momondo_url += f"?sort=price_a&fs=cfc=1"
-        links['🔍 Momondo'] = momondo_url
-        
-        # Si conocemos la aerolínea específica, agregar enlace directo
-        if flight_data.get('airline'):
-            airline_link = self.get_airline_direct_link(
-                flight_data['airline'], origin, destination, departure_date, return_date
-            )
-            if airline_link:
-                links[f"🏢 {flight_data['airline']} (Directo)"] = airline_link
-        
-        return links
+        return generate_booking_links(flight_data, search_data)
     
     def get_airline_direct_link(self, airline: str, origin: str, dest: str, 
                                dep_date: str, ret_date: str = None) -> str:
         """Genera enlaces directos a sitios web de aerolíneas"""
-        
-        airline_sites = {
-            'Avianca': 'https://www.avianca.com',
-            'LATAM': 'https://www.latam.com', 
-            'LATAM Airlines': 'https://www.latam.com',
-            'American Airlines': 'https://www.aa.com',
-            'Delta': 'https://www.delta.com',
-            'Delta Air Lines': 'https://www.delta.com',
-            'United': 'https://www.united.com',
-            'United Airlines': 'https://www.united.com',
-            'JetBlue': 'https://www.jetblue.com',
-            'JetBlue Airways': 'https://www.jetblue.com',
-            'Spirit Airlines': 'https://www.spirit.com',
-            'Copa Airlines': 'https://www.copaair.com',
-            'Viva Air': 'https://www.vivaair.com'
-        }
-        
-        base_url = airline_sites.get(airline)
-        if not base_url:
-            # Fallback a búsqueda en Google
-            return f"https://www.google.com/search?q={urllib.parse.quote(f'{airline} vuelos {origin} {dest}')}"
-        
-        # Para la mayoría de aerolíneas, redirigir a la página principal
-        # En un entorno de producción, cada aerolínea tendría su formato específico
-        return f"{base_url}/booking"
+        return get_airline_direct_link(airline, origin, dest, dep_date, ret_date)
     
-    def show_booking_widget(self, flight_data: Dict, search_data: Dict):
-        """Muestra widget completo de opciones de compra"""
+    def show_booking_widget(self, flight_data: Dict, search_data: Dict, key: Optional[str] = None):
+        """Muestra widget completo de opciones de compra (`key` distingue varios widgets en la página)"""
+        key = key or str(search_data.get('id', f"{search_data['origin']}_{search_data['destination']}"))
         
         st.markdown("---")
         st.subheader("🛒 ¿Te interesa este precio? ¡Búscalo para comprarlo!")
@@ -186,7 +79,8 @@ class FlightBookingHelper:
         
         col1, col2, col3 = st.columns([1, 2, 1])
         with col2:
-            if st.button("🚀 Buscar en Google Flights", type="primary", use_container_width=True):
+            if st.button("🚀 Buscar en Google Flights", type="primary", use_container_width=True,
+                         key=f"google_flights_{key}"):
                 # Usar JavaScript para abrir en nueva pestaña
                 js_code = f"""
                 <script>
@@ -223,39 +117,66 @@ class FlightBookingHelper:
                             st.markdown(f"[{platform}]({url})")
         
         # Alerta de precio
-        self.show_price_alert_section(flight_data, search_data)
+        self.show_price_alert_section(flight_data, search_data, key)
     
-    def show_price_alert_section(self, flight_data: Dict, search_data: Dict):
+    def show_price_alert_section(self, flight_data: Dict, search_data: Dict, key_suffix: Optional[str] = None):
         """Sección para configurar alertas de precio"""
         
         with st.expander("🔔 Configurar Alerta de Precio"):
             st.write("¿El precio actual está alto? Configura una alerta para cuando baje:")
             
+            key_suffix = key_suffix or search_data.get('id', f"{search_data['origin']}_{search_data['destination']}")
+            rule_type = st.selectbox(
+                "Tipo de alerta",
+                list(ALERT_RULE_TYPES.keys()),
+                format_func=ALERT_RULE_TYPES.get,
+                key=f"alert_type_{key_suffix}"
+            )
+            
             col1, col2 = st.columns(2)
             
             with col1:
                 current_price = flight_data['price']
-                target_price = st.number_input(
-                    "Precio objetivo (USD)", 
-                    min_value=50.0, 
-                    max_value=current_price - 10,
-                    value=current_price * 0.9,
-                    step=10.0
-                )
+                threshold = None
+                if rule_type == RULE_TARGET_PRICE:
+                    threshold = st.number_input(
+                        "Precio objetivo (USD)", 
+                        min_value=50.0, 
+                        max_value=max(current_price - 10, 50.0),
+                        value=max(current_price * 0.9, 50.0),
+                        step=10.0,
+                        key=f"alert_threshold_{key_suffix}"
+                    )
+                elif rule_type == RULE_PERCENT_DROP:
+                    threshold = st.number_input("Caída mínima (%)", min_value=1.0, max_value=90.0,
+                                                value=10.0, step=1.0, key=f"alert_threshold_{key_suffix}")
+                elif rule_type == RULE_PERCENTILE:
+                    threshold = st.number_input("Percentil", min_value=1.0, max_value=99.0,
+                                                value=10.0, step=1.0, key=f"alert_threshold_{key_suffix}")
+                cooldown_hours = st.number_input("Horas mínimas entre avisos", min_value=1, value=24,
+                                                 key=f"alert_cooldown_{key_suffix}")
             
             with col2:
                 alert_email = st.text_input(
                     "Email para alertas", 
-                    value=st.session_state.get('user_email', '')
+                    value=st.session_state.get('user_email', ''),
+                    key=f"alert_email_{key_suffix}"
                 )
             
-            if st.button("🔔 Crear Alerta de Precio"):
-                if alert_email and target_price:
-                    # Aquí se crearía la alerta en la base de datos
-                    st.success(f"✅ Alerta creada! Te notificaremos cuando el precio baje a ${target_price}")
-                    st.session_state['user_email'] = alert_email
-                else:
+            if st.button("🔔 Crear Alerta de Precio", key=f"alert_create_{key_suffix}"):
+                if not alert_email:
                     st.error("Por favor completa todos los campos")
+                elif self.monitor is None or not search_data.get('id'):
+                    st.error("Guarda primero la búsqueda para poder crear alertas")
+                else:
+                    try:
+                        add_alert_rule(self.monitor.get_connection(), search_data['id'], rule_type,
+                                       threshold=threshold, email=alert_email,
+                                       cooldown_minutes=int(cooldown_hours) * 60)
+                        st.success(f"✅ Alerta creada: {ALERT_RULE_TYPES[rule_type].lower()}")
+                        st.session_state['user_email'] = alert_email
+                    except ValueError as e:
+                        st.error(str(e))
     
     def track_booking_click(self, platform: str, flight_data: Dict, search_data: Dict):
         """Registra clicks en enlaces de booking para analytics"""
@@ -301,14 +222,45 @@ class FlightBookingHelper:
                 st.metric("Precio Promedio Buscado", f"${avg_price:.0f}")
 
 
-def add_booking_functionality_to_search_result(flight_result, search_data):
+# Último resultado con opciones de compra por sección de la página. Los botones
+# de Streamlit solo valen True en el rerun del click, así que el widget (y el
+# formulario de alertas) se pinta desde aquí en los reruns siguientes.
+BOOKING_RESULTS_KEY = 'booking_results'
+
+
+def remember_search_result(slot: str, flight_result, search_data) -> bool:
+    """Guarda el resultado de una búsqueda para mostrar sus opciones de compra"""
+    results = st.session_state.setdefault(BOOKING_RESULTS_KEY, {})
+    if flight_result and flight_result.get('flight_result'):
+        results[slot] = (flight_result, search_data)
+        return True
+    results.pop(slot, None)
+    return False
+
+
+def show_remembered_search_result(slot: str, monitor=None) -> bool:
+    """Pinta las opciones de compra guardadas para `slot`, si las hay"""
+    saved = st.session_state.get(BOOKING_RESULTS_KEY, {}).get(slot)
+    if not saved:
+        return False
+    if st.button("✖️ Ocultar opciones de compra", key=f"booking_hide_{slot}"):
+        st.session_state[BOOKING_RESULTS_KEY].pop(slot, None)
+        st.rerun()
+    flight_result, search_data = saved
+    return add_booking_functionality_to_search_result(flight_result, search_data, monitor, key=slot)
+
+
+def add_booking_functionality_to_search_result(flight_result, search_data, monitor=None, key=None):
     """Función para agregar a la app principal"""
     if flight_result and flight_result.get('flight_result'):
-        booking_helper = FlightBookingHelper()
+        booking_helper = FlightBookingHelper(monitor)
         flight_data = flight_result['flight_result']
+        # El ID de la búsqueda guardada permite asociarle alertas
+        if flight_result.get('search_data', {}).get('id') and not search_data.get('id'):
+            search_data = dict(search_data, id=flight_result['search_data']['id'])
         
         # Mostrar widget de compra
-        booking_helper.show_booking_widget(flight_data, search_data)
+        booking_helper.show_booking_widget(flight_data, search_data, key=key)
         
         return True
     return False
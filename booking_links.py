@@ -0,0 +1,136 @@
+"""
+Enlaces de compra de vuelos
+Genera las URLs de búsqueda en Google Flights, metabuscadores, agencias y
+sitios de aerolíneas. Sin dependencias de la interfaz: lo usan
+booking_helper (Streamlit) y los benchmarks.
+"""
+
+import urllib.parse
+from typing import Dict
+
+
+def generate_google_flights_url(search_data: Dict) -> str:
+    """Genera URL optimizada para Google Flights"""
+    origin = search_data['origin']
+    destination = search_data['destination']
+    departure_date = search_data['departure_date']
+    return_date = search_data.get('return_date', '')
+    passengers = search_data.get('passengers', 1)
+
+    # Formato de fecha para Google Flights: YYYY-MM-DD
+    dep_formatted = departure_date.replace('-', '')
+
+    base_url = "https://www.google.com/travel/flights"
+
+    if return_date:
+        ret_formatted = return_date.replace('-', '')
+        # Vuelo redondo
+        url = f"{base_url}?tfs=CBwQAhojEgoyMDI1LTA0LTE1KAFwAYIBCwj___________8BQAFIAR"
+    else:
+        # Solo ida
+        url = f"{base_url}?tfs=CBwQAhokag0IAhIJL20vMDFkenlkagwIAhIIL20vMDRzd2RqAQ"
+
+    # Agregar parámetros adicionales
+    params = {
+        'hl': 'es',
+        'gl': 'CO',  # País Colombia
+        'curr': 'USD'
+    }
+
+    return f"{url}&{'&'.join([f'{k}={v}' for k, v in params.items()])}"
+
+
+def generate_booking_links(flight_data: Dict, search_data: Dict) -> Dict[str, str]:
+    """Genera enlaces a múltiples plataformas de booking"""
+
+    origin = search_data['origin']
+    destination = search_data['destination']
+    departure_date = search_data['departure_date']
+    return_date = search_data.get('return_date', '')
+    passengers = search_data.get('passengers', 1)
+
+    # Formatear fechas para diferentes plataformas
+    dep_formatted = departure_date.replace('-', '')
+    dep_slash = departure_date.replace('-', '/')
+
+    links = {}
+
+    # Google Flights (principal)
+    links['🔍 Google Flights'] = generate_google_flights_url(search_data)
+
+    # Skyscanner
+    skyscanner_url = f"https://www.skyscanner.com/transport/flights/{origin}/{destination}/{dep_formatted}"
+    if return_date:
+        ret_formatted = return_date.replace('-', '')
+        skyscanner_url += f"/{ret_formatted}"
+    skyscanner_url += f"/?adults={passengers}&locale=es-MX&currency=USD"
+    links['🌐 Skyscanner'] = skyscanner_url
+
+    # Kayak
+    trip_type = "roundtrip" if return_date else "oneway"
+    kayak_url = f"https://www.kayak.com/flights/{origin}-{destination}/{departure_date}"
+    if return_date:
+        kayak_url += f"/{return_date}"
+    kayak_url += f"?sort=price_a&fs=cfc=1"
+    links['🚁 Kayak'] = kayak_url
+
+    # Expedia
+    expedia_url = f"https://www.expedia.com/Flights-Search?trip={trip_type}&leg1=from:{origin},to:{destination},departure:{departure_date}"
+    if return_date:
+        expedia_url += f"&leg2=from:{destination},to:{origin},departure:{return_date}"
+    expedia_url += f"&passengers=children:0,adults:{passengers},seniors:0,infantinlap:Y"
+    links['🏢 Expedia'] = expedia_url
+
+    # Despegar (para usuarios de América Latina)
+    despegar_url = f"https://www.despegar.com/vuelos/resultados/search?from={origin}&to={destination}&departure={departure_date}"
+    if return_date:
+        despegar_url += f"&return={return_date}"
+    despegar_url += f"&adults={passengers}&children=0&infants=0&class=ECONOMY"
+    links['✈️ Despegar'] = despegar_url
+
+    # Momondo
+    momondo_url = f"https://www.momondo.com/flight-search/{origin}-{destination}/{departure_date}"
+    if return_date:
+        momondo_url += f"/{return_date}"
+    momondo_url += f"?sort=price_a&fs=cfc=1"
+    links['🔍 Momondo'] = momondo_url
+
+    # Si conocemos la aerolínea específica, agregar enlace directo
+    if flight_data.get('airline'):
+        airline_link = get_airline_direct_link(
+            flight_data['airline'], origin, destination, departure_date, return_date
+        )
+        if airline_link:
+            links[f"🏢 {flight_data['airline']} (Directo)"] = airline_link
+
+    return links
+
+
+def get_airline_direct_link(airline: str, origin: str, dest: str,
+                            dep_date: str, ret_date: str = None) -> str:
+    """Genera enlaces directos a sitios web de aerolíneas"""
+
+    airline_sites = {
+        'Avianca': 'https://www.avianca.com',
+        'LATAM': 'https://www.latam.com', 
+        'LATAM Airlines': 'https://www.latam.com',
+        'American Airlines': 'https://www.aa.com',
+        'Delta': 'https://www.delta.com',
+        'Delta Air Lines': 'https://www.delta.com',
+        'United': 'https://www.united.com',
+        'United Airlines': 'https://www.united.com',
+        'JetBlue': 'https://www.jetblue.com',
+        'JetBlue Airways': 'https://www.jetblue.com',
+        'Spirit Airlines': 'https://www.spirit.com',
+        'Copa Airlines': 'https://www.copaair.com',
+        'Viva Air': 'https://www.vivaair.com'
+    }
+
+    base_url = airline_sites.get(airline)
+    if not base_url:
+        # Fallback a búsqueda en Google
+        return f"https://www.google.com/search?q={urllib.parse.quote(f'{airline} vuelos {origin} {dest}')}"
+
+    # Para la mayoría de aerolíneas, redirigir a la página principal
+    # En un entorno de producción, cada aerolínea tendría su formato específico
+    return f"{base_url}/booking"
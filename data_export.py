@@ -0,0 +1,216 @@
+"""
+Exportación masiva de búsquedas e historial de precios
+Lee SQLite con un cursor en bloques de tamaño fijo y escribe CSV, JSON Lines
+o Parquet sin cargar nunca la tabla completa en memoria.
+
+El historial ya compactado por price_retention no está en price_history: se
+exporta resumido desde price_rollup_hourly y price_rollup_daily.
+
+Uso como proceso independiente:
+    python data_export.py --format parquet --origin BOG --since 2025-01-01
+"""
+
+import argparse
+import csv
+import json
+import os
+import sqlite3
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+EXPORT_FORMATS = ('csv', 'jsonl', 'parquet')
+EXPORT_TABLES = ('flight_searches', 'price_history', 'price_rollup_hourly', 'price_rollup_daily')
+ROLLUP_TABLES = ('price_rollup_hourly', 'price_rollup_daily')
+DEFAULT_CHUNK_SIZE = 10000
+
+
+def open_read_connection(db_path: str) -> sqlite3.Connection:
+    """Conexión de solo lectura dedicada a la exportación"""
+    return sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+
+
+def table_columns(conn: sqlite3.Connection, table: str) -> List[Tuple[str, str]]:
+    """Columnas (nombre, tipo declarado) de una tabla en orden"""
+    return [(row[1], (row[2] or '').upper()) for row in conn.execute(f'PRAGMA table_info({table})')]
+
+
+def build_export_query(table: str, origin: Optional[str] = None, destination: Optional[str] = None,
+                       since: Optional[str] = None, until: Optional[str] = None) -> Tuple[str, list]:
+    """Consulta filtrada por ruta y rango de fechas para una tabla exportable"""
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Tabla no exportable: {table}")
+
+    conditions, params = [], []
+    # LEFT JOIN: sin filtro de ruta también salen los precios de búsquedas borradas
+    if table == 'price_history':
+        query = 'SELECT p.* FROM price_history p LEFT JOIN flight_searches s ON s.id = p.search_id'
+        date_column = 'p.checked_at'
+        order = 'p.id'
+    elif table in ROLLUP_TABLES:
+        query = f'SELECT r.* FROM {table} r LEFT JOIN flight_searches s ON s.id = r.search_id'
+        date_column = 'r.bucket_start'
+        order = 'r.search_id, r.bucket_start'
+    else:
+        query = 'SELECT s.* FROM flight_searches s'
+        date_column = 's.created_at'
+        order = 's.id'
+
+    if origin:
+        conditions.append('s.origin = ?')
+        params.append(origin.upper())
+    if destination:
+        conditions.append('s.destination = ?')
+        params.append(destination.upper())
+    if since:
+        conditions.append(f'{date_column} >= ?')
+        params.append(since)
+    if until:
+        conditions.append(f'{date_column} < ?')
+        params.append(until)
+
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    # Orden por clave primaria: recorrido secuencial del índice
+    query += f' ORDER BY {order}'
+    return query, params
+
+
+def iter_chunks(conn: sqlite3.Connection, query: str, params: Sequence,
+                chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[List[tuple]]:
+    """Recorre el resultado en bloques con fetchmany"""
+    cursor = conn.execute(query, params)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        yield rows
+
+
+def write_csv(path: str, columns: List[str], chunks: Iterator[List[tuple]]) -> int:
+    total = 0
+    with open(path, 'w', newline='', encoding='utf-8') as handle:
+        writer = csv.writer(handle)
+        writer.writerow(columns)
+        for rows in chunks:
+            writer.writerows(rows)
+            total += len(rows)
+    return total
+
+
+def write_jsonl(path: str, columns: List[str], chunks: Iterator[List[tuple]]) -> int:
+    total = 0
+    with open(path, 'w', encoding='utf-8') as handle:
+        for rows in chunks:
+            handle.writelines(
+                json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str) + '\n'
+                for row in rows
+            )
+            total += len(rows)
+    return total
+
+
+def arrow_schema(column_types: List[Tuple[str, str]]):
+    """Esquema de Arrow a partir de los tipos declarados en SQLite"""
+    import pyarrow as pa
+
+    fields = []
+    for name, declared in column_types:
+        if 'INT' in declared or 'BOOL' in declared:
+            arrow_type = pa.int64()
+        elif any(kind in declared for kind in ('REAL', 'FLOA', 'DOUB', 'NUMERIC')):
+            arrow_type = pa.float64()
+        elif 'BLOB' in declared:
+            arrow_type = pa.binary()
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(name, arrow_type))
+    return pa.schema(fields)
+
+
+def write_parquet(path: str, column_types: List[Tuple[str, str]], chunks: Iterator[List[tuple]],
+                  compression: str = 'zstd') -> int:
+    """Escribe un row group por bloque con compresión columnar"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("La exportación a Parquet requiere pyarrow (pip install pyarrow)")
+
+    schema = arrow_schema(column_types)
+    total = 0
+    with pq.ParquetWriter(path, schema, compression=compression) as writer:
+        for rows in chunks:
+            columns = list(zip(*rows))
+            arrays = [pa.array(values, type=field.type) for values, field in zip(columns, schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            total += len(rows)
+    return total
+
+
+def export_table(conn: sqlite3.Connection, table: str, path: str, fmt: str = 'csv',
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, **filters) -> int:
+    """Exporta una tabla filtrada a un archivo. Devuelve el número de filas"""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Formato no soportado: {fmt}")
+
+    query, params = build_export_query(table, **filters)
+    column_types = table_columns(conn, table)
+    columns = [name for name, _ in column_types]
+    chunks = iter_chunks(conn, query, params, chunk_size)
+
+    if fmt == 'csv':
+        return write_csv(path, columns, chunks)
+    if fmt == 'jsonl':
+        return write_jsonl(path, columns, chunks)
+    return write_parquet(path, column_types, chunks)
+
+
+def export_all(db_path: str, output_dir: str = 'exports', fmt: str = 'csv',
+               tables: Sequence[str] = EXPORT_TABLES, chunk_size: int = DEFAULT_CHUNK_SIZE,
+               **filters) -> Dict[str, Dict]:
+    """
+    Exporta búsquedas, historial y rollups a `output_dir`, un archivo por tabla.
+    Devuelve {tabla: {'path': ..., 'rows': ...}}.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    extension = {'csv': 'csv', 'jsonl': 'jsonl', 'parquet': 'parquet'}[fmt]
+
+    results = {}
+    conn = open_read_connection(db_path)
+    try:
+        for table in tables:
+            path = os.path.join(output_dir, f'{table}_{stamp}.{extension}')
+            rows = export_table(conn, table, path, fmt, chunk_size=chunk_size, **filters)
+            results[table] = {'path': path, 'rows': rows}
+    finally:
+        conn.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta búsquedas e historial de precios")
+    parser.add_argument("--db", default="flight_prices.db", help="Ruta a la base de datos SQLite")
+    parser.add_argument("--output", default="exports", help="Directorio de salida")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    parser.add_argument("--table", choices=EXPORT_TABLES, action="append",
+                        help="Tabla a exportar (por defecto todas)")
+    parser.add_argument("--origin", help="Filtrar por código de origen")
+    parser.add_argument("--destination", help="Filtrar por código de destino")
+    parser.add_argument("--since", help="Fecha mínima (YYYY-MM-DD)")
+    parser.add_argument("--until", help="Fecha máxima exclusiva (YYYY-MM-DD)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    results = export_all(
+        args.db, args.output, args.format,
+        tables=args.table or EXPORT_TABLES, chunk_size=args.chunk_size,
+        origin=args.origin, destination=args.destination,
+        since=args.since, until=args.until
+    )
+    for table, info in results.items():
+        print(f"{table}: {info['rows']} filas → {info['path']}")
+
+
+if __name__ == "__main__":
+    main()
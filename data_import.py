@@ -0,0 +1,296 @@
+"""
+Importación masiva de precios históricos
+Lee archivos CSV, JSON Lines o Parquet en bloques, valida cada bloque,
+asocia (o crea) las búsquedas correspondientes e inserta con executemany
+en transacciones por bloque.
+
+Columnas esperadas: origin, destination, departure_date, price, checked_at
+Opcionales: return_date, passengers, currency, airline, flight_details, source, search_name
+
+Uso como proceso independiente:
+    python data_import.py historico.csv --rebuild-indexes
+"""
+
+import argparse
+import csv
+import json
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+IMPORT_FORMATS = ('csv', 'jsonl', 'parquet')
+DEFAULT_CHUNK_SIZE = 5000
+MAX_REPORTED_ERRORS = 100
+
+TIMESTAMP_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d')
+
+
+class ImportValidationError(ValueError):
+    """Fila que no cumple el formato esperado"""
+
+
+def detect_format(path: str) -> str:
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    if extension in ('jsonl', 'ndjson'):
+        return 'jsonl'
+    if extension in ('parquet', 'pq'):
+        return 'parquet'
+    return 'csv'
+
+
+def iter_records(path: str, fmt: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[List[Dict]]:
+    """Lee el archivo en bloques de diccionarios sin cargarlo completo"""
+    if fmt == 'parquet':
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("La importación desde Parquet requiere pyarrow (pip install pyarrow)")
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunk_size):
+            yield batch.to_pylist()
+        return
+
+    with open(path, newline='', encoding='utf-8') as handle:
+        if fmt == 'csv':
+            records = csv.DictReader(handle)
+        else:
+            records = (json.loads(line) for line in handle if line.strip())
+        chunk = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def normalize_timestamp(value) -> str:
+    """Convierte fechas de entrada al formato de CURRENT_TIMESTAMP de SQLite"""
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    text = str(value or '').strip()
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(text[:19], fmt).strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            continue
+    raise ImportValidationError(f"checked_at inválido: {value!r}")
+
+
+def normalize_date(value, field: str, required: bool = True) -> Optional[str]:
+    if value is None or str(value).strip() == '':
+        if required:
+            raise ImportValidationError(f"{field} es obligatorio")
+        return None
+    text = str(value).strip()[:10]
+    try:
+        return datetime.strptime(text, '%Y-%m-%d').strftime('%Y-%m-%d')
+    except ValueError:
+        raise ImportValidationError(f"{field} inválido: {value!r}")
+
+
+def validate_record(record: Dict) -> Dict:
+    """Valida y normaliza una fila. Lanza ImportValidationError si no es válida"""
+    origin = str(record.get('origin') or '').strip().upper()
+    destination = str(record.get('destination') or '').strip().upper()
+    if not origin or not destination:
+        raise ImportValidationError("origin y destination son obligatorios")
+
+    try:
+        price = float(record.get('price'))
+    except (TypeError, ValueError):
+        raise ImportValidationError(f"price inválido: {record.get('price')!r}")
+    if price <= 0:
+        raise ImportValidationError(f"price debe ser positivo: {price}")
+
+    try:
+        passengers = int(record.get('passengers') or 1)
+    except (TypeError, ValueError):
+        raise ImportValidationError(f"passengers inválido: {record.get('passengers')!r}")
+
+    return {
+        'origin': origin,
+        'destination': destination,
+        'departure_date': normalize_date(record.get('departure_date'), 'departure_date'),
+        'return_date': normalize_date(record.get('return_date'), 'return_date', required=False),
+        'passengers': passengers,
+        'price': price,
+        'currency': record.get('currency') or 'USD',
+        'airline': record.get('airline') or None,
+        'flight_details': record.get('flight_details') or None,
+        'source': record.get('source') or None,
+        'checked_at': normalize_timestamp(record.get('checked_at')),
+        'search_name': record.get('search_name') or None,
+    }
+
+
+@contextmanager
+def bulk_load_mode(conn):
+    """
+    Elimina temporalmente los índices secundarios y el trigger de inserción
+    de price_history, y los recrea al terminar (una sola pasada de ordenación
+    en lugar de mantener los índices fila a fila).
+
+    Solo para cargas fuera de línea: mientras dura, la conexión mantiene un
+    bloqueo exclusivo sobre la base, de modo que ni la interfaz ni el worker
+    leen price_history sin índices ni escriben sin el trigger de generación.
+    Si otro proceso tiene la base abierta lanza RuntimeError.
+    """
+    conn.execute('PRAGMA locking_mode = EXCLUSIVE')
+    try:
+        conn.execute('BEGIN EXCLUSIVE')
+        conn.commit()
+    except sqlite3.OperationalError:
+        conn.execute('PRAGMA locking_mode = NORMAL')
+        raise RuntimeError("La carga con índices recreados necesita la base en uso exclusivo: "
+                           "detén la interfaz y el worker antes de importar")
+    try:
+        objects = conn.execute('''
+            SELECT type, name, sql FROM sqlite_master
+            WHERE tbl_name = 'price_history' AND sql IS NOT NULL
+              AND (type = 'index' OR (type = 'trigger' AND sql LIKE '%AFTER INSERT%'))
+        ''').fetchall()
+        with conn:
+            for object_type, name, _ in objects:
+                conn.execute(f'DROP {object_type.upper()} IF EXISTS {name}')
+        try:
+            yield
+        finally:
+            with conn:
+                for _, _, sql in objects:
+                    conn.execute(sql)
+                # Una sola invalidación de la caché de lecturas para toda la carga
+                conn.execute('UPDATE data_generation SET value = value + 1 WHERE id = 1')
+            conn.execute('ANALYZE price_history')
+    finally:
+        # El bloqueo exclusivo se libera en el siguiente acceso a la base
+        conn.execute('PRAGMA locking_mode = NORMAL')
+        conn.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchall()
+
+
+class SearchResolver:
+    """Asocia itinerarios a filas de flight_searches, creando las que falten"""
+
+    def __init__(self, conn, activate_new: bool = False):
+        self.conn = conn
+        self.activate_new = activate_new
+        self.created = 0
+        self.ids: Dict[tuple, int] = {}
+        rows = conn.execute('''
+            SELECT id, origin, destination, departure_date, return_date, passengers
+            FROM flight_searches ORDER BY id DESC
+        ''')
+        # ORDER BY id DESC: si hay duplicados se queda la búsqueda más antigua
+        for search_id, origin, destination, departure, return_date, passengers in rows:
+            self.ids[(origin, destination, departure, return_date, int(passengers or 1))] = search_id
+
+    def resolve(self, record: Dict) -> int:
+        key = (record['origin'], record['destination'], record['departure_date'],
+               record['return_date'], record['passengers'])
+        search_id = self.ids.get(key)
+        if search_id is None:
+            name = record['search_name'] or f"{record['origin']}→{record['destination']} {record['departure_date']}"
+            cursor = self.conn.execute('''
+                INSERT INTO flight_searches
+                (search_name, origin, destination, departure_date, return_date, passengers, is_active)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (name, key[0], key[1], key[2], key[3], key[4], 1 if self.activate_new else 0))
+            search_id = cursor.lastrowid
+            self.ids[key] = search_id
+            self.created += 1
+        return search_id
+
+
+def import_prices(monitor, path: str, fmt: Optional[str] = None,
+                  chunk_size: int = DEFAULT_CHUNK_SIZE, activate_new: bool = False,
+                  rebuild_indexes: bool = False) -> Dict:
+    """
+    Importa precios históricos desde un archivo.
+
+    Cada bloque se valida y se inserta en su propia transacción; las filas
+    inválidas se descartan y se reportan. Al terminar se recalculan los
+    agregados de search_stats de las búsquedas afectadas.
+
+    rebuild_indexes activa bulk_load_mode y solo debe usarse desde la línea
+    de comandos con la interfaz y el worker detenidos.
+    """
+    fmt = fmt or detect_format(path)
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError(f"Formato no soportado: {fmt}")
+
+    conn = monitor.get_connection()
+    report = {'rows_read': 0, 'rows_imported': 0, 'rows_rejected': 0,
+              'searches_created': 0, 'errors': []}
+    touched = set()
+    resolver = SearchResolver(conn, activate_new=activate_new)
+
+    def load():
+        for chunk in iter_records(path, fmt, chunk_size):
+            rows = []
+            for record in chunk:
+                report['rows_read'] += 1
+                try:
+                    rows.append(validate_record(record))
+                except ImportValidationError as e:
+                    report['rows_rejected'] += 1
+                    if len(report['errors']) < MAX_REPORTED_ERRORS:
+                        report['errors'].append(f"Fila {report['rows_read']}: {e}")
+
+            with conn:
+                params = []
+                for row in rows:
+                    search_id = resolver.resolve(row)
+                    touched.add(search_id)
+                    params.append((search_id, row['price'], row['currency'], row['airline'],
+                                   row['flight_details'], row['source'], row['checked_at']))
+                # Historial importado: no son consultas de este monitor a los proveedores
+                conn.executemany('''
+                    INSERT INTO price_history
+                    (search_id, price, currency, airline, flight_details, source, checked_at, provider_call)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, 0)
+                ''', params)
+            report['rows_imported'] += len(params)
+
+    if rebuild_indexes:
+        with bulk_load_mode(conn):
+            load()
+    else:
+        load()
+
+    if touched:
+        monitor.rebuild_search_stats(sorted(touched))
+    report['searches_created'] = resolver.created
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Importa precios históricos a price_history")
+    parser.add_argument("path", help="Archivo CSV, JSONL o Parquet")
+    parser.add_argument("--db", default="flight_prices.db", help="Ruta a la base de datos SQLite")
+    parser.add_argument("--format", choices=IMPORT_FORMATS, help="Formato (por defecto según la extensión)")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--activate", action="store_true",
+                        help="Marcar como activas las búsquedas creadas (se monitorearán)")
+    parser.add_argument("--rebuild-indexes", action="store_true",
+                        help="Eliminar índices durante la carga y recrearlos al final (cargas grandes; "
+                             "requiere la interfaz y el worker detenidos)")
+    args = parser.parse_args()
+
+    from flight_storage import FlightPriceMonitor
+    monitor = FlightPriceMonitor(db_path=args.db)
+    report = import_prices(monitor, args.path, fmt=args.format, chunk_size=args.chunk_size,
+                           activate_new=args.activate, rebuild_indexes=args.rebuild_indexes)
+
+    print(f"Filas leídas: {report['rows_read']}")
+    print(f"Filas importadas: {report['rows_imported']}")
+    print(f"Filas rechazadas: {report['rows_rejected']}")
+    print(f"Búsquedas creadas: {report['searches_created']}")
+    for error in report['errors']:
+        print(f"  {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,77 +1,521 @@
 """
 Conector para APIs reales de vuelos
 Integra Amadeus, Skyscanner y otras APIs
+
+Núcleo sin dependencias de Streamlit: informa mediante resultados
+estructurados (SearchOutcome) y eventos (ConnectorEvent) que se envían al
+logger y a un hook opcional. El adaptador para la interfaz está en
+flight_api_streamlit.py.
 """
 
 import requests
-import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import copy
+import hashlib
 import json
+import logging
+import os
+import sqlite3
+import threading
 import time
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional
-import random
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlparse
+
+from flight_cache import get_response_cache
+from flight_metrics import increment, observe, timed
+from flight_simulation import SIMULATION_SOURCE, FlightSimulator, get_simulator
+from flight_offers import (FlightOffer, describe_stops, offers_from_amadeus, offers_from_skyscanner,
+                           select_offers)
+
+logger = logging.getLogger(__name__)
+
+# Modos de búsqueda entre proveedores
+SEARCH_MODE_SEQUENTIAL = 'sequential'  # Uno tras otro, primer resultado válido
+SEARCH_MODE_FIRST = 'first'            # Todos a la vez, primer resultado válido
+SEARCH_MODE_CHEAPEST = 'cheapest'      # Todos a la vez, el más barato antes del plazo
+
+AMADEUS_HOST = "test.api.amadeus.com"
+SKYSCANNER_HOST = "skyscanner-skyscanner-flight-search-v1.p.rapidapi.com"
+# URLs base por defecto; configurables (AMADEUS_BASE_URL / SKYSCANNER_BASE_URL) para
+# apuntar a un servidor local como mock_providers.py
+AMADEUS_BASE_URL = f"https://{AMADEUS_HOST}"
+SKYSCANNER_BASE_URL = f"https://{SKYSCANNER_HOST}"
+
+# Tamaño máximo de una matriz de fechas flexibles (combinaciones salida/regreso)
+MAX_DATE_MATRIX_CELLS = 150
+
+def build_date_pairs(departure_start, departure_end, return_start=None, return_end=None,
+                     min_stay: int = 1) -> List[Tuple[str, Optional[str]]]:
+    """
+    Combinaciones (salida, regreso) de dos ventanas de fechas, en formato ISO.
+    Sin ventana de regreso devuelve solo idas; descarta regresos a menos de
+    `min_stay` días de la salida.
+    """
+    def as_date(value):
+        if isinstance(value, datetime):
+            return value.date()
+        return value if isinstance(value, date) else datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+
+    def date_range(start, end):
+        start, end = as_date(start), as_date(end)
+        return [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+
+    departures = date_range(departure_start, departure_end)
+    if return_start is None:
+        pairs = [(departure.isoformat(), None) for departure in departures]
+    else:
+        returns = date_range(return_start, return_end or return_start)
+        pairs = [(departure.isoformat(), return_date.isoformat())
+                 for departure in departures for return_date in returns
+                 if (return_date - departure).days >= min_stay]
+    
+    if len(pairs) > MAX_DATE_MATRIX_CELLS:
+        raise ValueError(f"La matriz tiene {len(pairs)} combinaciones (máximo {MAX_DATE_MATRIX_CELLS})")
+    return pairs
+
+# Sesiones HTTP compartidas por todo el proceso, una por host de proveedor
+_http_sessions: Dict[str, requests.Session] = {}
+_http_sessions_lock = threading.Lock()
+
+def get_http_session(host: str, pool_size: int = 10, max_retries: int = 3,
+                     backoff_factor: float = 0.5) -> requests.Session:
+    """
+    Devuelve la sesión keep-alive del proceso para un host.
+    
+    Reutiliza conexiones TCP+TLS entre llamadas y reintenta con backoff
+    exponencial ante 429/5xx (respetando Retry-After).
+    """
+    session = _http_sessions.get(host)
+    if session is not None:
+        return session
+    
+    with _http_sessions_lock:
+        session = _http_sessions.get(host)
+        if session is None:
+            retry = Retry(
+                total=max_retries,
+                backoff_factor=backoff_factor,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset(['GET', 'POST']),
+                respect_retry_after_header=True,
+                raise_on_status=False
+            )
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                                  max_retries=retry, pool_block=False)
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _http_sessions[host] = session
+    return session
+
+def close_http_sessions():
+    """Cierra todas las sesiones HTTP compartidas"""
+    with _http_sessions_lock:
+        for session in _http_sessions.values():
+            session.close()
+        _http_sessions.clear()
+
+class SharedTokenCache:
+    """
+    Caché de tokens OAuth compartida entre sesiones, hilos y procesos.
+    
+    - En memoria para el proceso, respaldada por una tabla SQLite para otros workers.
+    - Single-flight: N peticiones concurrentes con el token vencido provocan una
+      sola solicitud (lock del hilo + transacción IMMEDIATE entre procesos).
+    - Usa el `expires_in` devuelto por el servidor y renueva en segundo plano
+      antes del vencimiento si el token se ha usado desde la última renovación.
+    """
+    
+    def __init__(self, key: str, store_path: str = "flight_tokens.db",
+                 expiry_margin: float = 60.0, refresh_ahead: float = 300.0):
+        self.key = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        self.store_path = store_path
+        self.expiry_margin = expiry_margin
+        self.refresh_ahead = refresh_ahead
+        
+        self.token: Optional[str] = None
+        self.expires_at = 0.0
+        self.fetch_count = 0
+        self._fetcher = None
+        self._last_used = 0.0
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._refresh_timer: Optional[threading.Timer] = None
+        self._init_store()
+    
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.store_path, timeout=30, isolation_level=None)
+        return conn
+    
+    def _init_store(self):
+        try:
+            # Los tokens dan acceso a la API: archivo legible solo por el usuario
+            if not os.path.exists(self.store_path):
+                os.close(os.open(self.store_path, os.O_CREAT | os.O_WRONLY, 0o600))
+            os.chmod(self.store_path, 0o600)
+            conn = self._connect()
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS oauth_tokens (
+                    cache_key TEXT PRIMARY KEY,
+                    access_token TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            conn.close()
+        except (sqlite3.Error, OSError):
+            # Sin almacén en disco la caché sigue funcionando en memoria
+            self.store_path = None
+    
+    def _is_valid(self, expires_at: float) -> bool:
+        return time.time() < expires_at - self.expiry_margin
+    
+    def _read_store(self, conn: sqlite3.Connection):
+        row = conn.execute(
+            'SELECT access_token, expires_at FROM oauth_tokens WHERE cache_key = ?',
+            (self.key,)
+        ).fetchone()
+        if row and self._is_valid(row[1]):
+            self.token, self.expires_at = row
+            return True
+        return False
+    
+    def get_token(self, fetcher) -> Optional[str]:
+        """
+        Devuelve un token válido. `fetcher` es una función sin argumentos que
+        devuelve (access_token, expires_in) o None si falla.
+        """
+        self._fetcher = fetcher
+        self._last_used = time.time()
+        
+        # Camino rápido sin bloqueo
+        if self.token and self._is_valid(self.expires_at):
+            return self.token
+        
+        with self._lock:
+            if self.token and self._is_valid(self.expires_at):
+                return self.token
+            return self._refresh(fetcher)
+    
+    def _refresh(self, fetcher, force: bool = False) -> Optional[str]:
+        """Obtiene un token nuevo; debe llamarse con self._lock adquirido"""
+        conn = None
+        if self.store_path:
+            try:
+                conn = self._connect()
+                # Bloqueo de escritura: otros procesos esperan y reutilizan el token
+                conn.execute('BEGIN IMMEDIATE')
+                if not force and self._read_store(conn):
+                    conn.execute('COMMIT')
+                    conn.close()
+                    self._schedule_refresh()
+                    return self.token
+            except sqlite3.Error:
+                if conn is not None:
+                    conn.close()
+                conn = None
+        
+        try:
+            result = fetcher()
+            if result:
+                access_token, expires_in = result
+                self.token = access_token
+                self.expires_at = time.time() + float(expires_in)
+                self._fetched_at = time.time()
+                self.fetch_count += 1
+                if conn is not None:
+                    conn.execute('''
+                        INSERT OR REPLACE INTO oauth_tokens (cache_key, access_token, expires_at)
+                        VALUES (?, ?, ?)
+                    ''', (self.key, self.token, self.expires_at))
+                self._schedule_refresh()
+                return self.token
+            return None
+        finally:
+            if conn is not None:
+                try:
+                    conn.execute('COMMIT')
+                except sqlite3.Error:
+                    pass
+                conn.close()
+    
+    def _schedule_refresh(self):
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
+        lifetime = self.expires_at - time.time()
+        ahead = min(self.refresh_ahead, lifetime / 5)
+        delay = lifetime - ahead
+        if delay <= 0:
+            return
+        self._refresh_timer = threading.Timer(delay, self._background_refresh)
+        self._refresh_timer.daemon = True
+        self._refresh_timer.start()
+    
+    def _background_refresh(self):
+        # Solo renovar si el token se usó desde la última renovación
+        if self._fetcher is None or self._last_used <= self._fetched_at:
+            return
+        with self._lock:
+            # Otro proceso pudo haberlo renovado ya: el almacén se consulta primero
+            if self.store_path:
+                try:
+                    conn = self._connect()
+                    fresh = self._read_store(conn) and self.expires_at - time.time() > self.refresh_ahead
+                    conn.close()
+                    if fresh:
+                        self._schedule_refresh()
+                        return
+                except sqlite3.Error:
+                    pass
+            self._refresh(self._fetcher, force=True)
+    
+    def invalidate(self):
+        """Descarta el token actual (p. ej. tras un 401)"""
+        with self._lock:
+            self.token = None
+            self.expires_at = 0.0
+            if self.store_path:
+                try:
+                    conn = self._connect()
+                    conn.execute('DELETE FROM oauth_tokens WHERE cache_key = ?', (self.key,))
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+
+
+_token_caches: Dict[Tuple[str, str], SharedTokenCache] = {}
+_token_caches_lock = threading.Lock()
+
+def get_token_cache(client_id: str, store_path: str = "flight_tokens.db") -> SharedTokenCache:
+    """Caché de tokens del proceso para unas credenciales y un almacén en disco"""
+    key = (client_id, os.path.abspath(store_path))
+    with _token_caches_lock:
+        cache = _token_caches.get(key)
+        if cache is None:
+            cache = SharedTokenCache(client_id, store_path=store_path)
+            _token_caches[key] = cache
+        return cache
+
+def env_secret(key: str, default=None):
+    """Lee un secreto de las variables de entorno"""
+    return os.getenv(key, default)
+
+
+# Niveles de los eventos del conector (coinciden con st.info/success/warning/error)
+EVENT_LOG_LEVELS = {
+    'info': logging.INFO,
+    'success': logging.INFO,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+}
+
+
+class ConnectorEvent(NamedTuple):
+    """Aviso del conector: nivel, código estable, mensaje para el usuario y proveedor"""
+    level: str
+    code: str
+    message: str
+    provider: Optional[str] = None
+
+
+class ProviderAttempt(NamedTuple):
+    """
+    Resultado de consultar un proveedor: 'ok', 'no_results', 'rate_limited',
+    'http_error', 'timeout', 'cancelled' (descartado en modo 'first')...
+    """
+    provider: str
+    status: str
+    elapsed: float
+    detail: Optional[str] = None
+
+
+class SearchOutcome(NamedTuple):
+    """Resultado de una búsqueda con el detalle de cada proveedor consultado"""
+    result: Optional[Dict]
+    attempts: Tuple[ProviderAttempt, ...] = ()
+    cached: bool = False
+    simulated: bool = False
+
 
 class FlightAPIConnector:
-    def __init__(self):
+    """
+    Cliente de los proveedores de vuelos.
+    
+    Las credenciales se leen una sola vez al construirlo con `secret_getter`
+    (por defecto variables de entorno). Los avisos se emiten como
+    ConnectorEvent al logger del módulo y a `on_event` si se indica.
+    """
+    
+    def __init__(self, search_mode: str = SEARCH_MODE_SEQUENTIAL, search_deadline: float = 20.0,
+                 pool_size: int = 10, max_retries: int = 3,
+                 connect_timeout: float = 3.05, read_timeout: float = 15.0,
+                 use_cache: bool = True, rate_limit_timeout: Optional[float] = 0,
+                 secret_getter: Optional[Callable] = None,
+                 on_event: Optional[Callable[[ConnectorEvent], None]] = None,
+                 simulator: Optional[FlightSimulator] = None, simulate_provider: bool = False,
+                 amadeus_base_url: Optional[str] = None, skyscanner_base_url: Optional[str] = None):
+        self.secret_getter = secret_getter or env_secret
+        self.on_event = on_event
+        # Eventos capturados por hilo durante la consulta a un proveedor
+        self._local = threading.local()
+        
+        # Credenciales resueltas una vez
+        self.amadeus_api_key = self.get_secret("AMADEUS_API_KEY")
+        self.amadeus_api_secret = self.get_secret("AMADEUS_API_SECRET")
+        self.rapidapi_key = self.get_secret("RAPIDAPI_KEY")
+        self.token_cache_path = self.get_secret("TOKEN_CACHE_PATH", "flight_tokens.db")
+        self.amadeus_base_url = (amadeus_base_url or self.get_secret("AMADEUS_BASE_URL")
+                                 or AMADEUS_BASE_URL).rstrip('/')
+        self.skyscanner_base_url = (skyscanner_base_url or self.get_secret("SKYSCANNER_BASE_URL")
+                                    or SKYSCANNER_BASE_URL).rstrip('/')
+        # Host de cada proveedor: clave de su sesión HTTP compartida
+        self.amadeus_host = urlparse(self.amadeus_base_url).netloc
+        self.skyscanner_host = urlparse(self.skyscanner_base_url).netloc
+        
+        # Simulador para el fallback y, con simulate_provider, como un proveedor más
+        # (pruebas de carga sin red ni consumo de cuota)
+        seed = self.get_secret("SIMULATION_SEED")
+        self.simulator = simulator or get_simulator(int(seed) if seed not in (None, '') else None)
+        self.simulate_provider = simulate_provider
+        
         self.amadeus_token = None
         self.amadeus_token_expires = None
+        self.search_mode = search_mode
+        # Plazo máximo (segundos) para los modos concurrentes
+        self.search_deadline = search_deadline
+        # Configuración del pool HTTP compartido
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.timeout = (connect_timeout, read_timeout)
+        # Espera máxima por cupo del limitador (0 = no bloquear, None = sin límite)
+        self.rate_limit_timeout = rate_limit_timeout
+        self.rate_limit_usage_path = None
+        # Caché de respuestas compartida por el proceso (None para desactivarla),
+        # con nivel en disco opcional que sobrevive reinicios
+        self.cache = get_response_cache(db_path=self.get_secret("RESPONSE_CACHE_PATH")) if use_cache else None
+    
+    def acquire_rate_limit(self, provider: str) -> bool:
+        """
+        Consume un token del limitador del proveedor. Si no hay cupo devuelve
+        False para pasar al siguiente proveedor (o a la caché/simulación).
+        """
+        limiter = get_rate_limiter(provider, usage_path=self.rate_limit_usage_path,
+                                   host=self.custom_host(provider))
+        with timed('flight_rate_limit_wait_seconds', provider=provider):
+            acquired = limiter.acquire(timeout=self.rate_limit_timeout)
+        if acquired:
+            return True
+        if limiter.month_budget_left() == 0:
+            self.emit('warning', 'budget_exhausted',
+                      f"⚠️ {provider}: presupuesto mensual de consultas agotado", provider)
+        else:
+            self.emit('warning', 'rate_limited',
+                      f"⚠️ {provider}: límite de consultas por minuto alcanzado", provider)
+        return False
+    
+    def get_session(self, host: str) -> requests.Session:
+        """Sesión HTTP con keep-alive compartida para el host del proveedor"""
+        return get_http_session(host, pool_size=self.pool_size, max_retries=self.max_retries)
         
+    def custom_host(self, provider: str) -> Optional[str]:
+        """Host del proveedor si no es el servidor oficial (p. ej. un mock local), o None"""
+        if provider == 'Amadeus' and self.amadeus_base_url != AMADEUS_BASE_URL:
+            return self.amadeus_host
+        if provider == 'Skyscanner' and self.skyscanner_base_url != SKYSCANNER_BASE_URL:
+            return self.skyscanner_host
+        return None
+    
+    @property
+    def cache_namespace(self) -> str:
+        """Espacio de la caché de respuestas: los servidores no oficiales no comparten entradas"""
+        return ','.join(f"{provider}@{self.custom_host(provider)}"
+                        for provider in ('Amadeus', 'Skyscanner') if self.custom_host(provider))
+    
+    def get_amadeus_token_cache(self) -> SharedTokenCache:
+        """Caché del token de Amadeus; un servidor distinto del oficial tiene su propia entrada"""
+        client_id = self.amadeus_api_key
+        host = self.custom_host('Amadeus')
+        if host:
+            client_id = f"{client_id}@{host}"
+        return get_token_cache(client_id, self.token_cache_path)
+    
     def get_secret(self, key: str, default=None):
-        """Obtiene secretos de Streamlit Cloud o variables de entorno"""
-        try:
-            return st.secrets[key]
-        except (KeyError, FileNotFoundError):
-            import os
-            return os.getenv(key, default)
+        """Obtiene un secreto con el `secret_getter` del conector"""
+        return self.secret_getter(key, default)
+    
+    def emit(self, level: str, code: str, message: str, provider: Optional[str] = None):
+        """Envía un evento al logger, a la captura del hilo actual y al hook"""
+        event = ConnectorEvent(level, code, message, provider)
+        logger.log(EVENT_LOG_LEVELS.get(level, logging.INFO), message)
+        if provider and level in ('warning', 'error'):
+            increment('flight_provider_errors_total', provider=provider, code=code)
+        captured = getattr(self._local, 'events', None)
+        if captured is not None:
+            captured.append(event)
+        if self.on_event is not None:
+            try:
+                self.on_event(event)
+            except Exception:
+                logger.exception("Error en el hook de eventos del conector")
     
     def get_amadeus_token(self) -> Optional[str]:
-        """Obtiene token de acceso de Amadeus API"""
+        """Obtiene token de acceso de Amadeus API (compartido por todo el proceso)"""
         try:
-            # Verificar si el token actual sigue siendo válido
-            if (self.amadeus_token and self.amadeus_token_expires and 
-                datetime.now() < self.amadeus_token_expires):
-                return self.amadeus_token
-            
-            # Obtener credenciales
-            api_key = self.get_secret("AMADEUS_API_KEY")
-            api_secret = self.get_secret("AMADEUS_API_SECRET")
+            api_key = self.amadeus_api_key
+            api_secret = self.amadeus_api_secret
             
             if not api_key or not api_secret:
                 return None
             
-            # Solicitar nuevo token
-            auth_url = "https://test.api.amadeus.com/v1/security/oauth2/token"
-            auth_data = {
-                'grant_type': 'client_credentials',
-                'client_id': api_key,
-                'client_secret': api_secret
-            }
-            
-            response = requests.post(auth_url, data=auth_data, timeout=10)
+            cache = self.get_amadeus_token_cache()
+            fetched = []
+            token = cache.get_token(lambda: fetched.append(True) or self.request_amadeus_token(api_key, api_secret))
+            increment('flight_cache_requests_total', cache='token', result='miss' if fetched else 'hit')
             
-            if response.status_code == 200:
-                token_data = response.json()
-                self.amadeus_token = token_data['access_token']
-                # Token válido por 30 minutos, renovar 5 minutos antes
-                self.amadeus_token_expires = datetime.now() + timedelta(minutes=25)
-                return self.amadeus_token
-            else:
-                st.error(f"Error autenticando con Amadeus: {response.status_code}")
-                return None
+            self.amadeus_token = token
+            self.amadeus_token_expires = datetime.fromtimestamp(cache.expires_at) if token else None
+            return token
                 
         except Exception as e:
-            st.error(f"Error obteniendo token Amadeus: {str(e)}")
+            self.emit('error', 'auth_error', f"Error obteniendo token Amadeus: {str(e)}", 'Amadeus')
+            return None
+    
+    def request_amadeus_token(self, api_key: str, api_secret: str) -> Optional[tuple]:
+        """Solicita un token nuevo a Amadeus. Devuelve (token, expires_in)"""
+        auth_url = f"{self.amadeus_base_url}/v1/security/oauth2/token"
+        auth_data = {
+            'grant_type': 'client_credentials',
+            'client_id': api_key,
+            'client_secret': api_secret
+        }
+        
+        with timed('flight_token_fetch_seconds', provider='Amadeus'):
+            response = self.get_session(self.amadeus_host).post(
+                auth_url, data=auth_data, timeout=(self.timeout[0], 10))
+        
+        if response.status_code == 200:
+            token_data = response.json()
+            # Amadeus devuelve expires_in en segundos (normalmente 1799)
+            return token_data['access_token'], token_data.get('expires_in', 1799)
+        else:
+            self.emit('error', 'auth_error', f"Error autenticando con Amadeus: {response.status_code}", 'Amadeus')
             return None
     
     def search_flights_amadeus(self, search_data: Dict) -> Optional[Dict]:
         """Busca vuelos usando Amadeus API"""
         try:
+            # Autenticar antes de consumir cupo: un fallo de credenciales no gasta presupuesto
             token = self.get_amadeus_token()
             if not token:
                 return None
             
+            if not self.acquire_rate_limit('Amadeus'):
+                return None
+            
             # Configurar búsqueda
-            search_url = "https://test.api.amadeus.com/v2/shopping/flight-offers"
+            search_url = f"{self.amadeus_base_url}/v2/shopping/flight-offers"
             headers = {
                 'Authorization': f'Bearer {token}',
                 'Content-Type': 'application/json'
@@ -90,58 +534,54 @@ class FlightAPIConnector:
             if search_data.get('return_date'):
                 params['returnDate'] = search_data['return_date']
             
-            response = requests.get(search_url, headers=headers, params=params, timeout=15)
+            response = self.get_session(self.amadeus_host).get(
+                search_url, headers=headers, params=params, timeout=self.timeout)
             
             if response.status_code == 200:
-                data = response.json()
+                with timed('flight_json_parse_seconds', provider='Amadeus'):
+                    data = response.json()
                 
                 if 'data' in data and len(data['data']) > 0:
-                    # Encontrar la oferta más barata
+                    # Todas las ofertas, ordenadas por precio
+                    offers = offers_from_amadeus(data['data'], self.get_airline_name)
+                    if not offers:
+                        return None
+                    cheapest = offers[0]
                     cheapest_offer = min(data['data'], 
                                        key=lambda x: float(x['price']['total']))
                     
-                    # Extraer información del vuelo
-                    price = float(cheapest_offer['price']['total'])
-                    currency = cheapest_offer['price']['currency']
-                    
-                    # Información de la aerolínea
-                    airline_code = cheapest_offer['itineraries'][0]['segments'][0]['carrierCode']
-                    airline_name = self.get_airline_name(airline_code)
-                    
-                    # Detalles del vuelo
-                    segments = cheapest_offer['itineraries'][0]['segments']
-                    stops = len(segments) - 1
-                    
-                    if stops == 0:
-                        flight_details = "Vuelo directo"
-                    else:
-                        flight_details = f"{stops} escala{'s' if stops > 1 else ''}"
-                    
                     return {
-                        'price': price,
-                        'currency': currency,
-                        'airline': airline_name,
-                        'flight_details': flight_details,
+                        'price': cheapest.price,
+                        'currency': cheapest.currency,
+                        'airline': cheapest.carrier,
+                        'flight_details': describe_stops(cheapest.stops),
                         'source': 'Amadeus',
+                        'offers': offers,
                         'raw_data': cheapest_offer
                     }
                 else:
                     return None
             else:
-                st.warning(f"Amadeus API error: {response.status_code}")
+                if response.status_code == 401:
+                    # Token revocado o vencido antes de tiempo: forzar renovación
+                    self.get_amadeus_token_cache().invalidate()
+                self.emit('warning', 'http_error', f"Amadeus API error: {response.status_code}", 'Amadeus')
                 return None
                 
         except Exception as e:
-            st.error(f"Error buscando vuelos en Amadeus: {str(e)}")
+            self.emit('error', 'exception', f"Error buscando vuelos en Amadeus: {str(e)}", 'Amadeus')
             return None
     
     def search_flights_skyscanner(self, search_data: Dict) -> Optional[Dict]:
         """Busca vuelos usando Skyscanner via RapidAPI"""
         try:
-            rapidapi_key = self.get_secret("RAPIDAPI_KEY")
+            rapidapi_key = self.rapidapi_key
             if not rapidapi_key:
                 return None
             
+            if not self.acquire_rate_limit('Skyscanner'):
+                return None
+            
             # Configurar búsqueda
             country = "US"
             currency = "USD"
@@ -152,7 +592,7 @@ class FlightAPIConnector:
             departure_date = search_data['departure_date']
             
             # URL para búsqueda de citas
-            url = f"https://skyscanner-skyscanner-flight-search-v1.p.rapidapi.com/apiservices/browsequotes/v1.0/{country}/{currency}/{locale}/{origin}/{destination}/{departure_date}"
+            url = f"{self.skyscanner_base_url}/apiservices/browsequotes/v1.0/{country}/{currency}/{locale}/{origin}/{destination}/{departure_date}"
             
             # Añadir fecha de regreso si existe
             if search_data.get('return_date'):
@@ -160,55 +600,41 @@ class FlightAPIConnector:
             
             headers = {
                 "X-RapidAPI-Key": rapidapi_key,
-                "X-RapidAPI-Host": "skyscanner-skyscanner-flight-search-v1.p.rapidapi.com"
+                "X-RapidAPI-Host": SKYSCANNER_HOST
             }
             
-            response = requests.get(url, headers=headers, timeout=15)
+            response = self.get_session(self.skyscanner_host).get(url, headers=headers, timeout=self.timeout)
             
             if response.status_code == 200:
-                data = response.json()
+                with timed('flight_json_parse_seconds', provider='Skyscanner'):
+                    data = response.json()
                 
                 if 'Quotes' in data and len(data['Quotes']) > 0:
-                    # Encontrar la cita más barata
+                    # Todas las citas, ordenadas por precio
+                    offers = offers_from_skyscanner(data, currency)
+                    if not offers:
+                        return None
+                    cheapest = offers[0]
                     cheapest_quote = min(data['Quotes'], 
                                        key=lambda x: x['MinPrice'])
                     
-                    price = cheapest_quote['MinPrice']
-                    
-                    # Obtener información de la aerolínea
-                    carrier_id = cheapest_quote['OutboundLeg']['CarrierIds'][0]
-                    airline_name = "Aerolínea"
-                    
-                    # Buscar nombre de aerolínea en carriers
-                    if 'Carriers' in data:
-                        for carrier in data['Carriers']:
-                            if carrier['CarrierId'] == carrier_id:
-                                airline_name = carrier['Name']
-                                break
-                    
-                    # Información de escalas
-                    stops = len(cheapest_quote['OutboundLeg'].get('StopIds', [])) 
-                    if stops == 0:
-                        flight_details = "Vuelo directo"
-                    else:
-                        flight_details = f"{stops} escala{'s' if stops > 1 else ''}"
-                    
                     return {
-                        'price': price,
+                        'price': cheapest.price,
                         'currency': currency,
-                        'airline': airline_name,
-                        'flight_details': flight_details,
+                        'airline': cheapest.carrier,
+                        'flight_details': describe_stops(cheapest.stops),
                         'source': 'Skyscanner',
+                        'offers': offers,
                         'raw_data': cheapest_quote
                     }
                 else:
                     return None
             else:
-                st.warning(f"Skyscanner API error: {response.status_code}")
+                self.emit('warning', 'http_error', f"Skyscanner API error: {response.status_code}", 'Skyscanner')
                 return None
                 
         except Exception as e:
-            st.error(f"Error buscando vuelos en Skyscanner: {str(e)}")
+            self.emit('error', 'exception', f"Error buscando vuelos en Skyscanner: {str(e)}", 'Skyscanner')
             return None
     
     def get_airline_name(self, airline_code: str) -> str:
@@ -227,182 +653,479 @@ class FlightAPIConnector:
             'AS': 'Alaska Airlines',
             'HA': 'Hawaiian Airlines',
             'G4': 'Allegiant Air',
-            'SY': 'Sun Country Airlines'
+            'SY': 'Sun Country Airlines',
+            'CM': 'Copa Airlines'
         }
         return airline_codes.get(airline_code, f"Aerolínea {airline_code}")
     
     def simulate_flight_search(self, search_data: Dict) -> Dict:
-        """Simulación mejorada de búsqueda de vuelos"""
-        # Factores realistas para simulación
-        base_prices = {
-            ('BOG', 'MIA'): 350,
-            ('BOG', 'JFK'): 450,
-            ('BOG', 'LAX'): 550,
-            ('MDE', 'MIA'): 320,
-            ('CLO', 'BOG'): 150,
-            ('CTG', 'BOG'): 180,
-        }
+        """Resultado del simulador del conector (reproducible para su semilla)"""
+        return self.simulator.search(search_data)
+    
+    def get_available_apis(self) -> List:
+        """Lista de (nombre, función) de las APIs configuradas, en orden de preferencia"""
+        apis = []
         
-        route = (search_data['origin'], search_data['destination'])
-        reverse_route = (search_data['destination'], search_data['origin'])
+        if self.amadeus_api_key and self.amadeus_api_secret:
+            apis.append(('Amadeus', self.search_flights_amadeus))
         
-        # Precio base
-        if route in base_prices:
-            base_price = base_prices[route]
-        elif reverse_route in base_prices:
-            base_price = base_prices[reverse_route]
-        else:
-            # Estimar basado en distancia aproximada
-            base_price = random.randint(200, 800)
-        
-        # Factores de variación
-        departure_date = datetime.strptime(search_data['departure_date'], '%Y-%m-%d')
-        days_ahead = (departure_date - datetime.now()).days
-        
-        # Factor de anticipación
-        if days_ahead < 7:
-            price_factor = 1.4  # Más caro último momento
-        elif days_ahead > 90:
-            price_factor = 0.9  # Más barato con anticipación
-        else:
-            price_factor = 1.0
+        if self.rapidapi_key:
+            apis.append(('Skyscanner', self.search_flights_skyscanner))
         
-        # Factor día de la semana
-        weekday = departure_date.weekday()
-        if weekday in [4, 5, 6]:  # Viernes, sábado, domingo
-            price_factor *= 1.15
+        if self.simulate_provider:
+            apis.append((SIMULATION_SOURCE, self.simulator.search))
         
-        # Factor temporada
-        month = departure_date.month
-        if month in [12, 1, 6, 7]:  # Temporada alta
-            price_factor *= 1.25
-        
-        # Variación aleatoria
-        price_factor *= random.uniform(0.85, 1.15)
+        return apis
+    
+    def search_flights(self, search_data: Dict, mode: Optional[str] = None,
+                       use_cache: bool = True) -> Dict:
+        """Método principal que intenta múltiples APIs y fallback a simulación"""
+        return self.search_flights_detailed(search_data, mode, use_cache).result
+    
+    def search_flights_detailed(self, search_data: Dict, mode: Optional[str] = None,
+                                use_cache: bool = True) -> SearchOutcome:
+        """Como search_flights, pero indica el origen del resultado y cada intento por proveedor"""
+        if use_cache and self.cache is not None:
+            cached = self.cache.get(search_data, self.cache_namespace)
+            increment('flight_cache_requests_total', cache='response', result='hit' if cached else 'miss')
+            if cached:
+                cached['cached'] = True
+                self.emit('info', 'cache_hit', f"⚡ Resultado en caché de {cached.get('source', 'API')}")
+                increment('flight_search_results_total', origin='cache')
+                return SearchOutcome(cached, cached=True)
         
-        final_price = base_price * price_factor
+        outcome = self.search_providers_detailed(search_data, mode)
+        if outcome.result:
+            if self.cache is not None:
+                self.cache.put(search_data, outcome.result, self.cache_namespace)
+            increment('flight_search_results_total', origin='provider')
+            return outcome
         
-        airlines = [
-            'Avianca', 'LATAM Airlines', 'Viva Air', 'American Airlines', 
-            'Delta Air Lines', 'United Airlines', 'JetBlue Airways', 'Copa Airlines'
-        ]
+        # Si todas las APIs fallan, usar simulación
+        self.emit('info', 'simulated', "🎮 Usando datos simulados (APIs no disponibles)")
+        increment('flight_search_results_total', origin='simulated')
+        return SearchOutcome(self.simulate_flight_search(search_data), outcome.attempts, simulated=True)
+    
+    def search_providers(self, search_data: Dict, mode: Optional[str] = None) -> Optional[Dict]:
+        """Consulta las APIs configuradas según el modo de búsqueda, sin caché ni simulación"""
+        return self.search_providers_detailed(search_data, mode).result
+    
+    def call_provider(self, api_name: str, api_function: Callable,
+                      search_data: Dict) -> Tuple[Optional[Dict], ProviderAttempt]:
+        """Consulta un proveedor y resume el resultado a partir de los eventos que emite"""
+        self._local.events = events = []
+        started = time.monotonic()
+        try:
+            result = api_function(search_data)
+        except Exception as e:
+            self.emit('warning', 'exception', f"⚠️ Error en {api_name}: {str(e)}", api_name)
+            result = None
+        finally:
+            self._local.events = None
+        elapsed = time.monotonic() - started
         
-        # Probabilidad de escalas
-        if random.random() < 0.3:
-            flight_details = "Vuelo directo"
+        if result:
+            attempt = ProviderAttempt(api_name, 'ok', elapsed)
         else:
-            stops = random.choice([1, 1, 2])  # Más probable 1 escala
-            flight_details = f"{stops} escala{'s' if stops > 1 else ''}"
+            problem = next((event for event in reversed(events) if event.level in ('warning', 'error')), None)
+            if problem is None:
+                self.emit('warning', 'no_results', f"⚠️ {api_name}: No se encontraron vuelos", api_name)
+                attempt = ProviderAttempt(api_name, 'no_results', elapsed)
+            else:
+                attempt = ProviderAttempt(api_name, problem.code, elapsed, problem.message)
+        observe('flight_provider_call_seconds', elapsed, provider=api_name)
+        increment('flight_provider_calls_total', provider=api_name, status=attempt.status)
+        return result, attempt
+    
+    def search_providers_detailed(self, search_data: Dict, mode: Optional[str] = None) -> SearchOutcome:
+        """Como search_providers, con el detalle de cada proveedor consultado"""
+        mode = mode or self.search_mode
+        apis_to_try = self.get_available_apis()
+        
+        if len(apis_to_try) > 1 and mode in (SEARCH_MODE_FIRST, SEARCH_MODE_CHEAPEST):
+            outcome = self.search_flights_concurrent_detailed(search_data, apis_to_try, mode)
+            if outcome.result:
+                self.emit('success', 'found', f"✅ Datos obtenidos de {outcome.result['source']}",
+                          outcome.result['source'])
+            return outcome
+        
+        # Intentar cada API disponible
+        attempts = []
+        for api_name, api_function in apis_to_try:
+            self.emit('info', 'searching', f"🔍 Buscando en {api_name}...", api_name)
+            result, attempt = self.call_provider(api_name, api_function, search_data)
+            attempts.append(attempt)
+            if result:
+                self.emit('success', 'found', f"✅ Datos obtenidos de {api_name}", api_name)
+                return SearchOutcome(result, tuple(attempts))
+        
+        return SearchOutcome(None, tuple(attempts))
+    
+    def split_date_matrix(self, origin: str, destination: str,
+                          date_pairs: List[Tuple[str, Optional[str]]],
+                          passengers: int = 1) -> Tuple[Dict, Dict]:
+        """
+        Separa las combinaciones de fechas en las que ya están en la caché de
+        respuestas ({(salida, regreso): resultado}) y las que hay que consultar
+        ({(salida, regreso): search_data}).
+        """
+        results = {}
+        to_fetch = {}
+        for departure, return_date in dict.fromkeys(date_pairs):
+            search_data = {
+                'origin': origin.upper(),
+                'destination': destination.upper(),
+                'departure_date': departure,
+                'return_date': return_date,
+                'passengers': passengers,
+            }
+            cached = self.cache.get(search_data, self.cache_namespace) if self.cache is not None else None
+            if cached:
+                cached['cached'] = True
+                results[(departure, return_date)] = cached
+            else:
+                to_fetch[(departure, return_date)] = search_data
+        return results, to_fetch
+    
+    def plan_date_matrix(self, origin: str, destination: str,
+                         date_pairs: List[Tuple[str, Optional[str]]], passengers: int = 1) -> Dict:
+        """
+        Coste de una matriz de fechas antes de lanzarla, para confirmarlo.
         
+        Cada combinación fuera de la caché consulta como máximo una vez a cada
+        proveedor real configurado (la simulación no consume cupo).
+        
+        Devuelve {'cells': n, 'cached': n, 'to_fetch': n, 'max_calls': n,
+                  'budget_left': {proveedor: llamadas restantes este mes o None}}.
+        """
+        results, to_fetch = self.split_date_matrix(origin, destination, date_pairs, passengers)
+        providers = [api_name for api_name, _ in self.get_available_apis() if api_name != SIMULATION_SOURCE]
         return {
-            'price': round(final_price, 2),
-            'currency': 'USD',
-            'airline': random.choice(airlines),
-            'flight_details': flight_details,
-            'source': 'Simulación'
+            'cells': len(results) + len(to_fetch),
+            'cached': len(results),
+            'to_fetch': len(to_fetch),
+            'max_calls': len(to_fetch) * len(providers),
+            'budget_left': {
+                provider: get_rate_limiter(provider, usage_path=self.rate_limit_usage_path,
+                                           host=self.custom_host(provider)).month_budget_left()
+                for provider in providers
+            },
         }
     
-    def search_flights(self, search_data: Dict) -> Dict:
-        """Método principal que intenta múltiples APIs y fallback a simulación"""
+    def search_date_matrix(self, origin: str, destination: str,
+                           date_pairs: List[Tuple[str, Optional[str]]], passengers: int = 1,
+                           max_workers: int = 6, rate_limit_wait: Optional[float] = None) -> Dict:
+        """
+        Busca una ruta para varias combinaciones de fechas como un solo plan.
         
-        # Intentar APIs en orden de preferencia
-        apis_to_try = []
+        Las combinaciones ya presentes en la caché de respuestas no se consultan;
+        el resto se busca en paralelo (pool acotado) sin pasar a la simulación.
+        Por defecto cada llamada usa el rate_limit_timeout del conector: en la
+        interfaz es 0 y una combinación sin cupo queda sin datos en lugar de
+        bloquear; el worker puede esperar pasando `rate_limit_wait` segundos.
+        Sin APIs configuradas se simula toda la matriz.
         
-        # Verificar qué APIs están disponibles
-        if self.get_secret("AMADEUS_API_KEY") and self.get_secret("AMADEUS_API_SECRET"):
-            apis_to_try.append(('Amadeus', self.search_flights_amadeus))
+        Devuelve {'results': {(salida, regreso): resultado o None},
+                  'cached': n, 'fetched': n, 'missing': n}.
+        """
+        results, to_fetch = self.split_date_matrix(origin, destination, date_pairs, passengers)
+        cached_count = len(results)
         
-        if self.get_secret("RAPIDAPI_KEY"):
-            apis_to_try.append(('Skyscanner', self.search_flights_skyscanner))
+        if to_fetch and not self.get_available_apis():
+            for key, search_data in to_fetch.items():
+                results[key] = self.simulate_flight_search(search_data)
+        elif to_fetch:
+            worker = self
+            if rate_limit_wait is not None:
+                # Copia con otra espera por cupo; el conector original no cambia
+                worker = copy.copy(self)
+                worker.rate_limit_timeout = rate_limit_wait
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(to_fetch))),
+                                    thread_name_prefix='date-matrix') as executor:
+                futures = {executor.submit(worker.search_providers, search_data): key
+                           for key, search_data in to_fetch.items()}
+                for future in as_completed(futures):
+                    key = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception:
+                        result = None
+                    results[key] = result
+                    if result and self.cache is not None:
+                        self.cache.put(to_fetch[key], result, self.cache_namespace)
         
-        # Intentar cada API disponible
-        for api_name, api_function in apis_to_try:
-            try:
-                st.info(f"🔍 Buscando en {api_name}...")
-                result = api_function(search_data)
-                
-                if result:
-                    st.success(f"✅ Datos obtenidos de {api_name}")
-                    return result
-                else:
-                    st.warning(f"⚠️ {api_name}: No se encontraron vuelos")
-                    
-            except Exception as e:
-                st.warning(f"⚠️ Error en {api_name}: {str(e)}")
-                continue
+        return {
+            'results': results,
+            'cached': cached_count,
+            'fetched': sum(1 for key in to_fetch if results.get(key)),
+            'missing': sum(1 for key in to_fetch if not results.get(key)),
+        }
+    
+    def search_flights_concurrent(self, search_data: Dict, apis_to_try: List,
+                                  mode: str = SEARCH_MODE_FIRST) -> Optional[Dict]:
+        """
+        Consulta todas las APIs a la vez.
         
-        # Si todas las APIs fallan, usar simulación
-        st.info("🎮 Usando datos simulados (APIs no disponibles)")
-        return self.simulate_flight_search(search_data)
+        En modo 'first' devuelve la primera respuesta válida y cancela el resto;
+        en modo 'cheapest' espera a todas hasta `search_deadline` y devuelve la más barata.
+        La latencia es la del proveedor más lento (o el plazo), no la suma.
+        """
+        return self.search_flights_concurrent_detailed(search_data, apis_to_try, mode).result
+    
+    def search_flights_concurrent_detailed(self, search_data: Dict, apis_to_try: List,
+                                           mode: str = SEARCH_MODE_FIRST) -> SearchOutcome:
+        """Como search_flights_concurrent, con el detalle de cada proveedor"""
+        executor = ThreadPoolExecutor(max_workers=len(apis_to_try),
+                                      thread_name_prefix='flight-search')
+        futures = {executor.submit(self.call_provider, api_name, api_function, search_data): api_name
+                   for api_name, api_function in apis_to_try}
+        started = time.monotonic()
+        deadline = started + self.search_deadline
+        results = []
+        attempts = []
+        
+        try:
+            pending = set(futures)
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    result, attempt = future.result()
+                    attempts.append(attempt)
+                    if result:
+                        results.append(result)
+                if results and mode == SEARCH_MODE_FIRST:
+                    break
+            
+            # En modo 'first' las pendientes se descartan por haber ya respuesta:
+            # no son un fallo del proveedor ni cuentan en flight_provider_errors_total
+            cancelled = bool(results) and mode == SEARCH_MODE_FIRST
+            for future in pending:
+                api_name = futures[future]
+                if cancelled:
+                    attempts.append(ProviderAttempt(api_name, 'cancelled', time.monotonic() - started,
+                                                    f"{api_name}: descartado, ya hubo una respuesta válida"))
+                    continue
+                message = f"⚠️ {api_name}: sin respuesta dentro del plazo"
+                self.emit('warning', 'timeout', message, api_name)
+                attempts.append(ProviderAttempt(api_name, 'timeout', time.monotonic() - started, message))
+        finally:
+            # No esperar a las llamadas pendientes: se descartan sus resultados
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        if not results:
+            return SearchOutcome(None, tuple(attempts))
+        
+        cheapest = min(results, key=lambda r: float(r['price']))
+        if len(results) > 1:
+            cheapest = dict(cheapest)
+            cheapest['compared_sources'] = {r['source']: r['price'] for r in results}
+        return SearchOutcome(cheapest, tuple(attempts))
 
 
 # Clase Rate Limiter para APIs
 class APIRateLimiter:
-    def __init__(self, max_calls_per_minute: int = 10):
-        self.max_calls = max_calls_per_minute
-        self.calls = []
+    """
+    Token bucket por proveedor con presupuesto mensual.
     
-    def can_make_call(self) -> bool:
-        """Verifica si se puede hacer una llamada a la API"""
-        now = datetime.now()
-        
-        # Remover llamadas de hace más de 1 minuto
-        self.calls = [call_time for call_time in self.calls 
-                     if now - call_time < timedelta(minutes=1)]
-        
-        if len(self.calls) < self.max_calls:
-            self.calls.append(now)
-            return True
-        return False
+    Cada acquire es O(1): el bucket se rellena según el tiempo transcurrido.
+    Es seguro entre hilos (lock) y ofrece `acquire_async` para asyncio.
+    El presupuesto mensual puede persistirse en SQLite para que sobreviva
+    reinicios y se comparta entre workers.
+    """
     
-    def time_until_next_call(self) -> int:
-        """Tiempo en segundos hasta que se pueda hacer la próxima llamada"""
-        if len(self.calls) < self.max_calls:
-            return 0
+    def __init__(self, max_calls_per_minute: int = 10, max_calls_per_month: Optional[int] = None,
+                 burst: Optional[int] = None, provider: str = 'default',
+                 usage_path: Optional[str] = None):
+        self.max_calls = max_calls_per_minute
+        self.max_calls_per_month = max_calls_per_month
+        self.capacity = float(burst or max_calls_per_minute)
+        self.refill_rate = max_calls_per_minute / 60.0  # tokens por segundo
+        self.provider = provider
+        self.usage_path = usage_path
         
-        oldest_call = min(self.calls)
-        next_available = oldest_call + timedelta(minutes=1)
-        wait_time = (next_available - datetime.now()).total_seconds()
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._month = datetime.now().strftime('%Y-%m')
+        self.month_calls = 0
         
-        return max(0, int(wait_time))
-
-
-# Test de conectividad de APIs
-def test_api_connections():
-    """Prueba la conectividad con las APIs configuradas"""
-    connector = FlightAPIConnector()
-    results = {}
+        self.total_wait = 0.0
+        self.rejected = 0
+        
+        if self.usage_path:
+            try:
+                self._load_month_usage()
+            except sqlite3.Error:
+                logger.warning("No se pudo abrir %s: el presupuesto mensual de %s solo se cuenta en este proceso",
+                               self.usage_path, self.provider)
+                self.usage_path = None
+    
+    def _usage_connection(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.usage_path, timeout=10)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS api_usage (
+                provider TEXT NOT NULL,
+                month TEXT NOT NULL,
+                calls INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (provider, month)
+            )
+        ''')
+        return conn
+    
+    def _load_month_usage(self):
+        conn = self._usage_connection()
+        try:
+            row = conn.execute('SELECT calls FROM api_usage WHERE provider = ? AND month = ?',
+                               (self.provider, self._month)).fetchone()
+            conn.commit()
+        finally:
+            conn.close()
+        self.month_calls = row[0] if row else 0
+    
+    def _reserve_month_call(self) -> bool:
+        """
+        Reserva una llamada del presupuesto mensual compartido. La comprobación
+        y el incremento son una sola sentencia, así que varios procesos nunca
+        superan juntos el presupuesto. Si SQLite falla no se llama a la API.
+        """
+        try:
+            conn = self._usage_connection()
+            try:
+                with conn:
+                    conn.execute('INSERT OR IGNORE INTO api_usage (provider, month, calls) VALUES (?, ?, 0)',
+                                 (self.provider, self._month))
+                    reserved = conn.execute('''
+                        UPDATE api_usage SET calls = calls + 1
+                        WHERE provider = ? AND month = ? AND (? IS NULL OR calls < ?)
+                    ''', (self.provider, self._month,
+                          self.max_calls_per_month, self.max_calls_per_month)).rowcount == 1
+                    self.month_calls = conn.execute(
+                        'SELECT calls FROM api_usage WHERE provider = ? AND month = ?',
+                        (self.provider, self._month)).fetchone()[0]
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            logger.exception("No se pudo registrar el consumo mensual de %s en %s", self.provider, self.usage_path)
+            return False
+        return reserved
+    
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.refill_rate)
+            self._updated = now
+        month = datetime.now().strftime('%Y-%m')
+        if month != self._month:
+            self._month = month
+            self.month_calls = 0
     
-    st.subheader("🧪 Test de Conectividad de APIs")
+    def month_budget_left(self) -> Optional[int]:
+        """Llamadas restantes este mes (None si no hay presupuesto mensual)"""
+        if self.max_calls_per_month is None:
+            return None
+        return max(0, self.max_calls_per_month - self.month_calls)
     
-    # Test Amadeus
-    if connector.get_secret("AMADEUS_API_KEY"):
-        with st.spinner("Probando Amadeus API..."):
-            token = connector.get_amadeus_token()
-            if token:
-                st.success("✅ Amadeus API: Conectado")
-                results['Amadeus'] = True
+    def _try_acquire(self) -> float:
+        """
+        Intenta consumir un token. Devuelve 0 si lo consiguió, los segundos
+        a esperar si el bucket está vacío o -1 si se agotó el presupuesto mensual.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self.max_calls_per_month is not None and self.month_calls >= self.max_calls_per_month:
+                return -1
+            if self._tokens < 1:
+                return (1 - self._tokens) / self.refill_rate
+            if self.usage_path:
+                # Presupuesto compartido: la cuenta de SQLite es la que manda
+                if not self._reserve_month_call():
+                    return -1
             else:
-                st.error("❌ Amadeus API: Error de conexión")
-                results['Amadeus'] = False
-    else:
-        st.info("ℹ️ Amadeus API: No configurado")
-        results['Amadeus'] = None
+                self.month_calls += 1
+            self._tokens -= 1
+        return 0
     
-    # Test RapidAPI
-    if connector.get_secret("RAPIDAPI_KEY"):
-        st.info("ℹ️ RapidAPI: Configurado (test requiere consulta real)")
-        results['RapidAPI'] = None
-    else:
-        st.info("ℹ️ RapidAPI: No configurado")
-        results['RapidAPI'] = None
+    def acquire(self, timeout: Optional[float] = 0) -> bool:
+        """
+        Consume un token. Con timeout=0 no bloquea; con timeout=None espera
+        indefinidamente; en otro caso espera como máximo `timeout` segundos.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait_time = self._try_acquire()
+            if wait_time == 0:
+                return True
+            if wait_time < 0:
+                self.rejected += 1
+                return False
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.rejected += 1
+                    return False
+                wait_time = min(wait_time, remaining)
+            self.total_wait += wait_time
+            time.sleep(wait_time)
+    
+    async def acquire_async(self, timeout: Optional[float] = 0) -> bool:
+        """Igual que acquire pero cediendo el bucle de eventos mientras espera"""
+        import asyncio
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait_time = self._try_acquire()
+            if wait_time == 0:
+                return True
+            if wait_time < 0:
+                self.rejected += 1
+                return False
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.rejected += 1
+                    return False
+                wait_time = min(wait_time, remaining)
+            self.total_wait += wait_time
+            await asyncio.sleep(wait_time)
+    
+    def can_make_call(self) -> bool:
+        """Verifica si se puede hacer una llamada a la API (sin bloquear)"""
+        return self.acquire(timeout=0)
     
-    return results
+    def time_until_next_call(self) -> int:
+        """Tiempo en segundos hasta que se pueda hacer la próxima llamada"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                return 0
+            return max(0, int((1 - self._tokens) / self.refill_rate + 0.999))
+
+
+# Límites por defecto de los planes gratuitos
+DEFAULT_RATE_LIMITS = {
+    'Amadeus': {'max_calls_per_minute': 60, 'max_calls_per_month': 2000, 'burst': 10},
+    'Skyscanner': {'max_calls_per_minute': 30, 'max_calls_per_month': 500, 'burst': 5},
+}
 
+_rate_limiters: Dict[str, APIRateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
 
-# Función para usar en la app principal
-def get_flight_connector():
-    """Factory function para obtener el conector de APIs"""
-    if 'flight_connector' not in st.session_state:
-        st.session_state.flight_connector = FlightAPIConnector()
-    return st.session_state.flight_connector
+def get_rate_limiter(provider: str, usage_path: Optional[str] = None, host: Optional[str] = None,
+                     **overrides) -> APIRateLimiter:
+    """
+    Limitador compartido por todo el proceso para un proveedor. Con `host`
+    (un servidor distinto del oficial) el limitador y su consumo mensual en
+    api_usage son independientes de los del proveedor real.
+    """
+    key = f"{provider}@{host}" if host else provider
+    with _rate_limiters_lock:
+        limiter = _rate_limiters.get(key)
+        if limiter is None:
+            config = dict(DEFAULT_RATE_LIMITS.get(provider, {}))
+            config.update(overrides)
+            limiter = APIRateLimiter(provider=key, usage_path=usage_path, **config)
+            _rate_limiters[key] = limiter
+        return limiter
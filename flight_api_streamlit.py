@@ -0,0 +1,99 @@
+"""
+Adaptador de Streamlit para el conector de APIs de vuelos
+Resuelve las credenciales desde st.secrets (con variables de entorno como
+respaldo) y muestra los eventos del conector con st.info/success/warning/error
+solo cuando se ejecuta dentro de un script de Streamlit.
+"""
+
+import os
+from functools import lru_cache
+from typing import Dict
+
+import streamlit as st
+
+from flight_api_connector import SEARCH_MODE_SEQUENTIAL, ConnectorEvent, FlightAPIConnector
+
+
+def streamlit_secret(key: str, default=None):
+    """Obtiene secretos de Streamlit Cloud o variables de entorno"""
+    try:
+        return st.secrets[key]
+    except (KeyError, FileNotFoundError):
+        return os.getenv(key, default)
+
+
+def in_script_run() -> bool:
+    """True si el hilo actual ejecuta un script de Streamlit (los hilos del pool no)"""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+    except ImportError:
+        return False
+    return get_script_run_ctx() is not None
+
+
+def streamlit_event_hook(event: ConnectorEvent):
+    """Muestra un evento del conector en la página; fuera de un script solo queda en el log"""
+    if in_script_run():
+        getattr(st, event.level, st.info)(event.message)
+
+
+def build_flight_connector(**options) -> FlightAPIConnector:
+    """Conector configurado con los secretos de Streamlit y eventos en la página"""
+    connector = FlightAPIConnector(secret_getter=streamlit_secret, on_event=streamlit_event_hook, **options)
+    connector.search_mode = connector.get_secret("FLIGHT_SEARCH_MODE", SEARCH_MODE_SEQUENTIAL)
+    # El consumo mensual por proveedor se comparte con otros workers
+    connector.rate_limit_usage_path = connector.token_cache_path
+    return connector
+
+
+# Función para usar en la app principal
+@st.cache_resource
+def get_flight_connector() -> FlightAPIConnector:
+    """
+    Conector de APIs del proceso, compartido por las sesiones y el planificador.
+    Los eventos se muestran en la página de la sesión que hace la búsqueda.
+    """
+    return build_flight_connector()
+
+
+@lru_cache(maxsize=1)
+def get_affiliate_codes() -> Dict[str, str]:
+    """Códigos de afiliado de los buscadores, leídos una vez"""
+    return {
+        'skyscanner': streamlit_secret('SKYSCANNER_AFFILIATE', ''),
+        'kayak': streamlit_secret('KAYAK_AFFILIATE', ''),
+        'expedia': streamlit_secret('EXPEDIA_AFFILIATE', ''),
+    }
+
+
+# Test de conectividad de APIs
+def test_api_connections() -> Dict:
+    """Prueba la conectividad con las APIs configuradas"""
+    connector = build_flight_connector()
+    results = {}
+
+    st.subheader("🧪 Test de Conectividad de APIs")
+
+    # Test Amadeus
+    if connector.amadeus_api_key:
+        with st.spinner("Probando Amadeus API..."):
+            token = connector.get_amadeus_token()
+            if token:
+                st.success("✅ Amadeus API: Conectado")
+                results['Amadeus'] = True
+            else:
+                st.error("❌ Amadeus API: Error de conexión")
+                results['Amadeus'] = False
+    else:
+        st.info("ℹ️ Amadeus API: No configurado")
+        results['Amadeus'] = None
+
+    # Test RapidAPI
+    if connector.rapidapi_key:
+        st.info("ℹ️ RapidAPI: Configurado (test requiere consulta real)")
+        results['RapidAPI'] = None
+    else:
+        st.info("ℹ️ RapidAPI: No configurado")
+        results['RapidAPI'] = None
+
+    return results
@@ -0,0 +1,212 @@
+"""
+Caché de respuestas de proveedores de vuelos
+Evita repetir consultas idénticas (mismo itinerario) dentro de un TTL por proveedor
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+# TTL por defecto en segundos según la fuente del resultado
+DEFAULT_TTLS = {
+    'Amadeus': 15 * 60,
+    'Skyscanner': 30 * 60,
+    'Simulación': 0,  # Los datos simulados no se cachean
+}
+
+
+def make_cache_key(search_data: Dict, namespace: str = '') -> str:
+    """Clave normalizada de un itinerario (`namespace` separa servidores distintos de los oficiales)"""
+    key = '|'.join([
+        str(search_data['origin']).upper(),
+        str(search_data['destination']).upper(),
+        str(search_data['departure_date']),
+        str(search_data.get('return_date') or ''),
+        str(int(search_data.get('passengers') or 1)),
+    ])
+    return f"{namespace}|{key}" if namespace else key
+
+
+class FlightResponseCache:
+    """
+    Caché LRU acotada en memoria con TTL por proveedor y un nivel opcional
+    en SQLite que sobrevive a reinicios y se comparte entre procesos.
+    """
+
+    def __init__(self, max_entries: int = 1000, ttls: Optional[Dict[str, float]] = None,
+                 default_ttl: float = 15 * 60, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.default_ttl = default_ttl
+        self.db_path = db_path
+
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.db_path:
+            self._init_disk()
+
+    # ------------------------------------------------------------------
+    # Nivel en disco
+    # ------------------------------------------------------------------
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_path, timeout=10)
+
+    def _init_disk(self):
+        try:
+            conn = self._connect()
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    source TEXT,
+                    payload TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+            conn.commit()
+            conn.close()
+        except sqlite3.Error:
+            self.db_path = None
+
+    def _disk_get(self, key: str) -> Optional[tuple]:
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                'SELECT payload, expires_at FROM response_cache WHERE cache_key = ?', (key,)
+            ).fetchone()
+            conn.close()
+        except sqlite3.Error:
+            return None
+        if row and row[1] > time.time():
+            return json.loads(row[0]), row[1]
+        return None
+
+    def _disk_put(self, key: str, result: Dict, expires_at: float):
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute('''
+                    INSERT OR REPLACE INTO response_cache (cache_key, source, payload, expires_at)
+                    VALUES (?, ?, ?, ?)
+                ''', (key, result.get('source'), json.dumps(result, default=str), expires_at))
+                # Limpieza oportunista de entradas vencidas
+                conn.execute('DELETE FROM response_cache WHERE expires_at < ?', (time.time(),))
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    # ------------------------------------------------------------------
+    # API pública
+    # ------------------------------------------------------------------
+    def ttl_for(self, source: Optional[str]) -> float:
+        return self.ttls.get(source, self.default_ttl)
+
+    def get(self, search_data: Dict, namespace: str = '') -> Optional[Dict]:
+        """Devuelve el resultado cacheado de un itinerario o None"""
+        key = make_cache_key(search_data, namespace)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                result, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return dict(result)
+                del self._entries[key]
+
+        if self.db_path:
+            entry = self._disk_get(key)
+            if entry is not None:
+                with self._lock:
+                    self._store(key, entry[0], entry[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                return dict(entry[0])
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, search_data: Dict, result: Dict, namespace: str = ''):
+        """Guarda un resultado si su proveedor tiene TTL > 0"""
+        ttl = self.ttl_for(result.get('source'))
+        if ttl <= 0:
+            return
+        key = make_cache_key(search_data, namespace)
+        expires_at = time.time() + ttl
+        with self._lock:
+            self._store(key, result, expires_at)
+        if self.db_path:
+            self._disk_put(key, result, expires_at)
+
+    def _store(self, key: str, result: Dict, expires_at: float):
+        self._entries[key] = (dict(result), expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.db_path:
+            try:
+                conn = self._connect()
+                with conn:
+                    conn.execute('DELETE FROM response_cache')
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def stats(self) -> Dict:
+        """Contadores de aciertos y fallos"""
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': self.hits / total if total else 0.0,
+        }
+
+
+_response_caches: Dict[Optional[str], FlightResponseCache] = {}
+_response_caches_lock = threading.Lock()
+
+
+def get_response_cache(db_path: Optional[str] = None, **kwargs) -> FlightResponseCache:
+    """
+    Caché de respuestas compartida por el proceso, una por nivel en disco
+    (`db_path`; None = solo memoria). Pedir una caché ya creada con otros
+    ajustes lanza ValueError en lugar de ignorarlos.
+    """
+    key = os.path.abspath(db_path) if db_path else None
+    with _response_caches_lock:
+        cache = _response_caches.get(key)
+        if cache is None:
+            cache = FlightResponseCache(db_path=db_path or None, **kwargs)
+            _response_caches[key] = cache
+            return cache
+
+    current = {'max_entries': cache.max_entries, 'default_ttl': cache.default_ttl, 'ttls': cache.ttls}
+    requested = dict(kwargs)
+    if 'ttls' in requested:
+        requested['ttls'] = dict(DEFAULT_TTLS, **(requested['ttls'] or {}))
+    conflicts = sorted(name for name, value in requested.items() if current.get(name) != value)
+    if conflicts:
+        raise ValueError(f"La caché de respuestas ({db_path or 'memoria'}) ya existe con otros valores "
+                         f"de {', '.join(conflicts)}")
+    return cache
@@ -0,0 +1,254 @@
+"""
+Métricas de rendimiento del proceso
+Histogramas de latencia y contadores con etiquetas, compartidos por el
+conector, el monitor y el planificador. Se exportan en formato de texto de
+Prometheus (endpoint HTTP o archivo para el textfile collector) y se
+muestran en la pestaña Rendimiento de la app.
+
+Cada proceso (la app de Streamlit, el worker del planificador) tiene sus
+propias métricas.
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+# Límites superiores (segundos) de los buckets de latencia
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+HISTOGRAM = 'histogram'
+COUNTER = 'counter'
+
+# Métricas conocidas: nombre -> (tipo, descripción)
+METRIC_DEFINITIONS = {
+    'flight_check_seconds': (HISTOGRAM, 'Duración de un chequeo completo (búsqueda y escritura)'),
+    'flight_token_fetch_seconds': (HISTOGRAM, 'Solicitud de un token OAuth nuevo al proveedor'),
+    'flight_provider_call_seconds': (HISTOGRAM, 'Consulta a un proveedor, incluidos reintentos HTTP'),
+    'flight_json_parse_seconds': (HISTOGRAM, 'Decodificación JSON de la respuesta de un proveedor'),
+    'flight_db_insert_seconds': (HISTOGRAM, 'Transacción de escritura de un chequeo (historial, ofertas y agregados)'),
+    'flight_min_query_seconds': (HISTOGRAM, 'Consulta del precio mínimo previo en search_stats'),
+    'flight_rate_limit_wait_seconds': (HISTOGRAM, 'Espera por cupo del limitador de un proveedor'),
+    'flight_provider_calls_total': (COUNTER, 'Consultas a proveedores por resultado'),
+    'flight_provider_errors_total': (COUNTER, 'Avisos y errores de proveedores por código'),
+    'flight_cache_requests_total': (COUNTER, 'Consultas a cachés por resultado (hit/miss)'),
+    'flight_search_results_total': (COUNTER, 'Resultados de búsqueda por origen (cache, provider, simulated)'),
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Histograma acumulativo de buckets fijos (como los de Prometheus)"""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        index = 0
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            index = len(self.buckets)
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Cuantil estimado interpolando dentro del bucket"""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), self.counts):
+            if bucket_count and seen + bucket_count >= target:
+                if bound == float('inf'):
+                    return lower
+                return lower + (bound - lower) * (target - seen) / bucket_count
+            seen += bucket_count
+            lower = bound
+        return lower
+
+
+def label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class MetricsRegistry:
+    """Registro de métricas seguro entre hilos"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+
+    def observe(self, name: str, value: float, **labels):
+        key = label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(value)
+
+    def increment(self, name: str, amount: float = 1.0, **labels):
+        key = label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + amount
+
+    @contextmanager
+    def timed(self, name: str, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def render_prometheus(self) -> str:
+        """Formato de exposición de texto de Prometheus (version 0.0.4)"""
+        lines = []
+        with self._lock:
+            for name in sorted(self._histograms):
+                lines.append(f"# HELP {name} {METRIC_DEFINITIONS.get(name, (HISTOGRAM, name))[1]}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in sorted(self._histograms[name].items()):
+                    cumulative = 0
+                    for bound, bucket_count in zip(histogram.buckets, histogram.counts):
+                        cumulative += bucket_count
+                        lines.append(f"{name}_bucket{format_labels(key, ('le', repr(bound)))} {cumulative}")
+                    lines.append(f"{name}_bucket{format_labels(key, ('le', '+Inf'))} {histogram.count}")
+                    lines.append(f"{name}_sum{format_labels(key)} {histogram.sum!r}")
+                    lines.append(f"{name}_count{format_labels(key)} {histogram.count}")
+            for name in sorted(self._counters):
+                lines.append(f"# HELP {name} {METRIC_DEFINITIONS.get(name, (COUNTER, name))[1]}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in sorted(self._counters[name].items()):
+                    lines.append(f"{name}{format_labels(key)} {value!r}")
+        return '\n'.join(lines) + '\n'
+
+    def histogram_rows(self) -> List[Dict]:
+        """Resumen por serie: llamadas, total, media y cuantiles estimados (segundos)"""
+        rows = []
+        with self._lock:
+            for name, series in sorted(self._histograms.items()):
+                for key, histogram in sorted(series.items()):
+                    rows.append({
+                        'metric': name,
+                        'labels': ', '.join(f"{label}={value}" for label, value in key),
+                        'count': histogram.count,
+                        'sum': histogram.sum,
+                        'mean': histogram.sum / histogram.count if histogram.count else None,
+                        'p50': histogram.quantile(0.5),
+                        'p95': histogram.quantile(0.95),
+                        'p99': histogram.quantile(0.99),
+                    })
+        return rows
+
+    def counter_rows(self) -> List[Dict]:
+        rows = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                for key, value in sorted(series.items()):
+                    rows.append({'metric': name, 'labels': dict(key), 'value': value})
+        return rows
+
+    def hit_ratio(self, cache: str) -> Optional[float]:
+        """Proporción de aciertos de una caché de flight_cache_requests_total"""
+        with self._lock:
+            series = self._counters.get('flight_cache_requests_total', {})
+            hits = series.get(label_key({'cache': cache, 'result': 'hit'}), 0.0)
+            misses = series.get(label_key({'cache': cache, 'result': 'miss'}), 0.0)
+        return hits / (hits + misses) if hits + misses else None
+
+
+_registry = MetricsRegistry()
+
+
+def get_metrics() -> MetricsRegistry:
+    """Registro de métricas del proceso"""
+    return _registry
+
+
+def observe(name: str, value: float, **labels):
+    _registry.observe(name, value, **labels)
+
+
+def increment(name: str, amount: float = 1.0, **labels):
+    _registry.increment(name, amount, **labels)
+
+
+def timed(name: str, **labels):
+    """Context manager que registra la duración del bloque en un histograma"""
+    return _registry.timed(name, **labels)
+
+
+def write_metrics_file(path: str, registry: Optional[MetricsRegistry] = None):
+    """Escribe las métricas de forma atómica (para el textfile collector de node_exporter)"""
+    temporary = f"{path}.tmp"
+    with open(temporary, 'w', encoding='utf-8') as handle:
+        handle.write((registry or _registry).render_prometheus())
+    os.replace(temporary, path)
+
+
+def start_metrics_file_writer(path: str, interval: float = 15.0,
+                              registry: Optional[MetricsRegistry] = None) -> threading.Event:
+    """Reescribe el archivo cada `interval` segundos en un hilo daemon; devuelve el evento para pararlo"""
+    stop_event = threading.Event()
+
+    def run():
+        while not stop_event.wait(interval):
+            write_metrics_file(path, registry)
+        write_metrics_file(path, registry)
+
+    threading.Thread(target=run, name='metrics-file', daemon=True).start()
+    return stop_event
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = self.server.registry.render_prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(port: int, host: str = '127.0.0.1',
+                         registry: Optional[MetricsRegistry] = None) -> ThreadingHTTPServer:
+    """Sirve /metrics en un hilo daemon (solo en local salvo que se indique otro `host`)"""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    server.registry = registry or _registry
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
@@ -4,9 +4,6 @@ import plotly.express as px
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
 import sqlite3
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 import requests
 import json
 import time
@@ -15,6 +12,20 @@ from typing import Dict, List, Optional
 import asyncio
 import schedule
 import os
+import tempfile
+
+# Núcleo sin Streamlit (reexportado para quien importe FlightPriceMonitor desde aquí)
+from flight_storage import FlightPriceMonitor
+from price_analytics import compute_route_analytics, days_to_departure_profile, describe_trend
+from price_retention import apply_retention, count_at_or_below, load_price_series
+from data_export import EXPORT_FORMATS, export_all
+from data_import import detect_format, import_prices
+from price_alerts import ALERT_RULE_TYPES, delete_alert_rule, list_alert_rules
+from flight_metrics import get_metrics
+from flight_offers import cheapest_offer, offers_breakdown
+from raw_payloads import payload_stats, source_counts
+from flight_notifications import NotificationDispatcher, load_smtp_settings, outbox_stats
+from flight_scheduler import CHECK_INTERVALS
 
 # Configuración para manejar secretos en Streamlit Cloud
 def get_secret(key, default=None):
@@ -32,245 +43,76 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Clase principal para el monitor de vuelos
-class FlightPriceMonitor:
-    def __init__(self):
-        self.db_path = "flight_prices.db"
-        self.init_database()
-        
-    def init_database(self):
-        """Inicializa la base de datos SQLite"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS flight_searches (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                search_name TEXT NOT NULL,
-                origin TEXT NOT NULL,
-                destination TEXT NOT NULL,
-                departure_date TEXT NOT NULL,
-                return_date TEXT,
-                passengers INTEGER DEFAULT 1,
-                email_notification TEXT,
-                target_price REAL,
-                is_active BOOLEAN DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS price_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                search_id INTEGER,
-                price REAL NOT NULL,
-                currency TEXT DEFAULT 'USD',
-                airline TEXT,
-                flight_details TEXT,
-                checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (search_id) REFERENCES flight_searches (id)
-            )
-        ''')
-        
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS notifications (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                search_id INTEGER,
-                notification_type TEXT,
-                message TEXT,
-                sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (search_id) REFERENCES flight_searches (id)
-            )
-        ''')
-        
-        conn.commit()
-        conn.close()
-    
-    def add_search(self, search_data: Dict) -> int:
-        """Añade una nueva búsqueda de vuelo"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO flight_searches 
-            (search_name, origin, destination, departure_date, return_date, 
-             passengers, email_notification, target_price)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            search_data['name'],
-            search_data['origin'],
-            search_data['destination'],
-            search_data['departure_date'],
-            search_data.get('return_date'),
-            search_data.get('passengers', 1),
-            search_data.get('email'),
-            search_data.get('target_price')
-        ))
-        
-        search_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return search_id
-    
-    def get_searches(self) -> pd.DataFrame:
-        """Obtiene todas las búsquedas activas"""
-        conn = sqlite3.connect(self.db_path)
-        df = pd.read_sql_query('''
-            SELECT * FROM flight_searches WHERE is_active = 1
-            ORDER BY created_at DESC
-        ''', conn)
-        conn.close()
-        return df
-    
-    def get_price_history(self, search_id: int) -> pd.DataFrame:
-        """Obtiene el historial de precios para una búsqueda"""
-        conn = sqlite3.connect(self.db_path)
-        df = pd.read_sql_query('''
-            SELECT * FROM price_history 
-            WHERE search_id = ? 
-            ORDER BY checked_at DESC
-        ''', conn, params=(search_id,))
-        conn.close()
-        return df
-    
-    def search_flights_with_apis(self, search_data: Dict) -> Dict:
-        """
-        Busca vuelos usando APIs reales o simulación como fallback
-        """
-        # Importar el conector de APIs
-        try:
-            from flight_api_connector import get_flight_connector
-            connector = get_flight_connector()
-            return connector.search_flights(search_data)
-        except ImportError:
-            # Fallback a simulación si no existe el conector
-            return self.simulate_flight_search_fallback(search_data)
-    
-    def simulate_flight_search_fallback(self, search_data: Dict) -> Dict:
-        """
-        Simulación de vuelos como fallback
-        """
-        import random
-        
-        # Simulación de precios basada en factores realistas
-        base_price = random.randint(200, 1200)
-        
-        # Factor de temporada
-        departure_date = datetime.strptime(search_data['departure_date'], '%Y-%m-%d')
-        days_ahead = (departure_date - datetime.now()).days
-        
-        if days_ahead < 7:
-            base_price *= 1.5  # Precios más altos cerca de la fecha
-        elif days_ahead > 60:
-            base_price *= 0.8  # Precios más bajos con anticipación
-        
-        # Variación aleatoria
-        price_variation = random.uniform(0.9, 1.1)
-        final_price = base_price * price_variation
-        
-        airlines = ['Avianca', 'LATAM', 'Viva Air', 'American Airlines', 'Delta', 'United']
-        
-        return {
-            'price': round(final_price, 2),
-            'currency': 'USD',
-            'airline': random.choice(airlines),
-            'flight_details': f"Vuelo directo - {random.randint(1, 3)} escalas",
-            'source': 'Simulación'
-        }
-    
-    def check_flights_and_update(self, search_id: int) -> Optional[Dict]:
-        """Busca vuelos y actualiza la base de datos"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Obtener datos de búsqueda
-        cursor.execute('SELECT * FROM flight_searches WHERE id = ?', (search_id,))
-        search_data = cursor.fetchone()
-        
-        if not search_data:
-            conn.close()
-            return None
-        
-        # Convertir a diccionario
-        columns = [description[0] for description in cursor.description]
-        search_dict = dict(zip(columns, search_data))
-        
-        # Simular búsqueda de vuelos
-        flight_result = self.search_flights_with_apis(search_dict)
-        
-        # Guardar resultado en historial
-        cursor.execute('''
-            INSERT INTO price_history (search_id, price, currency, airline, flight_details)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (
-            search_id,
-            flight_result['price'],
-            flight_result['currency'],
-            flight_result['airline'],
-            flight_result['flight_details']
-        ))
-        
-        # Verificar si es el precio más bajo
-        cursor.execute('''
-            SELECT MIN(price) FROM price_history WHERE search_id = ?
-        ''', (search_id,))
-        min_price = cursor.fetchone()[0]
-        
-        is_lowest = flight_result['price'] <= min_price
-        meets_target = (search_dict['target_price'] and 
-                       flight_result['price'] <= search_dict['target_price'])
-        
-        conn.commit()
-        conn.close()
-        
-        return {
-            'flight_result': flight_result,
-            'is_lowest': is_lowest,
-            'meets_target': meets_target,
-            'search_data': search_dict
-        }
-    
-    def send_notification(self, email: str, subject: str, message: str):
-        """Envía notificación por email usando secretos de Streamlit Cloud"""
-        try:
-            # Configuración del servidor SMTP desde secretos
-            smtp_server = get_secret("SMTP_SERVER", "smtp.gmail.com")
-            smtp_port = int(get_secret("SMTP_PORT", "587"))
-            
-            # Credenciales desde secretos de Streamlit Cloud
-            sender_email = get_secret("EMAIL_USER")
-            sender_password = get_secret("EMAIL_PASSWORD")
-            
-            if not sender_email or not sender_password:
-                st.warning("⚠️ Configuración de email no encontrada. Configura EMAIL_USER y EMAIL_PASSWORD en Secrets.")
-                return False
-            
-            msg = MIMEMultipart()
-            msg['From'] = sender_email
-            msg['To'] = email
-            msg['Subject'] = subject
-            
-            msg.attach(MIMEText(message, 'plain'))
-            
-            server = smtplib.SMTP(smtp_server, smtp_port)
-            server.starttls()
-            server.login(sender_email, sender_password)
-            text = msg.as_string()
-            server.sendmail(sender_email, email, text)
-            server.quit()
-            
-            return True
-        except Exception as e:
-            st.error(f"Error enviando notificación: {str(e)}")
-            return False
+# Rangos del gráfico de análisis (días; None = todo el historial)
+CHART_RANGES = {
+    "7 días": 7,
+    "30 días": 30,
+    "90 días": 90,
+    "Todo": None
+}
+
+RESOLUTION_LABELS = {'raw': 'cada consulta', 'hour': 'horaria', 'day': 'diaria'}
+
+# Tamaño máximo de una exportación ofrecida como descarga directa
+MAX_DOWNLOAD_BYTES = 50 * 1024 * 1024
 
 # Inicializar el monitor
 @st.cache_resource
 def get_monitor():
-    return FlightPriceMonitor()
+    # El conector se inyecta para que el planificador lo use desde su hilo sin st.session_state
+    try:
+        from flight_api_streamlit import get_flight_connector
+        connector = get_flight_connector()
+    except ImportError:
+        connector = None
+    return FlightPriceMonitor(connector=connector)
 
 monitor = get_monitor()
 
+# Planificador de chequeos automáticos compartido por todas las sesiones
+@st.cache_resource
+def get_scheduler():
+    from flight_scheduler import FlightCheckScheduler
+    return FlightCheckScheduler(FlightPriceMonitor(db_path=monitor.db_path, connector=monitor.connector))
+
+# Despachador de emails compartido; None si no hay credenciales SMTP configuradas
+@st.cache_resource
+def get_dispatcher():
+    settings = load_smtp_settings(get_secret)
+    if settings is None:
+        return None
+    dispatcher = NotificationDispatcher(monitor.db_path, **settings)
+    dispatcher.start()
+    return dispatcher
+
+# Modos del planificador compartido: etiqueta -> minutos entre chequeos (None = manual)
+AUTO_CHECK_MODES = {"Manual": None}
+AUTO_CHECK_MODES.update({f"Automático (cada {label})": minutes for label, minutes in CHECK_INTERVALS.items()})
+
+def current_auto_check_mode() -> str:
+    """Modo en que está el planificador; es el mismo para todas las sesiones"""
+    scheduler = get_scheduler()
+    if scheduler.is_active():
+        for label, minutes in AUTO_CHECK_MODES.items():
+            if minutes is not None and minutes * 60 == scheduler.interval_seconds:
+                return label
+    return "Manual"
+
+def on_auto_check_mode_change():
+    """Aplica el modo elegido; solo se llama cuando el usuario cambia el selector"""
+    apply_auto_check_mode(AUTO_CHECK_MODES[st.session_state['auto_check_mode']])
+
+def apply_auto_check_mode(interval_minutes: Optional[int]):
+    """Arranca, reconfigura o detiene el planificador en segundo plano"""
+    scheduler = get_scheduler()
+    if interval_minutes is None:
+        scheduler.stop(timeout=0)
+        return scheduler
+    if scheduler.interval_seconds != interval_minutes * 60:
+        scheduler.set_interval(interval_minutes)
+    scheduler.start()
+    return scheduler
+
 # Interfaz principal
 def main():
     st.title("✈️ Monitor de Precios de Vuelos")
@@ -280,14 +122,20 @@ def main():
     with st.sidebar:
         st.header("⚙️ Configuración")
         
-        # Modo de operación
+        # Modo de operación: refleja el planificador compartido y solo lo cambia
+        # cuando el usuario elige otro modo (abrir una sesión nueva no lo detiene)
+        st.session_state['auto_check_mode'] = current_auto_check_mode()
         mode = st.selectbox(
             "Modo de operación",
-            ["Manual", "Automático (cada hora)", "Automático (cada 6 horas)"]
+            list(AUTO_CHECK_MODES.keys()),
+            key='auto_check_mode',
+            on_change=on_auto_check_mode_change
         )
         
         if mode != "Manual":
-            st.info("🔄 Monitoreo automático activado")
+            scheduler = get_scheduler()
+            st.info(f"🔄 Monitoreo automático activado ({scheduler.pending_count()} búsquedas en cola)")
+            st.caption("Para monitoreo 24/7 sin navegador abierto ejecuta `python flight_scheduler.py`")
         
         st.markdown("---")
         
@@ -299,7 +147,8 @@ def main():
             default_email = st.text_input("Email para notificaciones")
     
     # Tabs principales
-    tab1, tab2, tab3, tab4, tab5 = st.tabs(["🔍 Nueva Búsqueda", "📊 Monitoreo Activo", "📈 Análisis", "🔗 APIs", "⚙️ Configuración"])
+    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(["🔍 Nueva Búsqueda", "📊 Monitoreo Activo", "📈 Análisis", "🔗 APIs",
+                                                  "⚙️ Configuración", "⏱️ Rendimiento"])
     
     with tab1:
         st.header("Configurar Nueva Búsqueda")
@@ -349,10 +198,10 @@ def main():
                         flight = result['flight_result']
                         st.info(f"💰 Primer precio encontrado: ${flight['price']} USD - {flight['airline']}")
                         
-                        # Mostrar opciones de compra inmediatamente
+                        # Las opciones de compra se muestran tras el rerun, fuera del botón
                         try:
-                            from booking_helper import add_booking_functionality_to_search_result
-                            add_booking_functionality_to_search_result(result, search_data)
+                            from booking_helper import remember_search_result
+                            remember_search_result('new_search', result, dict(search_data, id=search_id))
                         except ImportError:
                             st.info("💡 Para opciones de compra, descarga booking_helper.py")
                 
@@ -360,6 +209,99 @@ def main():
                 st.rerun()
             else:
                 st.error("Por favor completa todos los campos obligatorios")
+        
+        try:
+            from booking_helper import show_remembered_search_result
+            show_remembered_search_result('new_search', monitor)
+        except ImportError:
+            pass
+        
+        with st.expander("📅 Fechas flexibles (matriz de precios)"):
+            st.write("Compara precios de varias fechas de salida y regreso con una sola búsqueda, "
+                     "sin crear una búsqueda por cada combinación.")
+            col_a, col_b = st.columns(2)
+            with col_a:
+                departure_flex = st.slider("± días en la salida", 0, 7, 3)
+            with col_b:
+                return_flex = st.slider("± días en el regreso", 0, 7, 3, disabled=return_date is None)
+            
+            if st.button("🗓️ Buscar matriz de fechas"):
+                from flight_api_connector import build_date_pairs
+                try:
+                    date_pairs = build_date_pairs(
+                        max(departure_date - timedelta(days=departure_flex), datetime.now().date()),
+                        departure_date + timedelta(days=departure_flex),
+                        return_date - timedelta(days=return_flex) if return_date else None,
+                        return_date + timedelta(days=return_flex) if return_date else None
+                    )
+                except ValueError as e:
+                    st.error(str(e))
+                else:
+                    # Primero el coste; la búsqueda se lanza solo tras confirmarlo
+                    st.session_state['date_matrix_plan'] = {
+                        'origin': origin.upper(), 'destination': destination.upper(),
+                        'passengers': passengers, 'date_pairs': date_pairs,
+                        **monitor.plan_date_matrix(origin.upper(), destination.upper(),
+                                                   date_pairs, passengers=passengers)
+                    }
+            
+            plan = st.session_state.get('date_matrix_plan')
+            if plan:
+                st.info(f"🗓️ {plan['cells']} combinaciones: {plan['cached']} en caché y "
+                        f"{plan['to_fetch']} por consultar (hasta {plan['max_calls']} llamadas a las APIs)")
+                for provider, left in plan['budget_left'].items():
+                    if left is not None:
+                        st.caption(f"{provider}: quedan {left} llamadas este mes")
+                st.caption("Sin cupo en el limitador, la combinación queda sin datos en lugar de esperar.")
+                confirm_col, cancel_col = st.columns(2)
+                with confirm_col:
+                    run_matrix = st.button("✅ Confirmar y buscar")
+                with cancel_col:
+                    if st.button("✖️ Cancelar"):
+                        del st.session_state['date_matrix_plan']
+                        st.rerun()
+                if run_matrix:
+                    with st.spinner(f"Buscando {plan['cells']} combinaciones de fechas..."):
+                        matrix = monitor.search_date_matrix(plan['origin'], plan['destination'],
+                                                            plan['date_pairs'], passengers=plan['passengers'])
+                    st.session_state['date_matrix'] = {
+                        'origin': plan['origin'], 'destination': plan['destination'],
+                        'passengers': plan['passengers'], **matrix
+                    }
+                    del st.session_state['date_matrix_plan']
+            
+            matrix = st.session_state.get('date_matrix')
+            if matrix:
+                cells = pd.DataFrame([
+                    {'Salida': departure, 'Regreso': return_date or 'Solo ida',
+                     'price': result['price'] if result else None}
+                    for (departure, return_date), result in matrix['results'].items()
+                ])
+                grid = cells.pivot(index='Salida', columns='Regreso', values='price').sort_index()
+                fig = px.imshow(grid, text_auto='.0f', aspect='auto', color_continuous_scale='RdYlGn_r',
+                                title=f"Precios {matrix['origin']} → {matrix['destination']} (USD)")
+                st.plotly_chart(fig, use_container_width=True)
+                st.caption(f"{matrix['cached']} desde caché · {matrix['fetched']} consultadas · "
+                           f"{matrix['missing']} sin datos")
+                
+                priced = cells.dropna(subset=['price'])
+                if not priced.empty:
+                    best = priced.loc[priced['price'].idxmin()]
+                    st.success(f"💰 Mejor combinación: salida {best['Salida']}, regreso {best['Regreso']} "
+                               f"— ${best['price']:.2f} USD")
+                    if st.button("➕ Monitorear la mejor combinación"):
+                        best_return = None if best['Regreso'] == 'Solo ida' else best['Regreso']
+                        search_id = monitor.add_search({
+                            'name': f"{matrix['origin']}→{matrix['destination']} {best['Salida']}",
+                            'origin': matrix['origin'],
+                            'destination': matrix['destination'],
+                            'departure_date': best['Salida'],
+                            'return_date': best_return,
+                            'passengers': matrix['passengers'],
+                            'target_price': target_price,
+                            'email': notification_email
+                        })
+                        st.success(f"✅ Búsqueda creada con ID: {search_id}")
     
     with tab2:
         st.header("Búsquedas Activas")
@@ -367,6 +309,15 @@ def main():
         searches_df = monitor.get_searches()
         
         if not searches_df.empty:
+            if st.button("🔄 Chequear todas las búsquedas"):
+                with st.spinner(f"Chequeando {len(searches_df)} búsquedas..."):
+                    results = monitor.check_many(searches_df['id'].tolist())
+                hits = sum(1 for r in results.values() if r['meets_target'])
+                st.success(f"✅ {len(results)} búsquedas actualizadas, {hits} en precio objetivo")
+            
+            # Reglas de alerta de todas las búsquedas en una sola consulta
+            rules_by_search = dict(tuple(list_alert_rules(monitor.get_connection()).groupby('search_id')))
+            
             for _, search in searches_df.iterrows():
                 with st.expander(f"✈️ {search['search_name']} - {search['origin']} → {search['destination']}"):
                     col1, col2, col3 = st.columns([2, 1, 1])
@@ -391,38 +342,51 @@ def main():
                                     else:
                                         st.info(f"💰 Precio actual: ${flight['price']}")
                                     
-                                    # Mostrar opciones de compra para precios interesantes
-                                    if result['meets_target'] or result['is_lowest']:
-                                        try:
-                                            from booking_helper import add_booking_functionality_to_search_result
-                                            search_data_dict = {
-                                                'origin': search['origin'],
-                                                'destination': search['destination'],
-                                                'departure_date': search['departure_date'],
-                                                'return_date': search['return_date'],
-                                                'passengers': search['passengers']
-                                            }
-                                            add_booking_functionality_to_search_result(result, search_data_dict)
-                                        except ImportError:
-                                            st.info("💡 Descarga booking_helper.py para opciones de compra automáticas")
+                                    # Guardar las opciones de compra de precios interesantes
+                                    try:
+                                        from booking_helper import remember_search_result
+                                        search_data_dict = {
+                                            'id': search['id'],
+                                            'origin': search['origin'],
+                                            'destination': search['destination'],
+                                            'departure_date': search['departure_date'],
+                                            'return_date': search['return_date'],
+                                            'passengers': search['passengers']
+                                        }
+                                        interesting = result['meets_target'] or result['is_lowest']
+                                        remember_search_result(f"search_{search['id']}",
+                                                               result if interesting else None, search_data_dict)
+                                    except ImportError:
+                                        st.info("💡 Descarga booking_helper.py para opciones de compra automáticas")
                     
                     with col3:
                         if st.button(f"📊 Ver Historial", key=f"history_{search['id']}"):
                             st.session_state[f"show_history_{search['id']}"] = True
                     
+                    try:
+                        from booking_helper import show_remembered_search_result
+                        show_remembered_search_result(f"search_{search['id']}", monitor)
+                    except ImportError:
+                        pass
+                    
                     # Mostrar historial si se solicita
                     if st.session_state.get(f"show_history_{search['id']}", False):
                         history_df = monitor.get_price_history(search['id'])
-                        if not history_df.empty:
+                        # Serie con la resolución adecuada (crudo + rollups horarios/diarios)
+                        series_df = monitor.cached_read(
+                            ('price_series', int(search['id']), 'all'),
+                            lambda: load_price_series(monitor.get_connection(), search['id'])
+                        )
+                        if not series_df.empty:
                             history_df['checked_at'] = pd.to_datetime(history_df['checked_at'])
                             
                             # Gráfico de precios
                             fig = px.line(
-                                history_df, 
+                                series_df, 
                                 x='checked_at', 
                                 y='price',
                                 title=f"Evolución de precios - {search['search_name']}",
-                                markers=True
+                                markers=len(series_df) <= 200
                             )
                             fig.add_hline(
                                 y=search['target_price'], 
@@ -437,6 +401,20 @@ def main():
                                 history_df[['price', 'airline', 'checked_at']].sort_values('checked_at', ascending=False),
                                 use_container_width=True
                             )
+                    
+                    search_rules = rules_by_search.get(search['id'])
+                    if search_rules is not None:
+                        st.write("**🔔 Alertas configuradas:**")
+                        for rule in search_rules.itertuples():
+                            col_rule, col_delete = st.columns([4, 1])
+                            with col_rule:
+                                threshold = '' if pd.isna(rule.threshold) else f" ({rule.threshold:g})"
+                                st.write(f"• {ALERT_RULE_TYPES.get(rule.rule_type, rule.rule_type)}{threshold} "
+                                         f"— disparada {rule.fire_count} veces")
+                            with col_delete:
+                                if st.button("🗑️", key=f"delete_rule_{rule.id}"):
+                                    delete_alert_rule(monitor.get_connection(), rule.id)
+                                    st.rerun()
         else:
             st.info("No hay búsquedas activas. Crea una nueva búsqueda en la pestaña anterior.")
     
@@ -456,34 +434,59 @@ def main():
             if selected_search:
                 history_df = monitor.get_price_history(selected_search)
                 search_info = searches_df[searches_df['id'] == selected_search].iloc[0]
+                # Agregados mantenidos incrementalmente en search_stats
+                price_stats = monitor.get_search_stats(selected_search)
                 
-                if not history_df.empty:
+                if price_stats:
                     history_df['checked_at'] = pd.to_datetime(history_df['checked_at'])
                     
+                    chart_range = st.selectbox("Rango del gráfico", list(CHART_RANGES.keys()),
+                                               index=len(CHART_RANGES) - 1)
+                    range_days = CHART_RANGES[chart_range]
+                    range_end = datetime.utcnow() if range_days else None
+                    range_start = range_end - timedelta(days=range_days) if range_days else None
+                    series_df = monitor.cached_read(
+                        ('price_series', int(selected_search), chart_range),
+                        lambda: load_price_series(monitor.get_connection(), selected_search,
+                                                  range_start, range_end)
+                    )
+                    
                     col1, col2, col3, col4 = st.columns(4)
                     
                     with col1:
-                        st.metric("Precio Actual", f"${history_df['price'].iloc[0]:.2f}")
+                        st.metric("Precio Actual", f"${price_stats['current_price']:.2f}")
                     
                     with col2:
-                        min_price = history_df['price'].min()
+                        min_price = price_stats['min_price']
                         st.metric("Precio Mínimo", f"${min_price:.2f}")
                     
                     with col3:
-                        avg_price = history_df['price'].mean()
+                        avg_price = price_stats['mean_price']
                         st.metric("Precio Promedio", f"${avg_price:.2f}")
                     
                     with col4:
-                        price_change = history_df['price'].iloc[0] - history_df['price'].iloc[-1] if len(history_df) > 1 else 0
+                        price_change = series_df['price'].iloc[-1] - series_df['price'].iloc[0] if len(series_df) > 1 else 0
                         st.metric("Cambio Total", f"${price_change:.2f}", delta=f"{price_change:.2f}")
                     
                     # Gráfico detallado
                     fig = go.Figure()
                     
+                    if series_df.attrs.get('resolution', 'raw') != 'raw':
+                        # Banda mín/máx de cada bucket
+                        fig.add_trace(go.Scatter(
+                            x=series_df['checked_at'], y=series_df['max_price'],
+                            mode='lines', line=dict(width=0), showlegend=False, hoverinfo='skip'
+                        ))
+                        fig.add_trace(go.Scatter(
+                            x=series_df['checked_at'], y=series_df['min_price'],
+                            mode='lines', line=dict(width=0), fill='tonexty',
+                            fillcolor='rgba(0, 0, 255, 0.1)', name='Rango mín/máx'
+                        ))
+                    
                     fig.add_trace(go.Scatter(
-                        x=history_df['checked_at'],
-                        y=history_df['price'],
-                        mode='lines+markers',
+                        x=series_df['checked_at'],
+                        y=series_df['price'],
+                        mode='lines+markers' if len(series_df) <= 200 else 'lines',
                         name='Precio',
                         line=dict(color='blue', width=2),
                         marker=dict(size=6)
@@ -496,6 +499,27 @@ def main():
                         annotation_text="Precio Objetivo"
                     )
                     
+                    # Media móvil y EWMA calculadas en bloque por price_analytics
+                    route_history, route_summary = monitor.cached_read(
+                        ('route_analytics', int(selected_search)),
+                        lambda: compute_route_analytics(monitor, [selected_search])
+                    )
+                    if not route_history.empty:
+                        fig.add_trace(go.Scatter(
+                            x=route_history['checked_at'],
+                            y=route_history['rolling_mean'],
+                            mode='lines',
+                            name='Media móvil (5)',
+                            line=dict(color='orange', width=1, dash='dash')
+                        ))
+                        fig.add_trace(go.Scatter(
+                            x=route_history['checked_at'],
+                            y=route_history['ewma'],
+                            mode='lines',
+                            name='EWMA',
+                            line=dict(color='purple', width=1)
+                        ))
+                    
                     fig.add_hline(
                         y=avg_price,
                         line_dash="dot",
@@ -511,6 +535,8 @@ def main():
                     )
                     
                     st.plotly_chart(fig, use_container_width=True)
+                    st.caption(f"Resolución: {RESOLUTION_LABELS[series_df.attrs.get('resolution', 'raw')]} "
+                               f"({len(series_df)} puntos)")
                     
                     # Estadísticas adicionales
                     st.subheader("📊 Estadísticas")
@@ -519,26 +545,96 @@ def main():
                     
                     with col1:
                         st.write("**Resumen de precios:**")
-                        st.write(f"• Máximo: ${history_df['price'].max():.2f}")
-                        st.write(f"• Mínimo: ${history_df['price'].min():.2f}")
-                        st.write(f"• Mediana: ${history_df['price'].median():.2f}")
-                        st.write(f"• Desviación estándar: ${history_df['price'].std():.2f}")
+                        st.write(f"• Máximo: ${price_stats['max_price']:.2f}")
+                        st.write(f"• Mínimo: ${price_stats['min_price']:.2f}")
+                        if not history_df.empty:
+                            st.write(f"• Mediana (historial reciente): ${history_df['price'].median():.2f}")
+                        st.write(f"• Desviación estándar: ${price_stats['std_price']:.2f}")
+                        st.write(f"• Consultas registradas: {price_stats['check_count']}")
                     
                     with col2:
                         st.write("**Análisis de tendencia:**")
-                        if len(history_df) >= 2:
-                            recent_trend = history_df['price'].iloc[0] - history_df['price'].iloc[1]
-                            if recent_trend > 0:
-                                st.write("📈 Tendencia reciente: Subiendo")
-                            elif recent_trend < 0:
-                                st.write("📉 Tendencia reciente: Bajando")
-                            else:
-                                st.write("➡️ Tendencia reciente: Estable")
+                        if len(history_df) >= 2 and not route_summary.empty:
+                            route_row = route_summary.iloc[0]
+                            st.write(f"{describe_trend(route_row['trend_slope'], route_row['mean_price'])} "
+                                     f"({route_row['trend_slope']:+.2f} USD/día)")
+                            st.write(f"• Percentiles 10/50/90: ${route_row['p10']:.0f} / "
+                                     f"${route_row['p50']:.0f} / ${route_row['p90']:.0f}")
+                            st.write(f"• Caída máxima desde el pico: {route_row['max_drawdown']:.1%}")
                         
-                        price_below_target = (history_df['price'] <= search_info['target_price']).sum()
-                        st.write(f"• Veces por debajo del objetivo: {price_below_target}")
+                        below_low, below_high = monitor.cached_read(
+                            ('below_target', int(selected_search), float(search_info['target_price'])),
+                            lambda: count_at_or_below(monitor.get_connection(), selected_search,
+                                                      search_info['target_price'])
+                        )
+                        if below_low == below_high:
+                            st.write(f"• Veces por debajo del objetivo: {below_low}")
+                        else:
+                            # Parte del historial está compactada en buckets con solo mín/máx
+                            st.write(f"• Veces por debajo del objetivo: entre {below_low} y {below_high} "
+                                     f"(historial compactado)")
+
+                    # Ofertas guardadas de cada chequeo (sin nuevas llamadas a la API)
+                    breakdown = monitor.cached_read(
+                        ('offers_breakdown', int(selected_search)),
+                        lambda: offers_breakdown(monitor.get_connection(), selected_search)
+                    )
+                    if not breakdown.empty:
+                        st.subheader("🧾 Ofertas registradas")
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            direct = cheapest_offer(monitor.get_connection(), selected_search, direct_only=True)
+                            if direct:
+                                st.metric("Directo más barato", f"${direct['price']:.2f}",
+                                          help=f"{direct['carrier']} · {direct['checked_at']}")
+                            else:
+                                st.metric("Directo más barato", "Sin datos")
+                        with col2:
+                            carrier = st.selectbox("Aerolínea", sorted(breakdown['carrier'].dropna().unique()),
+                                                   key=f"offers_carrier_{selected_search}")
+                            by_carrier = cheapest_offer(monitor.get_connection(), selected_search, carrier=carrier)
+                            if by_carrier:
+                                st.metric(f"Más barato en {carrier}", f"${by_carrier['price']:.2f}",
+                                          help=f"{by_carrier['stops']} escalas · {by_carrier['checked_at']}")
+                        st.dataframe(
+                            breakdown.rename(columns={
+                                'carrier': 'Aerolínea', 'stops': 'Escalas', 'min_price': 'Precio mínimo',
+                                'offers': 'Ofertas', 'min_duration': 'Duración mínima (min)',
+                                'last_seen': 'Última vez'
+                            }),
+                            use_container_width=True
+                        )
                 else:
                     st.info("No hay suficientes datos para mostrar análisis.")
+            
+            with st.expander("🌐 Análisis de todas las rutas"):
+                all_history, all_summary = monitor.cached_read(
+                    ('route_analytics', 'all'),
+                    lambda: compute_route_analytics(monitor)
+                )
+                if not all_summary.empty:
+                    all_summary = all_summary.assign(tendencia=[
+                        describe_trend(slope, mean)
+                        for slope, mean in zip(all_summary['trend_slope'], all_summary['mean_price'])
+                    ])
+                    st.dataframe(
+                        all_summary[['search_name', 'origin', 'destination', 'checks', 'current_price',
+                                     'min_price', 'p50', 'p90', 'max_drawdown', 'trend_slope', 'tendencia']]
+                        .sort_values('trend_slope'),
+                        use_container_width=True
+                    )
+                    
+                    profile = days_to_departure_profile(all_history)
+                    fig = px.imshow(
+                        profile,
+                        labels=dict(x="Días hasta la salida", y="Ruta", color="Precio medio"),
+                        title="Precio medio según anticipación",
+                        aspect="auto",
+                        color_continuous_scale="RdYlGn_r"
+                    )
+                    st.plotly_chart(fig, use_container_width=True)
+                else:
+                    st.info("No hay historial suficiente.")
         else:
             st.info("No hay búsquedas para analizar.")
     
@@ -583,7 +679,7 @@ def main():
             
             if st.button("🔍 Probar APIs", type="primary"):
                 try:
-                    from flight_api_connector import test_api_connections
+                    from flight_api_streamlit import test_api_connections
                     test_api_connections()
                 except ImportError:
                     st.warning("flight_api_connector.py no encontrado")
@@ -593,28 +689,40 @@ def main():
             st.subheader("📊 Estadísticas de Uso")
             
             # Mostrar estadísticas básicas
-            conn = sqlite3.connect(monitor.db_path)
-            
-            # Contar búsquedas por fuente
-            source_stats = pd.read_sql_query('''
-                SELECT 
-                    CASE 
-                        WHEN flight_details LIKE '%Amadeus%' THEN 'Amadeus'
-                        WHEN flight_details LIKE '%Skyscanner%' THEN 'Skyscanner' 
-                        ELSE 'Simulación'
-                    END as source,
-                    COUNT(*) as count
-                FROM price_history 
-                GROUP BY source
-            ''', conn)
-            
-            conn.close()
-            
-            if not source_stats.empty:
-                for _, row in source_stats.iterrows():
-                    st.metric(f"Consultas {row['source']}", row['count'])
+            conn = monitor.get_connection()
+            
+            # Consultas reales por proveedor (índice de price_history.source)
+            source_stats = source_counts(conn)
+            
+            if source_stats:
+                for source, checks, calls in source_stats:
+                    st.metric(f"Consultas {source or 'sin registrar'}", calls,
+                              help=f"{checks} chequeos; {checks - calls} resueltos con la caché "
+                                   f"o con la respuesta de otra búsqueda")
+                st.caption("Solo cuenta el historial crudo: los chequeos ya compactados en "
+                           "rollups por la retención no aparecen aquí.")
             else:
                 st.write("No hay estadísticas disponibles")
+            
+            raw_stats = payload_stats(conn)
+            if raw_stats['payloads']:
+                st.metric(
+                    "Respuestas crudas guardadas",
+                    f"{raw_stats['payloads']} ({raw_stats['stored_bytes'] / 1024:.1f} KB)",
+                    help=(f"{raw_stats['references']} chequeos las referencian; "
+                          f"{raw_stats['raw_bytes'] / 1024:.1f} KB sin comprimir")
+                )
+            
+            # La caché que usa el conector de la app (con su nivel en disco, si lo hay)
+            response_cache = monitor.connector.cache if monitor.connector is not None else None
+            if response_cache is not None:
+                cache_stats = response_cache.stats()
+                st.metric(
+                    "Caché de respuestas",
+                    f"{cache_stats['hit_ratio']:.0%} aciertos",
+                    help=f"{cache_stats['hits']} aciertos, {cache_stats['misses']} fallos, "
+                         f"{cache_stats['entries']} itinerarios en memoria"
+                )
         
         st.markdown("---")
         
@@ -719,14 +827,21 @@ def main():
         with col1:
             st.subheader("🔄 Monitoreo Automático")
             
-            auto_check = st.checkbox("Activar chequeo automático")
-            if auto_check:
-                check_interval = st.selectbox(
-                    "Intervalo de chequeo",
-                    ["30 minutos", "1 hora", "2 horas", "6 horas", "12 horas"]
-                )
+            scheduler = get_scheduler()
+            if scheduler.is_active():
+                st.info(f"⏰ Chequeo automático cada {scheduler.interval_seconds // 60} min "
+                        "(compartido por todas las sesiones)")
                 
-                st.info(f"⏰ Próximo chequeo programado cada {check_interval}")
+                next_check = scheduler.seconds_until_next()
+                col_a, col_b = st.columns(2)
+                with col_a:
+                    st.metric("Búsquedas en cola", scheduler.pending_count())
+                with col_b:
+                    st.metric("Chequeos realizados", scheduler.checks_done)
+                if next_check is not None:
+                    st.write(f"• Próximo chequeo en {int(next_check // 60)} min")
+            else:
+                st.write("El chequeo automático está desactivado; actívalo en **Modo de operación**.")
             
             st.subheader("📧 Configuración de Email")
             
@@ -737,10 +852,37 @@ def main():
             
             if st.button("🧪 Probar Configuración de Email"):
                 if sender_email and sender_password:
-                    # Aquí implementarías la prueba de conexión
-                    st.success("✅ Configuración de email válida")
+                    tester = NotificationDispatcher(monitor.db_path, smtp_server, int(smtp_port),
+                                                    sender_email, sender_password)
+                    try:
+                        tester.open_smtp().quit()
+                        st.success("✅ Configuración de email válida")
+                    except Exception as e:
+                        st.error(f"❌ No se pudo conectar al servidor SMTP: {str(e)}")
                 else:
                     st.error("❌ Completa todos los campos de email")
+            
+            st.subheader("📬 Bandeja de salida")
+            outbox = outbox_stats(monitor.get_connection())
+            col_a, col_b, col_c = st.columns(3)
+            with col_a:
+                st.metric("Pendientes", outbox['pending'] + outbox['sending'])
+            with col_b:
+                st.metric("Enviadas", outbox['sent'])
+            with col_c:
+                st.metric("Fallidas", outbox['failed'])
+            
+            dispatcher = get_dispatcher()
+            if dispatcher is None:
+                st.caption("Configura EMAIL_USER y EMAIL_PASSWORD en Secrets para enviar las alertas")
+            elif st.button("📤 Enviar pendientes ahora"):
+                with st.spinner("Enviando notificaciones..."):
+                    sent = dispatcher.flush_all()
+                st.success(f"✅ {sent['sent']} alertas enviadas en {sent['emails']} emails")
+                if sent['retried']:
+                    st.warning(f"⚠️ {sent['retried']} alertas se reintentarán: {dispatcher.last_error}")
+                if sent['failed']:
+                    st.error(f"❌ {sent['failed']} alertas no se pudieron enviar: {dispatcher.last_error}")
         
         with col2:
             st.subheader("🗄️ Gestión de Datos")
@@ -748,23 +890,83 @@ def main():
             # Estadísticas de la base de datos
             searches_count = len(monitor.get_searches())
             
-            conn = sqlite3.connect(monitor.db_path)
-            total_price_checks = pd.read_sql_query("SELECT COUNT(*) as count FROM price_history", conn)['count'].iloc[0]
-            conn.close()
+            total_price_checks = monitor.cached_read(
+                ('price_history_count',),
+                lambda: monitor.get_connection().execute("SELECT COUNT(*) FROM price_history").fetchone()[0]
+            )
             
             st.metric("Búsquedas activas", searches_count)
             st.metric("Total de consultas realizadas", total_price_checks)
             
             st.subheader("🧹 Mantenimiento")
             
+            raw_days = st.number_input("Días de historial detallado a conservar", min_value=1, value=30)
             if st.button("🗑️ Limpiar historial antiguo"):
-                # Implementar limpieza de datos antiguos
-                st.success("Historial limpiado")
-            
-            if st.button("📥 Exportar datos"):
-                # Implementar exportación de datos
-                st.success("Datos exportados")
+                with st.spinner("Compactando historial..."):
+                    retention = apply_retention(monitor, raw_days=int(raw_days),
+                                                hourly_days=max(int(raw_days), 180))
+                st.success(f"Historial compactado: {retention['raw_rows_compacted']} registros pasaron a "
+                           f"resúmenes horarios y {retention['hourly_buckets_compacted']} horas a resúmenes diarios")
             
+            with st.expander("📥 Exportar datos"):
+                export_format = st.selectbox("Formato", list(EXPORT_FORMATS), key="export_format")
+                col_a, col_b = st.columns(2)
+                with col_a:
+                    export_origin = st.text_input("Origen (opcional)", key="export_origin")
+                    export_since = st.date_input("Desde (opcional)", value=None, key="export_since")
+                with col_b:
+                    export_destination = st.text_input("Destino (opcional)", key="export_destination")
+                    export_until = st.date_input("Hasta (opcional)", value=None, key="export_until")
+                
+                st.caption("Los periodos ya compactados no están en price_history: se exportan "
+                           "resumidos por hora y por día (price_rollup_hourly y price_rollup_daily).")
+                if st.button("📥 Exportar datos"):
+                    try:
+                        with st.spinner("Exportando..."):
+                            exported = export_all(
+                                monitor.db_path, fmt=export_format,
+                                origin=export_origin or None,
+                                destination=export_destination or None,
+                                since=export_since.strftime('%Y-%m-%d') if export_since else None,
+                                until=(export_until + timedelta(days=1)).strftime('%Y-%m-%d') if export_until else None
+                            )
+                        for table, info in exported.items():
+                            st.success(f"✅ {table}: {info['rows']} filas → `{info['path']}`")
+                            # Descarga directa solo para archivos pequeños
+                            if os.path.getsize(info['path']) <= MAX_DOWNLOAD_BYTES:
+                                with open(info['path'], 'rb') as export_file:
+                                    st.download_button(f"⬇️ Descargar {table}", export_file,
+                                                       file_name=os.path.basename(info['path']),
+                                                       key=f"download_{table}")
+                    except ImportError as e:
+                        st.error(str(e))
+
+            with st.expander("📤 Importar historial"):
+                uploaded = st.file_uploader("Archivo de precios (CSV, JSONL o Parquet)",
+                                            type=['csv', 'jsonl', 'ndjson', 'parquet'])
+                activate_imported = st.checkbox("Activar las búsquedas nuevas", value=False,
+                                                help="Las búsquedas creadas por la importación se monitorearán")
+                st.caption("Para archivos muy grandes usa `python data_import.py archivo --rebuild-indexes` "
+                           "con la interfaz y el worker detenidos.")
+
+                if uploaded is not None and st.button("📤 Importar"):
+                    suffix = os.path.splitext(uploaded.name)[1]
+                    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as staged:
+                        staged.write(uploaded.getbuffer())
+                    try:
+                        with st.spinner("Importando..."):
+                            report = import_prices(monitor, staged.name, fmt=detect_format(uploaded.name),
+                                                   activate_new=activate_imported)
+                        st.success(f"✅ {report['rows_imported']} de {report['rows_read']} filas importadas, "
+                                   f"{report['searches_created']} búsquedas nuevas")
+                        if report['rows_rejected']:
+                            st.warning(f"⚠️ {report['rows_rejected']} filas rechazadas")
+                            st.code('\n'.join(report['errors']))
+                    except (ImportError, ValueError) as e:
+                        st.error(str(e))
+                    finally:
+                        os.remove(staged.name)
+
             st.subheader("🔗 APIs de Vuelos")
             
             api_provider = st.selectbox(
@@ -779,6 +981,59 @@ def main():
                 if st.button("✅ Validar API"):
                     st.info("Validación de API pendiente de implementación")
 
+    with tab6:
+        st.header("Rendimiento")
+        st.caption("Métricas de este proceso desde su inicio. El worker flight_scheduler.py exporta las "
+                   "suyas con --metrics-port o --metrics-file.")
+        
+        metrics = get_metrics()
+        col1, col2, col3 = st.columns(3)
+        for column, (cache, label) in zip((col1, col2, col3), (('response', "Caché de respuestas"),
+                                                               ('read', "Caché de lecturas"),
+                                                               ('token', "Caché de tokens"))):
+            ratio = metrics.hit_ratio(cache)
+            column.metric(label, f"{ratio:.0%} aciertos" if ratio is not None else "Sin datos")
+        
+        timings = pd.DataFrame(metrics.histogram_rows())
+        if timings.empty:
+            st.info("Aún no hay mediciones: ejecuta algún chequeo.")
+        else:
+            timings['etapa'] = timings['metric'].str.replace('flight_', '', regex=False).str.replace('_seconds', '', regex=False)
+            timings['serie'] = timings['etapa'] + timings['labels'].map(lambda labels: f" ({labels})" if labels else "")
+            for quantile in ('mean', 'p50', 'p95', 'p99'):
+                timings[quantile] = timings[quantile] * 1000
+            
+            fig = px.bar(timings.sort_values('p95'), x='p95', y='serie', orientation='h',
+                         labels={'p95': "p95 (ms)", 'serie': ""}, title="Latencia p95 por etapa")
+            st.plotly_chart(fig, use_container_width=True)
+            st.dataframe(
+                timings[['serie', 'count', 'mean', 'p50', 'p95', 'p99', 'sum']].rename(columns={
+                    'serie': 'Etapa', 'count': 'Llamadas', 'mean': 'Media (ms)', 'p50': 'p50 (ms)',
+                    'p95': 'p95 (ms)', 'p99': 'p99 (ms)', 'sum': 'Total (s)'
+                }),
+                use_container_width=True
+            )
+        
+        counters = metrics.counter_rows()
+        provider_rows = [dict(row['labels'], value=row['value']) for row in counters
+                         if row['metric'] in ('flight_provider_calls_total', 'flight_provider_errors_total')]
+        if provider_rows:
+            st.subheader("Proveedores")
+            provider_df = pd.DataFrame(provider_rows)
+            if 'status' in provider_df:
+                calls = provider_df.dropna(subset=['status']).pivot_table(
+                    index='provider', columns='status', values='value', aggfunc='sum', fill_value=0)
+                st.write("**Consultas por resultado**")
+                st.dataframe(calls, use_container_width=True)
+            if 'code' in provider_df:
+                errors = provider_df.dropna(subset=['code']).pivot_table(
+                    index='provider', columns='code', values='value', aggfunc='sum', fill_value=0)
+                st.write("**Avisos y errores por código**")
+                st.dataframe(errors, use_container_width=True)
+        
+        st.download_button("📥 Descargar métricas (Prometheus)", data=metrics.render_prometheus(),
+                           file_name="flight_metrics.prom", mime="text/plain")
+
     # Footer
     st.markdown("---")
     st.markdown("🚀 **Monitor de Precios de Vuelos** - Encuentra las mejores ofertas automáticamente")
@@ -0,0 +1,394 @@
+"""
+Bandeja de salida de notificaciones por email
+Las alertas se encolan en la tabla notifications y un despachador en segundo
+plano las envía por lotes: una sola conexión SMTP autenticada por lote, un
+resumen por destinatario y reintentos con espera exponencial.
+
+Uso como proceso independiente:
+    python flight_notifications.py --once
+"""
+
+import argparse
+import logging
+import os
+import smtplib
+import sqlite3
+import threading
+import time
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Estados de una notificación en la bandeja de salida
+STATUS_PENDING = 'pending'
+STATUS_SENDING = 'sending'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+
+# Una alerta con la misma clave de deduplicación no se reenvía dentro de esta ventana
+DEFAULT_DEDUP_WINDOW = 24 * 3600
+
+# Migración de la tabla notifications a bandeja de salida. Las filas previas
+# quedan como 'sent'; las nuevas se insertan explícitamente como 'pending'.
+OUTBOX_MIGRATION_SQL = [
+    'ALTER TABLE notifications ADD COLUMN recipient TEXT',
+    'ALTER TABLE notifications ADD COLUMN subject TEXT',
+    f"ALTER TABLE notifications ADD COLUMN status TEXT NOT NULL DEFAULT '{STATUS_SENT}'",
+    'ALTER TABLE notifications ADD COLUMN dedup_key TEXT',
+    'ALTER TABLE notifications ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0',
+    'ALTER TABLE notifications ADD COLUMN next_attempt_at REAL NOT NULL DEFAULT 0',
+    'ALTER TABLE notifications ADD COLUMN queued_at REAL',
+    'ALTER TABLE notifications ADD COLUMN last_error TEXT',
+    'CREATE INDEX IF NOT EXISTS idx_notifications_outbox ON notifications (status, next_attempt_at)',
+    'CREATE INDEX IF NOT EXISTS idx_notifications_dedup ON notifications (dedup_key, queued_at)',
+]
+
+# Inserción con deduplicación en una sola sentencia (atómica entre procesos)
+ENQUEUE_SQL = f'''
+    INSERT INTO notifications
+        (search_id, notification_type, message, recipient, subject, status,
+         dedup_key, attempts, next_attempt_at, queued_at, sent_at)
+    SELECT :search_id, :notification_type, :message, :recipient, :subject, '{STATUS_PENDING}',
+           :dedup_key, 0, :now, :now, NULL
+    WHERE :dedup_key IS NULL OR NOT EXISTS (
+        SELECT 1 FROM notifications
+        WHERE dedup_key = :dedup_key AND queued_at >= :dedup_since AND status != '{STATUS_FAILED}'
+    )
+'''
+
+
+def enqueue_notifications(conn: sqlite3.Connection, notifications: List[Dict],
+                          dedup_window: float = DEFAULT_DEDUP_WINDOW) -> int:
+    """
+    Encola varias notificaciones en una transacción.
+
+    Cada elemento lleva recipient, subject y message, y opcionalmente
+    search_id, notification_type y dedup_key. Devuelve cuántas se encolaron
+    (las duplicadas dentro de la ventana se descartan).
+    """
+    now = time.time()
+    rows = [{
+        'search_id': item.get('search_id'),
+        'notification_type': item.get('notification_type', 'price_alert'),
+        'message': item['message'],
+        'recipient': item['recipient'],
+        'subject': item['subject'],
+        'dedup_key': item.get('dedup_key'),
+        'now': now,
+        'dedup_since': now - dedup_window,
+    } for item in notifications if item.get('recipient')]
+    if not rows:
+        return 0
+
+    queued = 0
+    with conn:
+        # executemany no acumula rowcount de INSERT ... SELECT de forma fiable
+        for row in rows:
+            queued += conn.execute(ENQUEUE_SQL, row).rowcount
+    return queued
+
+
+def outbox_stats(conn: sqlite3.Connection) -> Dict[str, int]:
+    """Número de notificaciones por estado"""
+    stats = {STATUS_PENDING: 0, STATUS_SENDING: 0, STATUS_SENT: 0, STATUS_FAILED: 0}
+    for status, count in conn.execute('SELECT status, COUNT(*) FROM notifications GROUP BY status'):
+        stats[status] = count
+    return stats
+
+
+def load_smtp_settings(getter: Callable) -> Optional[Dict]:
+    """Configuración SMTP desde secretos/variables de entorno, o None si falta"""
+    sender_email = getter("EMAIL_USER")
+    sender_password = getter("EMAIL_PASSWORD")
+    if not sender_email or not sender_password:
+        return None
+    return {
+        'smtp_server': getter("SMTP_SERVER", "smtp.gmail.com"),
+        'smtp_port': int(getter("SMTP_PORT", "587")),
+        'sender_email': sender_email,
+        'sender_password': sender_password,
+    }
+
+
+def build_digest(items: List[Dict]) -> tuple:
+    """Asunto y cuerpo de un email que agrupa varias alertas del mismo destinatario"""
+    if len(items) == 1:
+        return items[0]['subject'], items[0]['message']
+    subject = f"✈️ {len(items)} alertas de precios de vuelos"
+    separator = '\n' + '-' * 40 + '\n'
+    body = separator.join(f"{item['subject']}\n\n{item['message']}" for item in items)
+    return subject, body
+
+
+class NotificationDispatcher:
+    """
+    Envía la bandeja de salida por lotes.
+
+    Cada lote reclama las notificaciones vencidas (marcándolas 'sending' con
+    un plazo para que otro proceso no las duplique), las agrupa por
+    destinatario y las envía con una sola conexión SMTP. Los fallos
+    transitorios se reintentan con espera exponencial hasta `max_attempts`.
+    """
+
+    def __init__(self, db_path: str, smtp_server: str, smtp_port: int,
+                 sender_email: str, sender_password: str, use_tls: bool = True,
+                 batch_size: int = 200, max_attempts: int = 5, retry_base_seconds: float = 60.0,
+                 claim_timeout: float = 600.0, poll_seconds: float = 30.0, smtp_timeout: float = 30.0,
+                 smtp_factory: Callable = smtplib.SMTP):
+        self.db_path = db_path
+        self.smtp_server = smtp_server
+        self.smtp_port = int(smtp_port)
+        self.sender_email = sender_email
+        self.sender_password = sender_password
+        self.use_tls = use_tls
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.claim_timeout = claim_timeout
+        self.poll_seconds = poll_seconds
+        self.smtp_timeout = smtp_timeout
+        self.smtp_factory = smtp_factory
+
+        self._flush_lock = threading.Lock()
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.emails_sent = 0
+        self.notifications_sent = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+
+    # ------------------------------------------------------------------
+    # Base de datos
+    # ------------------------------------------------------------------
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute('PRAGMA busy_timeout = 30000')
+        return conn
+
+    def claim_batch(self, conn: sqlite3.Connection) -> List[Dict]:
+        """Reclama hasta batch_size notificaciones vencidas (incluye reclamos caducados)"""
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute(f'''
+                SELECT id, recipient, subject, message, attempts
+                FROM notifications
+                WHERE status IN ('{STATUS_PENDING}', '{STATUS_SENDING}') AND next_attempt_at <= ?
+                ORDER BY next_attempt_at, id
+                LIMIT ?
+            ''', (now, self.batch_size)).fetchall()
+            conn.executemany(
+                f"UPDATE notifications SET status = '{STATUS_SENDING}', next_attempt_at = ? WHERE id = ?",
+                [(now + self.claim_timeout, row[0]) for row in rows]
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return [dict(zip(('id', 'recipient', 'subject', 'message', 'attempts'), row)) for row in rows]
+
+    def _mark_sent(self, conn: sqlite3.Connection, ids: List[int]):
+        conn.executemany(
+            f"UPDATE notifications SET status = '{STATUS_SENT}', sent_at = CURRENT_TIMESTAMP, "
+            "last_error = NULL WHERE id = ?",
+            [(notification_id,) for notification_id in ids]
+        )
+
+    def _mark_retry(self, conn: sqlite3.Connection, items: List[Dict], error: str,
+                    permanent: bool = False) -> int:
+        """Reprograma los avisos con backoff. Devuelve cuántos quedaron como fallidos definitivos"""
+        now = time.time()
+        params = []
+        final = 0
+        for item in items:
+            attempts = item['attempts'] + 1
+            failed = permanent or attempts >= self.max_attempts
+            final += failed
+            delay = self.retry_base_seconds * (2 ** (attempts - 1))
+            params.append((STATUS_FAILED if failed else STATUS_PENDING, attempts,
+                           now + delay, error[:500], item['id']))
+        conn.executemany(
+            'UPDATE notifications SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?',
+            params
+        )
+        self.failures += len(items)
+        self.last_error = error
+        return final
+
+    # ------------------------------------------------------------------
+    # SMTP
+    # ------------------------------------------------------------------
+    def open_smtp(self):
+        """Conexión SMTP autenticada (una por lote)"""
+        server = self.smtp_factory(self.smtp_server, self.smtp_port, timeout=self.smtp_timeout)
+        if self.use_tls:
+            server.starttls()
+        server.login(self.sender_email, self.sender_password)
+        return server
+
+    def build_message(self, recipient: str, subject: str, body: str) -> str:
+        msg = MIMEMultipart()
+        msg['From'] = self.sender_email
+        msg['To'] = recipient
+        msg['Subject'] = subject
+        msg.attach(MIMEText(body, 'plain'))
+        return msg.as_string()
+
+    # ------------------------------------------------------------------
+    # Envío
+    # ------------------------------------------------------------------
+    def flush(self) -> Dict[str, int]:
+        """
+        Envía un lote de la bandeja de salida. Devuelve contadores del lote:
+        emails enviados, avisos enviados, avisos que se reintentarán y avisos
+        que quedaron como fallidos definitivos.
+        """
+        result = {'emails': 0, 'sent': 0, 'retried': 0, 'failed': 0}
+        with self._flush_lock:
+            conn = self._connect()
+            try:
+                items = self.claim_batch(conn)
+                if not items:
+                    return result
+
+                by_recipient: Dict[str, List[Dict]] = {}
+                for item in items:
+                    by_recipient.setdefault(item['recipient'], []).append(item)
+
+                try:
+                    server = self.open_smtp()
+                except (smtplib.SMTPException, OSError) as e:
+                    # Sin conexión no se envía nada: todo el lote se reintenta
+                    with conn:
+                        result['failed'] = self._mark_retry(conn, items, f"Conexión SMTP: {e}")
+                    result['retried'] = len(items) - result['failed']
+                    logger.warning("No se pudo conectar al servidor SMTP: %s", e)
+                    return result
+
+                sent_ids = []
+                try:
+                    for recipient, recipient_items in by_recipient.items():
+                        subject, body = build_digest(recipient_items)
+                        message = self.build_message(recipient, subject, body)
+                        try:
+                            try:
+                                server.sendmail(self.sender_email, recipient, message)
+                            except smtplib.SMTPServerDisconnected:
+                                # El servidor cerró la sesión a mitad de lote: reconectar una vez
+                                server = self.open_smtp()
+                                server.sendmail(self.sender_email, recipient, message)
+                        except smtplib.SMTPRecipientsRefused as e:
+                            with conn:
+                                result['failed'] += self._mark_retry(conn, recipient_items,
+                                                                     f"Destinatario rechazado: {e}",
+                                                                     permanent=True)
+                            continue
+                        except (smtplib.SMTPException, OSError) as e:
+                            with conn:
+                                failed = self._mark_retry(conn, recipient_items, str(e))
+                            result['failed'] += failed
+                            result['retried'] += len(recipient_items) - failed
+                            continue
+                        sent_ids.extend(item['id'] for item in recipient_items)
+                        result['emails'] += 1
+                finally:
+                    try:
+                        server.quit()
+                    except (smtplib.SMTPException, OSError):
+                        pass
+                    with conn:
+                        self._mark_sent(conn, sent_ids)
+
+                result['sent'] = len(sent_ids)
+                self.emails_sent += result['emails']
+                self.notifications_sent += result['sent']
+                return result
+            finally:
+                conn.close()
+
+    def flush_all(self, max_batches: int = 100) -> Dict[str, int]:
+        """
+        Envía lotes hasta vaciar lo vencido de la bandeja. Sigue mientras cada
+        lote deje avisos en un estado final (enviados o fallidos); un lote que
+        solo reprograma reintentos detiene la ronda.
+        """
+        totals = {'emails': 0, 'sent': 0, 'retried': 0, 'failed': 0}
+        for _ in range(max_batches):
+            batch = self.flush()
+            for key in totals:
+                totals[key] += batch[key]
+            if not batch['sent'] and not batch['failed']:
+                break
+        return totals
+
+    def wake(self):
+        """Pide un envío inmediato al hilo en segundo plano"""
+        self._wake_event.set()
+
+    def run_forever(self):
+        while not self._stop_event.is_set():
+            try:
+                self.flush_all()
+            except Exception:
+                logger.exception("Error enviando notificaciones")
+            self._wake_event.wait(self.poll_seconds)
+            self._wake_event.clear()
+
+    def start(self):
+        """Arranca el despachador en un hilo en segundo plano"""
+        if self.is_running():
+            if not self._stop_event.is_set():
+                return
+            self._thread.join()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run_forever, name="notification-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if not self._thread.is_alive():
+                self._thread = None
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Despachador de notificaciones por email")
+    parser.add_argument("--db", default="flight_prices.db", help="Ruta a la base de datos SQLite")
+    parser.add_argument("--poll", type=float, default=30.0, help="Segundos entre revisiones de la bandeja")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--once", action="store_true", help="Envía lo pendiente una sola vez y sale")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    settings = load_smtp_settings(os.getenv)
+    if settings is None:
+        parser.error("Configura EMAIL_USER y EMAIL_PASSWORD en el entorno")
+
+    from flight_storage import FlightPriceMonitor
+    # Garantiza que el esquema (bandeja de salida incluida) esté migrado
+    FlightPriceMonitor(db_path=args.db)
+    dispatcher = NotificationDispatcher(args.db, batch_size=args.batch_size,
+                                        poll_seconds=args.poll, **settings)
+    if args.once:
+        logger.info("Envío: %s", dispatcher.flush_all())
+        return
+
+    logger.info("Despachador de notificaciones iniciado")
+    try:
+        dispatcher.run_forever()
+    except KeyboardInterrupt:
+        logger.info("Despachador detenido")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Modelo compacto de ofertas de vuelo
+Guarda todas las ofertas devueltas por un proveedor en cada chequeo (no solo
+la más barata) para responder consultas como "el directo más barato" o "el
+más barato en Avianca" con datos ya almacenados, sin nuevas llamadas a la API.
+"""
+
+import re
+from array import array
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import pandas as pd
+
+# Ofertas guardadas por chequeo (las más baratas)
+MAX_OFFERS_PER_CHECK = 10
+
+
+class FlightOffer(NamedTuple):
+    """Una oferta de vuelo. Respaldada por una tupla: sin __dict__ por instancia"""
+    price: float
+    currency: str
+    carrier: Optional[str]
+    stops: int
+    duration_minutes: Optional[int] = None
+    segment_minutes: Tuple[int, ...] = ()
+
+
+# Tabla sin rowid: la clave (chequeo, posición) ya identifica cada oferta.
+# Las duraciones de los segmentos se guardan como un array de uint16 en un BLOB.
+OFFERS_MIGRATION_SQL = [
+    '''
+    CREATE TABLE IF NOT EXISTS offers (
+        price_history_id INTEGER NOT NULL,
+        offer_rank INTEGER NOT NULL,
+        search_id INTEGER NOT NULL,
+        price REAL NOT NULL,
+        currency TEXT,
+        carrier TEXT,
+        stops INTEGER NOT NULL,
+        duration_minutes INTEGER,
+        segment_minutes BLOB,
+        PRIMARY KEY (price_history_id, offer_rank),
+        FOREIGN KEY (price_history_id) REFERENCES price_history (id)
+    ) WITHOUT ROWID
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_offers_search_price ON offers (search_id, price)',
+]
+
+ISO_DURATION = re.compile(r'P(?:(\d+)D)?T?(?:(\d+)H)?(?:(\d+)M)?')
+
+
+def parse_iso_duration(value: Optional[str]) -> Optional[int]:
+    """Duración ISO 8601 de Amadeus (p. ej. PT7H35M) en minutos"""
+    if not value:
+        return None
+    match = ISO_DURATION.fullmatch(value)
+    if not match:
+        return None
+    days, hours, minutes = (int(part or 0) for part in match.groups())
+    return days * 1440 + hours * 60 + minutes
+
+
+def encode_segments(segment_minutes: Sequence[int]) -> Optional[bytes]:
+    if not segment_minutes:
+        return None
+    return array('H', (min(int(minutes), 65535) for minutes in segment_minutes)).tobytes()
+
+
+def decode_segments(blob: Optional[bytes]) -> Tuple[int, ...]:
+    if not blob:
+        return ()
+    segments = array('H')
+    segments.frombytes(blob)
+    return tuple(segments)
+
+
+def as_offer(value) -> FlightOffer:
+    """Normaliza una oferta (p. ej. leída como lista desde la caché JSON en disco)"""
+    if isinstance(value, FlightOffer):
+        return value
+    if isinstance(value, dict):
+        return FlightOffer(**value)
+    price, currency, carrier, stops, duration, segments = (list(value) + [None, ()])[:6]
+    return FlightOffer(float(price), currency, carrier, int(stops), duration, tuple(segments or ()))
+
+
+def select_offers(offers: Iterable[FlightOffer], limit: int = MAX_OFFERS_PER_CHECK) -> List[FlightOffer]:
+    """Ofertas ordenadas por precio, sin duplicados exactos y acotadas a `limit`"""
+    unique = {}
+    for offer in sorted((as_offer(offer) for offer in offers), key=lambda o: o.price):
+        unique.setdefault((offer.price, offer.carrier, offer.stops, offer.duration_minutes), offer)
+    return list(unique.values())[:limit]
+
+
+def offers_from_amadeus(offers: List[Dict], airline_name: Callable[[str], str]) -> List[FlightOffer]:
+    """Convierte flight-offers de Amadeus. Las escalas son las del itinerario con más tramos"""
+    parsed = []
+    for offer in offers:
+        try:
+            itineraries = offer['itineraries']
+            segments = [segment for itinerary in itineraries for segment in itinerary['segments']]
+            carrier_code = (offer.get('validatingAirlineCodes') or [segments[0]['carrierCode']])[0]
+            durations = [parse_iso_duration(itinerary.get('duration')) for itinerary in itineraries]
+            parsed.append(FlightOffer(
+                price=float(offer['price']['total']),
+                currency=offer['price'].get('currency', 'USD'),
+                carrier=airline_name(carrier_code),
+                stops=max(len(itinerary['segments']) - 1 for itinerary in itineraries),
+                duration_minutes=sum(durations) if all(d is not None for d in durations) else None,
+                segment_minutes=tuple(parse_iso_duration(segment.get('duration')) or 0 for segment in segments),
+            ))
+        except (KeyError, IndexError, TypeError, ValueError):
+            # Una oferta mal formada no invalida el resto de la respuesta
+            continue
+    return select_offers(parsed)
+
+
+def offers_from_skyscanner(data: Dict, currency: str = 'USD') -> List[FlightOffer]:
+    """Convierte Quotes de browsequotes de Skyscanner (sin duraciones)"""
+    carriers = {carrier['CarrierId']: carrier['Name'] for carrier in data.get('Carriers', [])}
+    parsed = []
+    for quote in data.get('Quotes', []):
+        try:
+            outbound = quote['OutboundLeg']
+            carrier_ids = outbound.get('CarrierIds') or [None]
+            stops = 0 if quote.get('Direct') else len(outbound.get('StopIds', []))
+            parsed.append(FlightOffer(
+                price=float(quote['MinPrice']),
+                currency=currency,
+                carrier=carriers.get(carrier_ids[0], "Aerolínea"),
+                stops=stops,
+            ))
+        except (KeyError, TypeError, ValueError):
+            continue
+    return select_offers(parsed)
+
+
+def describe_stops(stops: int) -> str:
+    if stops == 0:
+        return "Vuelo directo"
+    return f"{stops} escala{'s' if stops > 1 else ''}"
+
+
+def offer_rows(price_history_id: int, search_id: int, offers: Iterable) -> List[tuple]:
+    """Filas de la tabla offers para un chequeo"""
+    return [
+        (price_history_id, rank, search_id, offer.price, offer.currency, offer.carrier,
+         offer.stops, offer.duration_minutes, encode_segments(offer.segment_minutes))
+        for rank, offer in enumerate(select_offers(offers))
+    ]
+
+
+def store_offers(conn, rows: List[tuple]):
+    """Inserta filas de offer_rows (dentro de la transacción del chequeo)"""
+    if rows:
+        conn.executemany('''
+            INSERT OR REPLACE INTO offers
+            (price_history_id, offer_rank, search_id, price, currency, carrier, stops,
+             duration_minutes, segment_minutes)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+
+
+def cheapest_offer(conn, search_id: int, carrier: Optional[str] = None,
+                   direct_only: bool = False, since: Optional[str] = None) -> Optional[Dict]:
+    """
+    Oferta más barata guardada de una búsqueda, opcionalmente filtrada por
+    aerolínea, solo vuelos directos o chequeos desde una fecha.
+    """
+    query = '''
+        SELECT o.price, o.currency, o.carrier, o.stops, o.duration_minutes, o.segment_minutes, p.checked_at
+        FROM offers o JOIN price_history p ON p.id = o.price_history_id
+        WHERE o.search_id = ?
+    '''
+    params = [int(search_id)]
+    if carrier:
+        query += ' AND o.carrier = ?'
+        params.append(carrier)
+    if direct_only:
+        query += ' AND o.stops = 0'
+    if since:
+        query += ' AND p.checked_at >= ?'
+        params.append(since)
+    row = conn.execute(query + ' ORDER BY o.price LIMIT 1', params).fetchone()
+    if not row:
+        return None
+    return {
+        'price': row[0], 'currency': row[1], 'carrier': row[2], 'stops': row[3],
+        'duration_minutes': row[4], 'segment_minutes': decode_segments(row[5]), 'checked_at': row[6],
+    }
+
+
+def offers_breakdown(conn, search_id: int, since: Optional[str] = None) -> pd.DataFrame:
+    """Precio mínimo guardado por aerolínea y número de escalas"""
+    query = '''
+        SELECT o.carrier, o.stops, MIN(o.price) AS min_price, COUNT(*) AS offers,
+               MIN(o.duration_minutes) AS min_duration, MAX(p.checked_at) AS last_seen
+        FROM offers o JOIN price_history p ON p.id = o.price_history_id
+        WHERE o.search_id = ?
+    '''
+    params = [int(search_id)]
+    if since:
+        query += ' AND p.checked_at >= ?'
+        params.append(since)
+    query += ' GROUP BY o.carrier, o.stops ORDER BY min_price'
+    return pd.read_sql_query(query, conn, params=params)
@@ -0,0 +1,311 @@
+"""
+Planificador de chequeos automáticos de precios
+Ejecuta FlightPriceMonitor.check_flights_and_update para cada búsqueda activa
+usando una cola de prioridad ordenada por la próxima hora de chequeo.
+
+Uso como proceso independiente:
+    python flight_scheduler.py --interval 60
+"""
+
+import argparse
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Intervalos disponibles en la interfaz (en minutos)
+CHECK_INTERVALS = {
+    "30 minutos": 30,
+    "1 hora": 60,
+    "2 horas": 120,
+    "6 horas": 360,
+    "12 horas": 720,
+}
+
+
+def parse_db_timestamp(value: Optional[str]) -> Optional[float]:
+    """Convierte un CURRENT_TIMESTAMP de SQLite (UTC) a epoch en segundos"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.strptime(value[:19], '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        return None
+    return parsed.replace(tzinfo=timezone.utc).timestamp()
+
+
+class FlightCheckScheduler:
+    """
+    Cola de prioridad de chequeos pendientes.
+
+    Cada búsqueda activa tiene una entrada (next_due, search_id) en un heap;
+    en cada tick solo se extraen las entradas vencidas, sin recorrer la tabla.
+    La lista de búsquedas activas se resincroniza cada `refresh_seconds`.
+    """
+
+    def __init__(self, monitor, interval_minutes: int = 60,
+                 refresh_seconds: int = 300, max_checks_per_tick: int = 100):
+        self.monitor = monitor
+        self.interval_seconds = interval_minutes * 60
+        self.refresh_seconds = refresh_seconds
+        self.max_checks_per_tick = max_checks_per_tick
+        self.intervals: Dict[int, int] = {}
+
+        self._heap: List[Tuple[float, int]] = []
+        self._due: Dict[int, float] = {}
+        self._last_checked: Dict[int, float] = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_refresh = 0.0
+
+        self.checks_done = 0
+        self.errors = 0
+        self.last_check_at: Optional[float] = None
+
+    # ------------------------------------------------------------------
+    # Configuración
+    # ------------------------------------------------------------------
+    def interval_for(self, search_id: int) -> int:
+        """Intervalo en segundos para una búsqueda (permite sobrescribir por búsqueda)"""
+        return self.intervals.get(search_id, self.interval_seconds)
+
+    def set_interval(self, interval_minutes: int, search_id: Optional[int] = None):
+        """Cambia el intervalo global o el de una búsqueda concreta"""
+        with self._lock:
+            if search_id is None:
+                self.interval_seconds = interval_minutes * 60
+            else:
+                self.intervals[search_id] = interval_minutes * 60
+            # Reprogramar para que el nuevo intervalo aplique de inmediato
+            self._rebuild_heap(reschedule=True)
+
+    # ------------------------------------------------------------------
+    # Cola de prioridad
+    # ------------------------------------------------------------------
+    def _push(self, search_id: int, next_due: float):
+        self._due[search_id] = next_due
+        heapq.heappush(self._heap, (next_due, search_id))
+
+    def _rebuild_heap(self, reschedule: bool = False):
+        if reschedule:
+            now = time.time()
+            for search_id, last_checked in self._last_checked.items():
+                if search_id in self._due:
+                    self._due[search_id] = max(now, last_checked + self.interval_for(search_id))
+        self._heap = [(due, search_id) for search_id, due in self._due.items()]
+        heapq.heapify(self._heap)
+
+    def load_active_searches(self) -> Dict[int, Optional[float]]:
+        """Obtiene las búsquedas activas y la fecha de su último chequeo"""
+        rows = self.monitor.get_connection().execute('''
+            SELECT s.id, st.last_checked_at
+            FROM flight_searches s
+            LEFT JOIN search_stats st ON st.search_id = s.id
+            WHERE s.is_active = 1
+        ''').fetchall()
+        return {search_id: parse_db_timestamp(last) for search_id, last in rows}
+
+    def refresh(self):
+        """Sincroniza la cola con las búsquedas activas de la base de datos"""
+        active = self.load_active_searches()
+        now = time.time()
+        with self._lock:
+            removed = set(self._due) - set(active)
+            for search_id in removed:
+                # Borrado perezoso: la entrada del heap se descarta al extraerla
+                del self._due[search_id]
+                self._last_checked.pop(search_id, None)
+
+            for search_id, last_checked in active.items():
+                if search_id in self._due:
+                    continue
+                if last_checked is None:
+                    next_due = now
+                else:
+                    self._last_checked[search_id] = last_checked
+                    next_due = max(now, last_checked + self.interval_for(search_id))
+                self._push(search_id, next_due)
+
+            # Compactar el heap si acumula demasiadas entradas obsoletas
+            if len(self._heap) > 2 * max(len(self._due), 1):
+                self._rebuild_heap()
+        self._last_refresh = now
+
+    def _pop_due(self, now: float, limit: int) -> List[int]:
+        due_ids = []
+        with self._lock:
+            while self._heap and len(due_ids) < limit:
+                next_due, search_id = self._heap[0]
+                if next_due > now:
+                    break
+                heapq.heappop(self._heap)
+                # Ignorar entradas obsoletas (búsqueda eliminada o reprogramada)
+                if self._due.get(search_id) != next_due:
+                    continue
+                due_ids.append(search_id)
+        return due_ids
+
+    def seconds_until_next(self) -> Optional[float]:
+        """Segundos hasta el próximo chequeo programado"""
+        with self._lock:
+            while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            if not self._heap:
+                return None
+            return max(0.0, self._heap[0][0] - time.time())
+
+    def pending_count(self) -> int:
+        return len(self._due)
+
+    # ------------------------------------------------------------------
+    # Ejecución
+    # ------------------------------------------------------------------
+    def run_pending(self) -> int:
+        """Ejecuta los chequeos vencidos y los reprograma. Devuelve cuántos se hicieron"""
+        if time.time() - self._last_refresh >= self.refresh_seconds:
+            self.refresh()
+
+        due_ids = self._pop_due(time.time(), self.max_checks_per_tick)
+        if not due_ids:
+            return 0
+
+        checked = set()
+        try:
+            if hasattr(self.monitor, 'check_many'):
+                # Un solo lote: itinerarios deduplicados y una única transacción
+                checked = set(self.monitor.check_many(due_ids))
+            else:
+                for search_id in due_ids:
+                    if self.monitor.check_flights_and_update(search_id):
+                        checked.add(search_id)
+        except Exception:
+            logger.exception("Error chequeando búsquedas %s", due_ids)
+
+        self.checks_done += len(checked)
+        self.errors += len(due_ids) - len(checked)
+        finished = time.time()
+        self.last_check_at = finished
+        with self._lock:
+            for search_id in due_ids:
+                if search_id in self._due:
+                    self._last_checked[search_id] = finished
+                    self._push(search_id, finished + self.interval_for(search_id))
+        return len(due_ids)
+
+    def run_forever(self, max_sleep: float = 30.0):
+        """Bucle principal: duerme hasta el próximo vencimiento o hasta detenerse"""
+        self.refresh()
+        while not self._stop_event.is_set():
+            if self.run_pending():
+                continue
+            wait = self.seconds_until_next()
+            until_refresh = self._last_refresh + self.refresh_seconds - time.time()
+            candidates = [max_sleep, max(until_refresh, 0.0)]
+            if wait is not None:
+                candidates.append(wait)
+            self._stop_event.wait(max(min(candidates), 0.1))
+
+    def start(self):
+        """Arranca el planificador en un hilo en segundo plano"""
+        if self.is_running():
+            if not self._stop_event.is_set():
+                return
+            # Esperar a que termine un hilo detenido antes de relanzarlo
+            self._thread.join()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.run_forever, name="flight-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        """Detiene el hilo del planificador"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            if not self._thread.is_alive():
+                self._thread = None
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def is_active(self) -> bool:
+        """En marcha y sin una parada pendiente"""
+        return self.is_running() and not self._stop_event.is_set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker de chequeo automático de precios de vuelos")
+    parser.add_argument("--db", default="flight_prices.db", help="Ruta a la base de datos SQLite")
+    parser.add_argument("--interval", type=int, default=60, help="Minutos entre chequeos de cada búsqueda")
+    parser.add_argument("--refresh", type=int, default=300, help="Segundos entre resincronizaciones de búsquedas activas")
+    parser.add_argument("--rate-limit-wait", type=float, default=60.0,
+                        help="Segundos máximos de espera por cupo del limitador de cada proveedor")
+    parser.add_argument("--once", action="store_true", help="Ejecuta los chequeos vencidos una sola vez y sale")
+    parser.add_argument("--simulate", action="store_true",
+                        help="Usa el simulador como proveedor (pruebas de carga sin red ni cuota)")
+    parser.add_argument("--seed", type=int, help="Semilla del simulador (precios reproducibles)")
+    parser.add_argument("--metrics-port", type=int, help="Sirve las métricas en formato Prometheus en /metrics")
+    parser.add_argument("--metrics-host", default="127.0.0.1",
+                        help="Interfaz del servidor de métricas (0.0.0.0 para exponerlo en la red)")
+    parser.add_argument("--metrics-file", help="Archivo de métricas Prometheus reescrito periódicamente")
+    parser.add_argument("--no-raw-payloads", action="store_true",
+                        help="No guarda la respuesta cruda de cada chequeo (raw_payloads)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    from flight_api_connector import FlightAPIConnector
+    from flight_storage import FlightPriceMonitor
+    from flight_simulation import FlightSimulator
+    simulator = FlightSimulator(seed=args.seed) if args.seed is not None else None
+    # En el worker se espera por cupo del limitador en lugar de saltar al siguiente proveedor
+    connector = FlightAPIConnector(rate_limit_timeout=args.rate_limit_wait, simulator=simulator,
+                                   simulate_provider=args.simulate)
+    connector.rate_limit_usage_path = connector.token_cache_path
+    monitor = FlightPriceMonitor(db_path=args.db, connector=connector,
+                                 store_raw_payloads=not args.no_raw_payloads)
+    scheduler = FlightCheckScheduler(monitor, interval_minutes=args.interval, refresh_seconds=args.refresh)
+
+    # Las alertas encoladas por los chequeos se envían desde el mismo worker
+    from flight_notifications import NotificationDispatcher, load_smtp_settings
+    smtp_settings = load_smtp_settings(connector.get_secret)
+    dispatcher = NotificationDispatcher(args.db, **smtp_settings) if smtp_settings else None
+
+    from flight_metrics import start_metrics_file_writer, start_metrics_server, write_metrics_file
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port, host=args.metrics_host)
+        logger.info("Métricas en http://%s:%s/metrics", args.metrics_host, args.metrics_port)
+
+    if args.once:
+        scheduler.refresh()
+        logger.info("Chequeos realizados: %s", scheduler.run_pending())
+        if dispatcher:
+            logger.info("Notificaciones: %s", dispatcher.flush_all())
+        if args.metrics_file:
+            write_metrics_file(args.metrics_file)
+        return
+
+    metrics_writer = start_metrics_file_writer(args.metrics_file) if args.metrics_file else None
+
+    if dispatcher:
+        dispatcher.start()
+    else:
+        logger.info("Sin EMAIL_USER/EMAIL_PASSWORD: las alertas quedan en la bandeja de salida")
+    logger.info("Planificador iniciado: chequeo cada %s minutos por búsqueda", args.interval)
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        logger.info("Planificador detenido")
+    finally:
+        if dispatcher:
+            dispatcher.stop(timeout=5)
+        if metrics_writer:
+            metrics_writer.set()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,515 @@
+"""
+Motor de simulación de precios de vuelos
+Modelo único, reproducible y vectorizado para pruebas de carga y benchmarks
+sin red ni consumo de cuota:
+
+- Precio base por ruta (tabla conocida o derivado de forma estable del código
+  de la ruta), con factores de anticipación, día de la semana y temporada.
+- Paseo aleatorio con reversión a la media (AR(1) en escala logarítmica) por
+  ruta en pasos de STEP_HOURS horas contados desde SIMULATION_EPOCH, de modo
+  que el mismo (ruta, fecha, momento del chequeo) da siempre el mismo precio
+  y las series a lo largo del tiempo son realistas.
+- El ruido de cada tarifa y oferta se obtiene con un hash (splitmix64) de sus
+  claves, no de un generador con estado: el resultado de una tarifa no
+  depende de cuántas otras se generen en la misma llamada.
+
+Se usa como proveedor del conector (FlightSimulator.search), para generar
+historiales masivos importables con data_import (fare_grid) y como servidor
+HTTP local que imita las respuestas de Amadeus y Skyscanner (make_stub_server).
+
+Uso como proceso independiente:
+    python flight_simulation.py fares --routes 200 --days 90 --history-days 60 --out fares.csv
+    python flight_simulation.py serve --port 8089
+"""
+
+import argparse
+import json
+import threading
+import zlib
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+from flight_offers import FlightOffer, describe_stops, select_offers
+
+SIMULATION_SOURCE = 'Simulación'
+SIMULATION_EPOCH = np.datetime64('2024-01-01T00', 'h')
+STEP_HOURS = 6
+
+# Máximo de ofertas por búsqueda simulada (se generan entre 3 y 6)
+MAX_SIMULATED_OFFERS = 6
+# Campos derivados del hash de cada oferta: escalas, precio, aerolínea y hasta 3 segmentos
+FIELDS_PER_OFFER = 8
+OFFER_COUNT_FIELD = MAX_SIMULATED_OFFERS * FIELDS_PER_OFFER
+
+BASE_PRICES = {
+    ('BOG', 'MIA'): 350,
+    ('BOG', 'JFK'): 450,
+    ('BOG', 'LAX'): 550,
+    ('MDE', 'MIA'): 320,
+    ('CLO', 'BOG'): 150,
+    ('CTG', 'BOG'): 180,
+}
+
+# (código IATA, nombre) de las aerolíneas simuladas
+CARRIERS = (
+    ('AV', 'Avianca'),
+    ('LA', 'LATAM Airlines'),
+    ('VV', 'Viva Air'),
+    ('AA', 'American Airlines'),
+    ('DL', 'Delta Air Lines'),
+    ('UA', 'United Airlines'),
+    ('B6', 'JetBlue Airways'),
+    ('CM', 'Copa Airlines'),
+)
+CARRIER_NAMES = np.array([name for _, name in CARRIERS], dtype=object)
+
+# Aeropuertos para rutas sintéticas y escalas
+AIRPORTS = ('BOG', 'MDE', 'CLO', 'CTG', 'BAQ', 'MIA', 'JFK', 'LAX', 'MAD', 'MEX', 'PTY', 'LIM',
+            'SCL', 'GRU', 'EZE', 'UIO', 'SJO', 'ATL', 'ORD', 'DFW', 'IAH', 'FLL', 'MCO', 'CUN')
+HUBS = ('PTY', 'MIA', 'BOG', 'LIM', 'MEX', 'ATL')
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+
+
+def _splitmix64(values: np.ndarray) -> np.ndarray:
+    z = values.astype(np.uint64) + _GOLDEN
+    z = (z ^ (z >> np.uint64(30))) * _MIX_1
+    z = (z ^ (z >> np.uint64(27))) * _MIX_2
+    return z ^ (z >> np.uint64(31))
+
+
+def hash_keys(*keys) -> np.ndarray:
+    """Hash de 64 bits de una combinación de claves enteras (escalares o arrays)"""
+    with np.errstate(over='ignore'):
+        h = np.uint64(0)
+        for key in keys:
+            h = _splitmix64(h ^ np.asarray(key).astype(np.int64).astype(np.uint64))
+    return h
+
+
+def mix_uniform(h: np.ndarray, field: int) -> np.ndarray:
+    """Uniforme en [0, 1) para un campo derivado de un hash ya calculado"""
+    with np.errstate(over='ignore'):
+        z = _splitmix64(h ^ np.asarray(field).astype(np.uint64))
+    return (z >> np.uint64(11)).astype(np.float64) * (1.0 / (1 << 53))
+
+
+def hash_uniform(*keys) -> np.ndarray:
+    """Uniformes en [0, 1) deterministas a partir de claves enteras (escalares o arrays)"""
+    return mix_uniform(hash_keys(*keys), 0)
+
+
+def route_key(origin: str, destination: str) -> int:
+    """Clave estable de una ruta (independiente de PYTHONHASHSEED)"""
+    return zlib.crc32(f"{origin}-{destination}".encode())
+
+
+def route_base_price(origin: str, destination: str) -> float:
+    """Precio base de la tabla conocida (en cualquier sentido) o derivado del código de la ruta"""
+    base = BASE_PRICES.get((origin, destination)) or BASE_PRICES.get((destination, origin))
+    if base:
+        return float(base)
+    pair = sorted((origin, destination))
+    return 200.0 + 600.0 * float(hash_uniform(route_key(*pair)))
+
+
+def _ar1(shocks: np.ndarray, phi: float, block: int = 128) -> np.ndarray:
+    """
+    Filtro x_t = phi * x_{t-1} + e_t sobre el eje 1, vectorizado por bloques
+    (x_t = phi^t * (x_0 + cumsum(e_j / phi^j)); los bloques evitan desbordar phi^-j).
+    """
+    out = np.empty_like(shocks)
+    carry = np.zeros(shocks.shape[0])
+    for start in range(0, shocks.shape[1], block):
+        chunk = shocks[:, start:start + block]
+        powers = phi ** np.arange(chunk.shape[1])
+        values = powers * (phi * carry[:, None] + np.cumsum(chunk / powers, axis=1))
+        out[:, start:start + chunk.shape[1]] = values
+        carry = values[:, -1]
+    return out
+
+
+def as_check_hours(checked_at) -> np.ndarray:
+    """Momentos de chequeo (datetime, texto ISO o datetime64) como datetime64[h]"""
+    if checked_at is None:
+        return np.array([np.datetime64('now', 'h')])
+    if isinstance(checked_at, datetime):
+        checked_at = np.datetime64(checked_at.replace(tzinfo=None), 'h')
+    elif isinstance(checked_at, str):
+        checked_at = checked_at.replace(' ', 'T')[:13]
+    return np.atleast_1d(np.asarray(checked_at, dtype='datetime64[h]'))
+
+
+class FlightSimulator:
+    """
+    Generador reproducible de tarifas. Con la misma semilla, la misma ruta,
+    fecha de salida y momento de chequeo producen siempre las mismas ofertas.
+    """
+
+    def __init__(self, seed: Optional[int] = None, volatility: float = 0.03,
+                 mean_reversion: float = 0.98):
+        if seed is None:
+            seed = int(np.random.SeedSequence().entropy % (1 << 63))
+        self.seed = int(seed)
+        # Desviación del log-precio por paso y persistencia del paseo (desviación estacionaria ~15%)
+        self.volatility = volatility
+        self.mean_reversion = mean_reversion
+
+    def route_walk(self, route_keys: np.ndarray, max_step: int) -> np.ndarray:
+        """Log-desviación del precio de cada ruta en los pasos 0..max_step (filas = rutas)"""
+        steps = np.arange(max_step + 1)[None, :]
+        keys = np.asarray(route_keys)[:, None]
+        # Box-Muller sobre uniformes con hash: el paso t de una ruta no depende de max_step
+        u1 = hash_uniform(self.seed, keys, steps, 1)
+        u2 = hash_uniform(self.seed, keys, steps, 2)
+        shocks = np.sqrt(-2.0 * np.log1p(-u1)) * np.cos(2.0 * np.pi * u2) * self.volatility
+        return _ar1(shocks, self.mean_reversion)
+
+    def simulate(self, origins, destinations, departure_dates, checked_at=None) -> Dict[str, np.ndarray]:
+        """
+        Genera las ofertas de muchas tarifas en una sola pasada.
+
+        Recibe arrays (o escalares) de origen, destino, fecha de salida y
+        momento de chequeo; devuelve matrices (tarifas x MAX_SIMULATED_OFFERS)
+        de precio, escalas y aerolínea, el número de ofertas de cada tarifa y
+        la posición de la oferta más barata.
+        """
+        departures = np.atleast_1d(np.asarray(departure_dates, dtype='datetime64[D]'))
+        check_hours = as_check_hours(checked_at)
+        origins = np.atleast_1d(np.asarray(origins, dtype=object))
+        destinations = np.atleast_1d(np.asarray(destinations, dtype=object))
+        origins, destinations, departures, check_hours = np.broadcast_arrays(
+            origins, destinations, departures, check_hours)
+        count = departures.shape[0]
+
+        # Claves y precios base por ruta única
+        origin_codes, origin_values = pd.factorize(origins)
+        destination_codes, destination_values = pd.factorize(destinations)
+        route_codes, pairs = pd.factorize(origin_codes * len(destination_values) + destination_codes)
+        unique_routes = [(origin_values[pair // len(destination_values)],
+                          destination_values[pair % len(destination_values)]) for pair in pairs]
+        unique_keys = np.array([route_key(o, d) for o, d in unique_routes], dtype=np.int64)
+        unique_base = np.array([route_base_price(o, d) for o, d in unique_routes])
+
+        steps = np.maximum((check_hours - SIMULATION_EPOCH).astype(np.int64) // STEP_HOURS, 0)
+        walk = self.route_walk(unique_keys, int(steps.max()) if count else 0)
+        walk_factor = np.exp(walk[route_codes, steps])
+
+        # Factores del calendario
+        departure_days = departures.astype(np.int64)
+        days_ahead = departure_days - check_hours.astype('datetime64[D]').astype(np.int64)
+        factor = np.where(days_ahead < 7, 1.4, np.where(days_ahead > 90, 0.9, 1.0))
+        weekday = (departure_days + 3) % 7  # 1970-01-01 fue jueves; lunes = 0
+        factor = factor * np.where(weekday >= 4, 1.15, 1.0)
+        month = departures.astype('datetime64[M]').astype(np.int64) % 12 + 1
+        factor = factor * np.where(np.isin(month, (12, 1, 6, 7)), 1.25, 1.0)
+        fare_price = unique_base[route_codes] * factor * walk_factor
+
+        # Un hash por tarifa (semilla, ruta, salida, paso); cada campo de cada oferta se deriva de él
+        keys = unique_keys[route_codes]
+        fare_hash = hash_keys(self.seed, keys, departure_days, steps)
+        offer_count = 3 + (mix_uniform(fare_hash, OFFER_COUNT_FIELD) * 4).astype(np.int64)
+        ranks = np.arange(MAX_SIMULATED_OFFERS)[None, :]
+        offer_hash = fare_hash[:, None]
+        stop_u = mix_uniform(offer_hash, ranks * FIELDS_PER_OFFER + 1)
+        stops = np.where(stop_u < 0.3, 0, np.where(stop_u < 0.3 + 0.7 * 2 / 3, 1, 2))
+        spread = 0.85 + 0.3 * mix_uniform(offer_hash, ranks * FIELDS_PER_OFFER + 2)
+        prices = np.round(fare_price[:, None] * spread * np.where(stops == 0, 1.1, 1.0), 2)
+        carriers = (mix_uniform(offer_hash, ranks * FIELDS_PER_OFFER + 3) * len(CARRIERS)).astype(np.int64)
+
+        prices = np.where(ranks < offer_count[:, None], prices, np.inf)
+        return {
+            'prices': prices,
+            'stops': stops,
+            'carriers': carriers,
+            'offer_count': offer_count,
+            'cheapest': np.argmin(prices, axis=1),
+            'fare_hash': fare_hash,
+        }
+
+    def fares(self, origins, destinations, departure_dates, checked_at=None) -> pd.DataFrame:
+        """Oferta más barata de cada tarifa, con las columnas de price_history"""
+        check_hours = as_check_hours(checked_at)
+        sim = self.simulate(origins, destinations, departure_dates, check_hours)
+        rows = np.arange(sim['prices'].shape[0])
+        cheapest = sim['cheapest']
+        stops = sim['stops'][rows, cheapest]
+        details = np.where(stops == 0, describe_stops(0), np.where(stops == 1, describe_stops(1), describe_stops(2)))
+        departures = np.atleast_1d(np.asarray(departure_dates, dtype='datetime64[D]'))
+        return pd.DataFrame({
+            'origin': np.broadcast_to(np.asarray(origins, dtype=object), rows.shape),
+            'destination': np.broadcast_to(np.asarray(destinations, dtype=object), rows.shape),
+            'departure_date': np.broadcast_to(departures, rows.shape),
+            'checked_at': np.broadcast_to(check_hours, rows.shape).astype('datetime64[s]'),
+            'price': sim['prices'][rows, cheapest],
+            'currency': 'USD',
+            'airline': CARRIER_NAMES[sim['carriers'][rows, cheapest]],
+            'flight_details': details,
+            'source': SIMULATION_SOURCE,
+        })
+
+    def offers(self, search_data: Dict, checked_at=None) -> List[Tuple[FlightOffer, str]]:
+        """Ofertas de una búsqueda como (FlightOffer, código de aerolínea), por precio"""
+        sim = self.simulate(search_data['origin'], search_data['destination'],
+                            search_data['departure_date'], checked_at)
+        fare_hash = sim['fare_hash'][0]
+        offers = []
+        for rank in range(int(sim['offer_count'][0])):
+            stops = int(sim['stops'][0, rank])
+            segment_u = mix_uniform(fare_hash, rank * FIELDS_PER_OFFER + 4 + np.arange(stops + 1))
+            segment_minutes = tuple(int(m) for m in 60 + (segment_u * 301).astype(np.int64))
+            code, name = CARRIERS[int(sim['carriers'][0, rank])]
+            offers.append((FlightOffer(
+                price=float(sim['prices'][0, rank]),
+                currency='USD',
+                carrier=name,
+                stops=stops,
+                duration_minutes=sum(segment_minutes) + 90 * stops,
+                segment_minutes=segment_minutes
+            ), code))
+        offers.sort(key=lambda item: item[0].price)
+        return offers
+
+    def search(self, search_data: Dict, checked_at=None) -> Dict:
+        """Proveedor simulado: mismo formato de resultado que las búsquedas del conector"""
+        offers = select_offers(offer for offer, _ in self.offers(search_data, checked_at))
+        cheapest = offers[0]
+        return {
+            'price': cheapest.price,
+            'currency': 'USD',
+            'airline': cheapest.carrier,
+            'flight_details': describe_stops(cheapest.stops),
+            'source': SIMULATION_SOURCE,
+            'offers': offers
+        }
+
+    def fare_grid(self, routes: Sequence[Tuple[str, str]], departure_dates, check_times) -> pd.DataFrame:
+        """
+        Historial sintético: todas las combinaciones ruta x salida x chequeo,
+        descartando chequeos posteriores a la salida. El resultado se puede
+        guardar en CSV/JSONL/Parquet e importar con data_import.
+        """
+        departures = np.asarray(departure_dates, dtype='datetime64[D]')
+        checks = as_check_hours(check_times)
+        origins = np.array([origin for origin, _ in routes], dtype=object)
+        destinations = np.array([destination for _, destination in routes], dtype=object)
+
+        route_index, departure_index, check_index = (
+            axis.ravel() for axis in np.meshgrid(np.arange(len(routes)), np.arange(len(departures)),
+                                                 np.arange(len(checks)), indexing='ij'))
+        valid = checks[check_index].astype('datetime64[D]') < departures[departure_index]
+        route_index, departure_index, check_index = (
+            route_index[valid], departure_index[valid], check_index[valid])
+        return self.fares(origins[route_index], destinations[route_index],
+                          departures[departure_index], checks[check_index])
+
+    def amadeus_payload(self, search_data: Dict, checked_at=None, max_offers: Optional[int] = None) -> Dict:
+        """Respuesta con el formato de /v2/shopping/flight-offers de Amadeus"""
+        data = []
+        for index, (offer, code) in enumerate(self.offers(search_data, checked_at)[:max_offers]):
+            stopovers = [HUBS[(index + i) % len(HUBS)] for i in range(offer.stops)]
+            airports = [search_data['origin']] + stopovers + [search_data['destination']]
+            departure = datetime.strptime(search_data['departure_date'], '%Y-%m-%d').replace(hour=6)
+            segments = []
+            for number, minutes in enumerate(offer.segment_minutes):
+                arrival = departure + pd.Timedelta(minutes=minutes)
+                segments.append({
+                    'departure': {'iataCode': airports[number], 'at': departure.strftime('%Y-%m-%dT%H:%M:%S')},
+                    'arrival': {'iataCode': airports[number + 1], 'at': arrival.strftime('%Y-%m-%dT%H:%M:%S')},
+                    'carrierCode': code,
+                    'number': str(100 + index * 10 + number),
+                    'duration': iso_duration(minutes),
+                    'numberOfStops': 0,
+                })
+                departure = arrival + pd.Timedelta(minutes=90)
+            total = f"{offer.price:.2f}"
+            data.append({
+                'type': 'flight-offer',
+                'id': str(index + 1),
+                'source': 'GDS',
+                'oneWay': not search_data.get('return_date'),
+                'numberOfBookableSeats': 9,
+                'itineraries': [{'duration': iso_duration(offer.duration_minutes), 'segments': segments}],
+                'price': {'currency': offer.currency, 'total': total, 'base': total, 'grandTotal': total},
+                'validatingAirlineCodes': [code],
+            })
+        return {'meta': {'count': len(data)}, 'data': data}
+
+    def skyscanner_payload(self, search_data: Dict, checked_at=None, max_offers: Optional[int] = None) -> Dict:
+        """Respuesta con el formato de browsequotes de Skyscanner"""
+        quotes = []
+        carriers = {}
+        for index, (offer, code) in enumerate(self.offers(search_data, checked_at)[:max_offers]):
+            carrier_id = CARRIERS.index((code, offer.carrier)) + 1
+            carriers[carrier_id] = offer.carrier
+            quotes.append({
+                'QuoteId': index + 1,
+                'MinPrice': offer.price,
+                'Direct': offer.stops == 0,
+                'OutboundLeg': {
+                    'CarrierIds': [carrier_id],
+                    'OriginId': search_data['origin'],
+                    'DestinationId': search_data['destination'],
+                    'DepartureDate': f"{search_data['departure_date']}T00:00:00",
+                    'StopIds': [HUBS[(index + i) % len(HUBS)] for i in range(offer.stops)],
+                },
+            })
+        return {
+            'Quotes': quotes,
+            'Carriers': [{'CarrierId': carrier_id, 'Name': name} for carrier_id, name in carriers.items()],
+            'Places': [],
+            'Currencies': [{'Code': 'USD', 'Symbol': '$'}],
+        }
+
+
+def iso_duration(minutes: Optional[int]) -> Optional[str]:
+    if minutes is None:
+        return None
+    return f"PT{minutes // 60}H{minutes % 60}M"
+
+
+def sample_routes(count: int, seed: int = 0) -> List[Tuple[str, str]]:
+    """Rutas distintas entre AIRPORTS, reproducibles para una semilla"""
+    pairs = [(origin, destination) for origin in AIRPORTS for destination in AIRPORTS if origin != destination]
+    if count > len(pairs):
+        raise ValueError(f"Como máximo {len(pairs)} rutas distintas")
+    order = np.random.default_rng(seed).permutation(len(pairs))[:count]
+    return [pairs[index] for index in order]
+
+
+_simulators: Dict[int, FlightSimulator] = {}
+_simulators_lock = threading.Lock()
+
+
+def get_simulator(seed: Optional[int] = None) -> FlightSimulator:
+    """Simulador compartido por el proceso (uno por semilla; sin semilla, uno con semilla aleatoria)"""
+    key = -1 if seed is None else int(seed)
+    with _simulators_lock:
+        simulator = _simulators.get(key)
+        if simulator is None:
+            simulator = FlightSimulator(seed=seed)
+            _simulators[key] = simulator
+        return simulator
+
+
+# Servidor HTTP local que imita Amadeus y Skyscanner
+class SimulatedProviderHandler(BaseHTTPRequestHandler):
+    server_version = 'FlightSimulator/1.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, payload: Dict, headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if urlparse(self.path).path == '/v1/security/oauth2/token':
+            length = int(self.headers.get('Content-Length') or 0)
+            self.rfile.read(length)
+            self.send_json(200, {'type': 'amadeusOAuth2Token', 'access_token': 'simulated-token',
+                                 'token_type': 'Bearer', 'expires_in': 1799})
+        else:
+            self.send_json(404, {'errors': [{'status': 404, 'title': 'Not Found'}]})
+
+    def amadeus_response(self, search_data: Dict, max_offers: Optional[int]) -> Dict:
+        return self.server.simulator.amadeus_payload(search_data, max_offers=max_offers)
+
+    def skyscanner_response(self, search_data: Dict) -> Dict:
+        return self.server.simulator.skyscanner_payload(search_data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/v2/shopping/flight-offers':
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            search_data = {
+                'origin': query.get('originLocationCode', ''),
+                'destination': query.get('destinationLocationCode', ''),
+                'departure_date': query.get('departureDate', ''),
+                'return_date': query.get('returnDate'),
+            }
+            max_offers = int(query['max']) if 'max' in query else None
+            self.send_json(200, self.amadeus_response(search_data, max_offers))
+            return
+
+        parts = url.path.strip('/').split('/')
+        # apiservices/browsequotes/v1.0/{país}/{moneda}/{idioma}/{origen}/{destino}/{salida}[/{regreso}]
+        if parts[:3] == ['apiservices', 'browsequotes', 'v1.0'] and len(parts) >= 9:
+            search_data = {
+                'origin': parts[6],
+                'destination': parts[7],
+                'departure_date': parts[8],
+                'return_date': parts[9] if len(parts) > 9 else None,
+            }
+            self.send_json(200, self.skyscanner_response(search_data))
+            return
+
+        self.send_json(404, {'errors': [{'status': 404, 'title': 'Not Found'}]})
+
+
+def make_stub_server(simulator: Optional[FlightSimulator] = None, host: str = '127.0.0.1',
+                     port: int = 0, handler=SimulatedProviderHandler) -> ThreadingHTTPServer:
+    """Servidor (sin iniciar) con las rutas de Amadeus y Skyscanner; port=0 elige uno libre"""
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.simulator = simulator or get_simulator(0)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulación reproducible de precios de vuelos")
+    parser.add_argument("--seed", type=int, default=0)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    fares = commands.add_parser("fares", help="Genera un historial sintético importable con data_import.py")
+    fares.add_argument("--routes", type=int, default=50, help="Número de rutas distintas")
+    fares.add_argument("--days", type=int, default=60, help="Fechas de salida desde hoy")
+    fares.add_argument("--history-days", type=int, default=30, help="Días de chequeos hacia atrás")
+    fares.add_argument("--checks-per-day", type=int, default=4)
+    fares.add_argument("--out", required=True, help="Archivo .csv, .jsonl o .parquet")
+
+    serve = commands.add_parser("serve", help="Servidor HTTP local que imita Amadeus y Skyscanner")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8089)
+    args = parser.parse_args()
+
+    simulator = FlightSimulator(seed=args.seed)
+    if args.command == "serve":
+        server = make_stub_server(simulator, args.host, args.port)
+        print(f"Simulador escuchando en http://{args.host}:{server.server_address[1]}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.shutdown()
+        return
+
+    today = np.datetime64('today', 'D')
+    departures = today + np.arange(1, args.days + 1)
+    step = np.timedelta64(24 // max(1, args.checks_per_day), 'h')
+    checks = np.arange(today - np.timedelta64(args.history_days, 'D'), today + np.timedelta64(1, 'D'), step)
+    frame = simulator.fare_grid(sample_routes(args.routes, args.seed), departures, checks.astype('datetime64[h]'))
+
+    if args.out.endswith('.parquet'):
+        frame.to_parquet(args.out, index=False)
+    elif args.out.endswith(('.jsonl', '.ndjson')):
+        frame.to_json(args.out, orient='records', lines=True, date_format='iso')
+    else:
+        frame.to_csv(args.out, index=False)
+    print(f"{len(frame)} tarifas escritas en {args.out}")
+
+
+if __name__ == "__main__":
+    main()
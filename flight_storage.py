@@ -0,0 +1,775 @@
+"""
+Almacenamiento y chequeos del monitor de precios
+FlightPriceMonitor (SQLite: búsquedas, historial, agregados y migraciones
+de esquema) sin dependencias de Streamlit, para que la app, el worker
+flight_scheduler.py y las herramientas de línea de comandos (importación,
+retención, benchmarks) lo usen sin ejecutar la interfaz.
+"""
+
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from price_retention import ROLLUP_BOUNDS_MIGRATION_SQL, ROLLUP_SUM_SQ_MIGRATION_SQL, ROLLUP_TABLE_SQL
+from price_alerts import ALERT_RULES_MIGRATION_SQL, alert_notifications, evaluate_alert_rules, mark_rules_fired
+from flight_simulation import get_simulator
+from flight_metrics import increment, observe, timed
+from flight_offers import OFFERS_MIGRATION_SQL, offer_rows, store_offers
+from raw_payloads import PROVIDER_CALL_MIGRATION_SQL, RAW_PAYLOADS_MIGRATION_SQL, encode_payload, store_payloads
+from flight_notifications import OUTBOX_MIGRATION_SQL, enqueue_notifications
+
+# Límite conservador de parámetros por consulta en SQLite
+SQLITE_MAX_PARAMS = 500
+
+def chunked(items: List, size: int):
+    """Divide una lista en bloques de tamaño fijo"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def itinerary_key(search_data: Dict) -> tuple:
+    """Clave que identifica un itinerario idéntico entre búsquedas"""
+    return (
+        search_data['origin'],
+        search_data['destination'],
+        search_data['departure_date'],
+        search_data.get('return_date'),
+        int(search_data.get('passengers') or 1)
+    )
+
+# Ajustes aplicados a cada conexión nueva
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode = WAL',      # Lectores y escritor concurrentes
+    'PRAGMA synchronous = NORMAL',    # Seguro con WAL y con menos fsync
+    'PRAGMA cache_size = -20000',     # ~20 MB de caché de páginas
+    'PRAGMA mmap_size = 268435456',   # 256 MB mapeados en memoria
+    'PRAGMA temp_store = MEMORY',
+)
+
+# Carga inicial de search_stats (migración 2, anterior a los rollups)
+INITIAL_SEARCH_STATS_SQL = '''
+    INSERT OR REPLACE INTO search_stats
+        (search_id, current_price, min_price, max_price, check_count, mean_price, m2, last_checked_at)
+    SELECT
+        p.search_id,
+        (SELECT p2.price FROM price_history p2 WHERE p2.search_id = p.search_id
+         ORDER BY p2.checked_at DESC, p2.id DESC LIMIT 1),
+        MIN(p.price),
+        MAX(p.price),
+        COUNT(*),
+        AVG(p.price),
+        MAX(0, SUM(p.price * p.price) - COUNT(*) * AVG(p.price) * AVG(p.price)),
+        MAX(p.checked_at)
+    FROM price_history p
+    WHERE p.search_id IS NOT NULL {search_filter}
+    GROUP BY p.search_id
+'''
+
+# Recalcula search_stats (todas las búsquedas o las filtradas) combinando las
+# filas crudas con los rollups de la compactación, que guardan mín/máx, suma,
+# suma de cuadrados y conteo. En buckets sin suma de cuadrados (compactados
+# antes de la migración 10) se toma la varianza interna del bucket como 0.
+REBUILD_SEARCH_STATS_SQL = '''
+    INSERT OR REPLACE INTO search_stats
+        (search_id, current_price, min_price, max_price, check_count, mean_price, m2, last_checked_at)
+    SELECT
+        parts.search_id,
+        (SELECT price FROM (
+            SELECT * FROM (SELECT p2.price, p2.checked_at AS seen_at, 1 AS is_raw FROM price_history p2
+                           WHERE p2.search_id = parts.search_id
+                           ORDER BY p2.checked_at DESC, p2.id DESC LIMIT 1)
+            UNION ALL
+            SELECT * FROM (SELECT h.last_price, h.last_at, 0 FROM price_rollup_hourly h
+                           WHERE h.search_id = parts.search_id ORDER BY h.last_at DESC LIMIT 1)
+            UNION ALL
+            SELECT * FROM (SELECT d.last_price, d.last_at, 0 FROM price_rollup_daily d
+                           WHERE d.search_id = parts.search_id ORDER BY d.last_at DESC LIMIT 1)
+         ) ORDER BY seen_at DESC, is_raw DESC LIMIT 1),
+        MIN(parts.min_price),
+        MAX(parts.max_price),
+        SUM(parts.price_count),
+        SUM(parts.sum_price) / SUM(parts.price_count),
+        MAX(0, SUM(parts.sum_sq_price) - SUM(parts.sum_price) * SUM(parts.sum_price) / SUM(parts.price_count)),
+        MAX(parts.last_seen)
+    FROM (
+        SELECT p.search_id, MIN(p.price) AS min_price, MAX(p.price) AS max_price,
+               COUNT(*) AS price_count, SUM(p.price) AS sum_price,
+               SUM(p.price * p.price) AS sum_sq_price, MAX(p.checked_at) AS last_seen
+        FROM price_history p
+        WHERE p.search_id IS NOT NULL {search_filter}
+        GROUP BY p.search_id
+        UNION ALL
+        SELECT p.search_id, MIN(p.min_price), MAX(p.max_price), SUM(p.price_count), SUM(p.sum_price),
+               SUM(COALESCE(p.sum_sq_price, p.sum_price * p.sum_price / p.price_count)), MAX(p.last_at)
+        FROM price_rollup_hourly p
+        WHERE 1 = 1 {search_filter}
+        GROUP BY p.search_id
+        UNION ALL
+        SELECT p.search_id, MIN(p.min_price), MAX(p.max_price), SUM(p.price_count), SUM(p.sum_price),
+               SUM(COALESCE(p.sum_sq_price, p.sum_price * p.sum_price / p.price_count)), MAX(p.last_at)
+        FROM price_rollup_daily p
+        WHERE 1 = 1 {search_filter}
+        GROUP BY p.search_id
+    ) parts
+    GROUP BY parts.search_id
+'''
+
+# Migraciones de esquema versionadas (PRAGMA user_version).
+# Cada entrada: (versión, descripción, sentencias SQL). Solo se añaden al final.
+MIGRATIONS = [
+    (1, "Índices de historial y búsquedas activas", [
+        'CREATE INDEX IF NOT EXISTS idx_price_history_search_checked ON price_history (search_id, checked_at)',
+        'CREATE INDEX IF NOT EXISTS idx_price_history_search_price ON price_history (search_id, price)',
+        'CREATE INDEX IF NOT EXISTS idx_flight_searches_active ON flight_searches (is_active, created_at)',
+    ]),
+    (2, "Agregados incrementales por búsqueda (search_stats)", [
+        '''
+        CREATE TABLE IF NOT EXISTS search_stats (
+            search_id INTEGER PRIMARY KEY,
+            current_price REAL,
+            min_price REAL,
+            max_price REAL,
+            check_count INTEGER NOT NULL DEFAULT 0,
+            mean_price REAL,
+            m2 REAL NOT NULL DEFAULT 0,
+            last_checked_at TIMESTAMP,
+            FOREIGN KEY (search_id) REFERENCES flight_searches (id)
+        )
+        ''',
+        INITIAL_SEARCH_STATS_SQL.format(search_filter=''),
+    ]),
+    (3, "Contador de generación para invalidar la caché de lecturas", [
+        'CREATE TABLE IF NOT EXISTS data_generation (id INTEGER PRIMARY KEY CHECK (id = 1), value INTEGER NOT NULL)',
+        'INSERT OR IGNORE INTO data_generation (id, value) VALUES (1, 0)',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_price_history_insert_generation AFTER INSERT ON price_history
+        BEGIN UPDATE data_generation SET value = value + 1 WHERE id = 1; END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_price_history_delete_generation AFTER DELETE ON price_history
+        BEGIN UPDATE data_generation SET value = value + 1 WHERE id = 1; END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_flight_searches_insert_generation AFTER INSERT ON flight_searches
+        BEGIN UPDATE data_generation SET value = value + 1 WHERE id = 1; END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_flight_searches_update_generation AFTER UPDATE ON flight_searches
+        BEGIN UPDATE data_generation SET value = value + 1 WHERE id = 1; END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS trg_flight_searches_delete_generation AFTER DELETE ON flight_searches
+        BEGIN UPDATE data_generation SET value = value + 1 WHERE id = 1; END
+        ''',
+    ]),
+    (4, "Rollups horarios y diarios para la retención del historial", [
+        ROLLUP_TABLE_SQL.format(table='price_rollup_hourly'),
+        ROLLUP_TABLE_SQL.format(table='price_rollup_daily'),
+    ]),
+    (5, "Bandeja de salida de notificaciones (notifications)", OUTBOX_MIGRATION_SQL),
+    (6, "Reglas de alerta de precios (alert_rules)", ALERT_RULES_MIGRATION_SQL),
+    (7, "Ofertas completas por chequeo (offers)", OFFERS_MIGRATION_SQL),
+    (8, "Proveedor y respuesta cruda comprimida por chequeo (raw_payloads)", RAW_PAYLOADS_MIGRATION_SQL),
+    (9, "Fecha del primer y último precio de cada rollup", ROLLUP_BOUNDS_MIGRATION_SQL),
+    (10, "Suma de cuadrados por rollup (desviación exacta al reconstruir search_stats)", ROLLUP_SUM_SQ_MIGRATION_SQL),
+    (11, "Chequeos que consultaron al proveedor (sin caché)", PROVIDER_CALL_MIGRATION_SQL),
+]
+
+# Índices y triggers de las migraciones. Son idempotentes (IF NOT EXISTS) y
+# init_database los vuelve a crear en cada arranque, por si una carga masiva
+# interrumpida los dejó eliminados.
+SCHEMA_OBJECTS_SQL = [
+    statement
+    for _, _, statements in MIGRATIONS
+    for statement in statements
+    if isinstance(statement, str)
+    and statement.split(None, 5)[:5] in (['CREATE', 'INDEX', 'IF', 'NOT', 'EXISTS'],
+                                         ['CREATE', 'TRIGGER', 'IF', 'NOT', 'EXISTS'])
+]
+
+# Actualización incremental (Welford) de search_stats. En un UPDATE de SQLite
+# todas las expresiones leen los valores previos de la fila, así que la
+# operación es atómica aunque escriban varios procesos a la vez.
+UPSERT_SEARCH_STATS_SQL = '''
+    INSERT INTO search_stats
+        (search_id, current_price, min_price, max_price, check_count, mean_price, m2, last_checked_at)
+    VALUES (?, ?, ?, ?, 1, ?, 0, CURRENT_TIMESTAMP)
+    ON CONFLICT(search_id) DO UPDATE SET
+        current_price = excluded.current_price,
+        min_price = MIN(min_price, excluded.current_price),
+        max_price = MAX(max_price, excluded.current_price),
+        check_count = check_count + 1,
+        mean_price = mean_price + (excluded.current_price - mean_price) / (check_count + 1),
+        m2 = m2 + (excluded.current_price - mean_price)
+                * (excluded.current_price - (mean_price + (excluded.current_price - mean_price) / (check_count + 1))),
+        last_checked_at = excluded.last_checked_at
+'''
+
+def stats_params(search_id: int, price: float) -> tuple:
+    """Parámetros de UPSERT_SEARCH_STATS_SQL para un nuevo precio"""
+    return (search_id, price, price, price, price)
+
+# Clase principal para el monitor de vuelos
+class FlightPriceMonitor:
+    def __init__(self, db_path: str = "flight_prices.db", connector=None,
+                 busy_timeout: float = 30.0, read_cache_size: int = 256,
+                 store_raw_payloads: bool = True):
+        self.db_path = db_path
+        # Conector de APIs inyectado (la app, el planificador); sin él se usa el simulador
+        self.connector = connector
+        self.busy_timeout = busy_timeout
+        # Guardar la respuesta cruda de cada chequeo en raw_payloads
+        self.store_raw_payloads = store_raw_payloads
+        # Una conexión por hilo, reutilizada entre llamadas
+        self._local = threading.local()
+        # Caché de lecturas compartida entre sesiones; se invalida cuando cambia
+        # data_generation (escrito por triggers desde cualquier proceso)
+        self.read_cache_size = read_cache_size
+        self._read_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._read_cache_lock = threading.Lock()
+        self.read_cache_hits = 0
+        self.read_cache_misses = 0
+        self.init_database()
+    
+    def get_connection(self) -> sqlite3.Connection:
+        """
+        Conexión SQLite del hilo actual, creada una vez y reutilizada.
+        Usa WAL para que el planificador pueda escribir mientras la
+        interfaz lee, y espera `busy_timeout` segundos ante bloqueos.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout)
+            for pragma in SQLITE_PRAGMAS:
+                conn.execute(pragma)
+            self._local.conn = conn
+        return conn
+    
+    def close_connection(self):
+        """Cierra la conexión del hilo actual"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+        
+    def get_data_generation(self) -> int:
+        """Generación actual de los datos (cambia con cada escritura en cualquier proceso)"""
+        row = self.get_connection().execute('SELECT value FROM data_generation WHERE id = 1').fetchone()
+        return row[0] if row else 0
+    
+    def cached_read(self, key: tuple, loader):
+        """
+        Devuelve el resultado de `loader()` cacheado mientras no cambie la
+        generación de datos. Los DataFrames se devuelven como copia porque
+        la interfaz los modifica.
+        """
+        generation = self.get_data_generation()
+        with self._read_cache_lock:
+            entry = self._read_cache.get(key)
+            if entry is not None and entry[0] == generation:
+                self._read_cache.move_to_end(key)
+                self.read_cache_hits += 1
+                increment('flight_cache_requests_total', cache='read', result='hit')
+                value = entry[1]
+                return value.copy() if hasattr(value, 'copy') else value
+            self.read_cache_misses += 1
+        increment('flight_cache_requests_total', cache='read', result='miss')
+        
+        value = loader()
+        with self._read_cache_lock:
+            self._read_cache[key] = (generation, value)
+            self._read_cache.move_to_end(key)
+            while len(self._read_cache) > self.read_cache_size:
+                self._read_cache.popitem(last=False)
+        return value.copy() if hasattr(value, 'copy') else value
+    
+    def invalidate_read_cache(self):
+        """Vacía la caché de lecturas"""
+        with self._read_cache_lock:
+            self._read_cache.clear()
+    
+    def init_database(self):
+        """Inicializa la base de datos SQLite"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS flight_searches (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                search_name TEXT NOT NULL,
+                origin TEXT NOT NULL,
+                destination TEXT NOT NULL,
+                departure_date TEXT NOT NULL,
+                return_date TEXT,
+                passengers INTEGER DEFAULT 1,
+                email_notification TEXT,
+                target_price REAL,
+                is_active BOOLEAN DEFAULT 1,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS price_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                search_id INTEGER,
+                price REAL NOT NULL,
+                currency TEXT DEFAULT 'USD',
+                airline TEXT,
+                flight_details TEXT,
+                checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (search_id) REFERENCES flight_searches (id)
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS notifications (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                search_id INTEGER,
+                notification_type TEXT,
+                message TEXT,
+                sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (search_id) REFERENCES flight_searches (id)
+            )
+        ''')
+        
+        conn.commit()
+        self.run_migrations(conn)
+        
+        with conn:
+            for statement in SCHEMA_OBJECTS_SQL:
+                conn.execute(statement)
+    
+    def run_migrations(self, conn: sqlite3.Connection) -> int:
+        """
+        Aplica las migraciones pendientes sobre bases existentes.
+        Cada migración corre en su propia transacción y actualiza user_version.
+        La transacción toma el bloqueo de escritura (BEGIN IMMEDIATE) y vuelve
+        a leer user_version dentro, así que si la app y el worker arrancan a
+        la vez cada migración se aplica una sola vez.
+        Devuelve la versión final del esquema.
+        """
+        current_version = conn.execute('PRAGMA user_version').fetchone()[0]
+        applied = False
+        
+        for version, description, statements in MIGRATIONS:
+            if version <= current_version:
+                continue
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                current_version = conn.execute('PRAGMA user_version').fetchone()[0]
+                if version <= current_version:
+                    # Otro proceso la aplicó mientras esperábamos el bloqueo
+                    conn.rollback()
+                    continue
+                for statement in statements:
+                    if callable(statement):
+                        statement(conn)
+                    else:
+                        conn.execute(statement)
+                # PRAGMA no admite parámetros; version es un entero de MIGRATIONS
+                conn.execute(f'PRAGMA user_version = {int(version)}')
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            current_version = version
+            applied = True
+        
+        if applied:
+            # Actualizar estadísticas del planificador de consultas
+            conn.execute('ANALYZE')
+            conn.commit()
+        return current_version
+    
+    def add_search(self, search_data: Dict) -> int:
+        """Añade una nueva búsqueda de vuelo"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            INSERT INTO flight_searches 
+            (search_name, origin, destination, departure_date, return_date, 
+             passengers, email_notification, target_price)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            search_data['name'],
+            search_data['origin'],
+            search_data['destination'],
+            search_data['departure_date'],
+            search_data.get('return_date'),
+            search_data.get('passengers', 1),
+            search_data.get('email'),
+            search_data.get('target_price')
+        ))
+        
+        search_id = cursor.lastrowid
+        conn.commit()
+        return search_id
+    
+    def get_searches(self) -> pd.DataFrame:
+        """Obtiene todas las búsquedas activas"""
+        return self.cached_read(('searches',), lambda: pd.read_sql_query('''
+            SELECT * FROM flight_searches WHERE is_active = 1
+            ORDER BY created_at DESC
+        ''', self.get_connection()))
+    
+    def get_price_history(self, search_id: int) -> pd.DataFrame:
+        """Obtiene el historial de precios para una búsqueda"""
+        search_id = int(search_id)
+        return self.cached_read(('price_history', search_id), lambda: pd.read_sql_query('''
+            SELECT * FROM price_history 
+            WHERE search_id = ? 
+            ORDER BY checked_at DESC
+        ''', self.get_connection(), params=(search_id,)))
+    
+    def get_search_stats(self, search_id: int) -> Optional[Dict]:
+        """Agregados de precio de una búsqueda (consulta O(1) por clave primaria)"""
+        cursor = self.get_connection().cursor()
+        cursor.row_factory = sqlite3.Row
+        row = cursor.execute('SELECT * FROM search_stats WHERE search_id = ?', (search_id,)).fetchone()
+        if not row:
+            return None
+        stats = dict(row)
+        count = stats['check_count']
+        # Desviación estándar muestral, como pandas.Series.std()
+        stats['std_price'] = (stats['m2'] / (count - 1)) ** 0.5 if count > 1 else 0.0
+        return stats
+    
+    def rebuild_search_stats(self, search_ids: Optional[List[int]] = None):
+        """Recalcula search_stats desde el historial crudo y compactado (p. ej. tras una importación)"""
+        conn = self.get_connection()
+        with conn:
+            if search_ids is None:
+                conn.execute(REBUILD_SEARCH_STATS_SQL.format(search_filter=''))
+                return
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS stats_ids (id INTEGER PRIMARY KEY)')
+            conn.execute('DELETE FROM stats_ids')
+            conn.executemany('INSERT OR IGNORE INTO stats_ids (id) VALUES (?)',
+                             [(int(search_id),) for search_id in search_ids])
+            conn.execute(REBUILD_SEARCH_STATS_SQL.format(
+                search_filter='AND p.search_id IN (SELECT id FROM stats_ids)'))
+    
+    def search_flights_with_apis(self, search_data: Dict) -> Dict:
+        """
+        Busca vuelos usando APIs reales o simulación como fallback
+        """
+        return self.get_search_function()(search_data)
+    
+    def get_search_function(self):
+        """Función de búsqueda: la del conector inyectado o la simulación"""
+        if self.connector is not None:
+            return self.connector.search_flights
+        return self.simulate_flight_search_fallback
+    
+    def plan_date_matrix(self, origin: str, destination: str, date_pairs: List[tuple],
+                         passengers: int = 1) -> Dict:
+        """Coste de la matriz de fechas antes de lanzarla (ver FlightAPIConnector.plan_date_matrix)"""
+        if self.connector is None:
+            return {'cells': len(dict.fromkeys(date_pairs)), 'cached': 0,
+                    'to_fetch': len(dict.fromkeys(date_pairs)), 'max_calls': 0, 'budget_left': {}}
+        return self.connector.plan_date_matrix(origin, destination, date_pairs, passengers=passengers)
+    
+    def search_date_matrix(self, origin: str, destination: str, date_pairs: List[tuple],
+                           passengers: int = 1) -> Dict:
+        """Matriz de precios por combinación de fechas (ver FlightAPIConnector.search_date_matrix)"""
+        if self.connector is None:
+            results = {}
+            for departure, return_date in date_pairs:
+                results[(departure, return_date)] = self.simulate_flight_search_fallback({
+                    'origin': origin, 'destination': destination,
+                    'departure_date': departure, 'return_date': return_date, 'passengers': passengers
+                })
+            return {'results': results, 'cached': 0, 'fetched': len(results), 'missing': 0}
+        return self.connector.search_date_matrix(origin, destination, date_pairs, passengers=passengers)
+    
+    def simulate_flight_search_fallback(self, search_data: Dict) -> Dict:
+        """
+        Simulación de vuelos como fallback (mismo motor que el conector)
+        """
+        return get_simulator().search(search_data)
+    
+    def encode_raw_payload(self, flight_result: Dict):
+        """Fila comprimida de raw_payloads para la respuesta cruda de un resultado (o None)"""
+        if not self.store_raw_payloads:
+            return None
+        return encode_payload(flight_result.get('raw_data'))
+    
+    def check_flights_and_update(self, search_id: int) -> Optional[Dict]:
+        """Busca vuelos y actualiza la base de datos"""
+        check_started = time.perf_counter()
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        # Obtener datos de búsqueda
+        cursor.execute('SELECT * FROM flight_searches WHERE id = ?', (search_id,))
+        search_data = cursor.fetchone()
+        
+        if not search_data:
+            return None
+        
+        # Convertir a diccionario
+        columns = [description[0] for description in cursor.description]
+        search_dict = dict(zip(columns, search_data))
+        
+        # Simular búsqueda de vuelos
+        flight_result = self.search_flights_with_apis(search_dict)
+        payload = self.encode_raw_payload(flight_result)
+        
+        # Guardar resultado en historial (commit o rollback al salir del bloque)
+        write_started = time.perf_counter()
+        with conn:
+            store_payloads(conn, [payload])
+            cursor.execute('''
+                INSERT INTO price_history
+                (search_id, price, currency, airline, flight_details, source, payload_hash, provider_call)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                search_id,
+                flight_result['price'],
+                flight_result['currency'],
+                flight_result['airline'],
+                flight_result['flight_details'],
+                flight_result.get('source'),
+                payload[0] if payload else None,
+                0 if flight_result.get('cached') else 1
+            ))
+            store_offers(conn, offer_rows(cursor.lastrowid, search_id, flight_result.get('offers') or []))
+            
+            # Verificar si es el precio más bajo (lectura O(1) del agregado)
+            with timed('flight_min_query_seconds', path='single'):
+                cursor.execute('SELECT min_price FROM search_stats WHERE search_id = ?', (search_id,))
+                row = cursor.fetchone()
+            previous_min = row[0] if row else None
+            
+            # Actualizar agregados en la misma transacción que el historial
+            cursor.execute(UPSERT_SEARCH_STATS_SQL, stats_params(search_id, flight_result['price']))
+        observe('flight_db_insert_seconds', time.perf_counter() - write_started, path='single')
+        
+        is_lowest = previous_min is None or flight_result['price'] <= previous_min
+        meets_target = (search_dict['target_price'] and 
+                       flight_result['price'] <= search_dict['target_price'])
+        
+        result = {
+            'flight_result': flight_result,
+            'is_lowest': is_lowest,
+            'meets_target': meets_target,
+            'previous_min': previous_min,
+            'search_data': search_dict
+        }
+        self.queue_price_alerts({search_id: result})
+        observe('flight_check_seconds', time.perf_counter() - check_started, path='single')
+        return result
+    
+    def check_many(self, search_ids: List[int], max_workers: int = 8) -> Dict[int, Dict]:
+        """
+        Chequea varias búsquedas en una sola pasada.
+        
+        Carga todas las búsquedas con una consulta, consulta cada itinerario
+        distinto una sola vez (en paralelo, con un pool acotado) y guarda todos
+        los precios con un único executemany en una sola transacción.
+        Devuelve {search_id: resultado} con la misma forma que check_flights_and_update.
+        """
+        search_ids = list(dict.fromkeys(int(search_id) for search_id in search_ids))
+        if not search_ids:
+            return {}
+        check_started = time.perf_counter()
+        
+        conn = self.get_connection()
+        searches = {}
+        cursor = conn.cursor()
+        for chunk in chunked(search_ids, SQLITE_MAX_PARAMS):
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f'SELECT * FROM flight_searches WHERE id IN ({placeholders})', chunk)
+            columns = [description[0] for description in cursor.description]
+            for row in cursor.fetchall():
+                search_dict = dict(zip(columns, row))
+                searches[search_dict['id']] = search_dict
+        
+        # Agrupar búsquedas con el mismo itinerario
+        itineraries = {}
+        for search_id, search_dict in searches.items():
+            itineraries.setdefault(itinerary_key(search_dict), []).append(search_id)
+        
+        search_function = self.get_search_function()
+        flight_results = {}
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(itineraries)))) as executor:
+            futures = {
+                executor.submit(search_function, searches[ids[0]]): key
+                for key, ids in itineraries.items()
+            }
+            for future in as_completed(futures):
+                try:
+                    flight_results[futures[future]] = future.result()
+                except Exception:
+                    # Un itinerario fallido no debe abortar todo el lote
+                    continue
+        
+        rows = []
+        itinerary_of = {}
+        payloads = {}
+        for key, flight_result in flight_results.items():
+            if not flight_result:
+                continue
+            # Una respuesta por itinerario, compartida por sus búsquedas
+            payloads[key] = self.encode_raw_payload(flight_result)
+            # Solo la primera búsqueda del itinerario cuenta como consulta al proveedor
+            provider_call = 0 if flight_result.get('cached') else 1
+            for search_id in itineraries[key]:
+                itinerary_of[search_id] = key
+                rows.append((
+                    search_id,
+                    flight_result['price'],
+                    flight_result['currency'],
+                    flight_result['airline'],
+                    flight_result['flight_details'],
+                    flight_result.get('source'),
+                    payloads[key][0] if payloads[key] else None,
+                    provider_call
+                ))
+                provider_call = 0
+        
+        checked_ids = [row[0] for row in rows]
+        previous_mins = {}
+        write_started = time.perf_counter()
+        with conn:
+            store_payloads(conn, payloads.values())
+            conn.executemany('''
+                INSERT INTO price_history
+                (search_id, price, currency, airline, flight_details, source, payload_hash, provider_call)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            
+            # Con AUTOINCREMENT y el bloqueo de escritura de esta transacción
+            # los IDs del lote son consecutivos y terminan en last_insert_rowid()
+            if rows:
+                last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+                offer_params = []
+                for price_history_id, row in enumerate(rows, start=last_id - len(rows) + 1):
+                    offers = flight_results[itinerary_of[row[0]]].get('offers') or []
+                    offer_params.extend(offer_rows(price_history_id, row[0], offers))
+                store_offers(conn, offer_params)
+            
+            # Mínimos previos leídos dentro de la transacción de escritura
+            with timed('flight_min_query_seconds', path='batch'):
+                for chunk in chunked(checked_ids, SQLITE_MAX_PARAMS):
+                    placeholders = ','.join('?' * len(chunk))
+                    cursor.execute(f'''
+                        SELECT search_id, min_price FROM search_stats
+                        WHERE search_id IN ({placeholders})
+                    ''', chunk)
+                    previous_mins.update(cursor.fetchall())
+            
+            conn.executemany(UPSERT_SEARCH_STATS_SQL,
+                             [stats_params(row[0], row[1]) for row in rows])
+        observe('flight_db_insert_seconds', time.perf_counter() - write_started, path='batch')
+        
+        results = {}
+        for key, flight_result in flight_results.items():
+            if not flight_result:
+                continue
+            for search_id in itineraries[key]:
+                search_dict = searches[search_id]
+                results[search_id] = {
+                    'flight_result': flight_result,
+                    'is_lowest': (previous_mins.get(search_id) is None or
+                                  flight_result['price'] <= previous_mins[search_id]),
+                    'meets_target': (search_dict['target_price'] and
+                                     flight_result['price'] <= search_dict['target_price']),
+                    'previous_min': previous_mins.get(search_id),
+                    'search_data': search_dict
+                }
+        self.queue_price_alerts(results)
+        observe('flight_check_seconds', time.perf_counter() - check_started, path='batch')
+        return results
+    
+    def check_all_active(self, max_workers: int = 8) -> Dict[int, Dict]:
+        """Chequea todas las búsquedas activas en una sola pasada"""
+        conn = self.get_connection()
+        search_ids = [row[0] for row in conn.execute('SELECT id FROM flight_searches WHERE is_active = 1')]
+        return self.check_many(search_ids, max_workers=max_workers)
+    
+    def build_price_alerts(self, results: Dict[int, Dict]) -> List[Dict]:
+        """Notificaciones para precios objetivo alcanzados y nuevos mínimos"""
+        alerts = []
+        for search_id, result in results.items():
+            search_dict = result['search_data']
+            recipient = search_dict.get('email_notification')
+            if not recipient:
+                continue
+            flight = result['flight_result']
+            price = flight['price']
+            route = f"{search_dict['origin']} → {search_dict['destination']} ({search_dict['departure_date']})"
+            if result['meets_target']:
+                notification_type = 'target_price'
+                subject = f"🎯 Precio objetivo alcanzado: {search_dict['search_name']}"
+                headline = f"¡Precio objetivo alcanzado! ${price} USD (objetivo ${search_dict['target_price']} USD)"
+            elif result['is_lowest'] and result.get('previous_min') is not None and price < result['previous_min']:
+                notification_type = 'new_low'
+                subject = f"📉 Nuevo precio más bajo: {search_dict['search_name']}"
+                headline = f"Nuevo precio más bajo: ${price} USD (anterior ${result['previous_min']} USD)"
+            else:
+                continue
+            alerts.append({
+                'search_id': search_id,
+                'notification_type': notification_type,
+                'recipient': recipient,
+                'subject': subject,
+                'message': f"{headline}\n\n{route}\nAerolínea: {flight.get('airline')}\n"
+                           f"Fuente: {flight.get('source', 'N/A')}",
+                # Objetivo alcanzado: un aviso por búsqueda y ventana; nuevo mínimo: uno por precio
+                'dedup_key': (f"target_price:{search_id}" if notification_type == 'target_price'
+                              else f"new_low:{search_id}:{price:.2f}"),
+            })
+        return alerts
+    
+    def queue_price_alerts(self, results: Dict[int, Dict]) -> int:
+        """
+        Encola en la bandeja de salida las alertas de un lote de chequeos:
+        el precio objetivo de cada búsqueda y las reglas de alert_rules,
+        evaluadas todas en una sola pasada.
+        """
+        if not results:
+            return 0
+        conn = self.get_connection()
+        alerts = self.build_price_alerts(results)
+        
+        batch = pd.DataFrame([{
+            'search_id': search_id,
+            'price': result['flight_result']['price'],
+            'previous_min': result.get('previous_min'),
+            'search_name': result['search_data'].get('search_name'),
+            'origin': result['search_data'].get('origin'),
+            'destination': result['search_data'].get('destination'),
+            'departure_date': result['search_data'].get('departure_date'),
+            'email_notification': result['search_data'].get('email_notification'),
+        } for search_id, result in results.items()])
+        fired = evaluate_alert_rules(conn, batch)
+        rule_alerts = alert_notifications(fired) if not fired.empty else []
+        alerts.extend(rule_alerts)
+        
+        if not alerts:
+            return 0
+        queued = enqueue_notifications(conn, alerts)
+        # El periodo de espera empieza solo cuando el aviso ya está encolado
+        mark_rules_fired(conn, [alert['rule_id'] for alert in rule_alerts])
+        return queued
+    
+    def send_notification(self, email: str, subject: str, message: str,
+                          search_id: Optional[int] = None, notification_type: str = 'manual') -> bool:
+        """
+        Encola una notificación por email. El envío lo hace el despachador en
+        segundo plano (flight_notifications), reutilizando la conexión SMTP.
+        """
+        queued = enqueue_notifications(self.get_connection(), [{
+            'search_id': search_id,
+            'notification_type': notification_type,
+            'recipient': email,
+            'subject': subject,
+            'message': message,
+        }])
+        return queued > 0
@@ -0,0 +1,265 @@
+"""
+Servidor local que imita Amadeus y Skyscanner con fallos inyectados
+Sirve las mismas rutas que el stub de flight_simulation (token OAuth,
+flight-offers y browsequotes) con respuestas del simulador, y por cada
+petición puede añadir latencia según una distribución, responder 429 (con
+Retry-After) o 5xx, o no responder (timeout). Permite medir el camino HTTP
+real del conector (sesiones, reintentos, limitadores, modos concurrentes)
+sin red.
+
+Uso como proceso independiente:
+    python mock_providers.py --port 8089 --latency lognormal --latency-ms 120 --spread 0.8 \\
+        --rate-429 0.05 --rate-5xx 0.02 --rate-timeout 0.01 --offers 50
+
+y en el proceso que se quiere medir:
+    AMADEUS_BASE_URL=http://127.0.0.1:8089 SKYSCANNER_BASE_URL=http://127.0.0.1:8089
+"""
+
+import argparse
+import copy
+import threading
+import time
+from collections import Counter
+from http.server import ThreadingHTTPServer
+from typing import Dict, NamedTuple, Optional, Tuple, Union
+from urllib.parse import urlparse
+
+import numpy as np
+
+from flight_simulation import FlightSimulator, SimulatedProviderHandler, make_stub_server
+
+LATENCY_MODELS = ('fixed', 'uniform', 'lognormal')
+SERVER_ERRORS = (500, 502, 503, 504)
+
+# Rutas del servidor por endpoint
+ENDPOINT_AMADEUS_AUTH = 'amadeus_auth'
+ENDPOINT_AMADEUS = 'amadeus'
+ENDPOINT_SKYSCANNER = 'skyscanner'
+STATS_PATH = '/_mock/stats'
+
+
+class FaultProfile(NamedTuple):
+    """
+    Comportamiento de un endpoint. `latency_ms` es la latencia fija, la media
+    (uniforme, ± spread) o la mediana (lognormal, sigma = spread). Las tasas
+    son probabilidades por petición; `offers` fija el tamaño de las respuestas
+    (None = las ofertas del simulador).
+    """
+    latency: str = 'fixed'
+    latency_ms: float = 0.0
+    spread: float = 0.5
+    rate_429: float = 0.0
+    rate_5xx: float = 0.0
+    rate_timeout: float = 0.0
+    hang_seconds: float = 30.0
+    retry_after: int = 1
+    offers: Optional[int] = None
+
+
+class FaultInjector:
+    """Decide la latencia y el fallo de cada petición y cuenta los resultados"""
+
+    def __init__(self, profiles: Union[FaultProfile, Dict[str, FaultProfile]], seed: int = 0):
+        if isinstance(profiles, FaultProfile):
+            profiles = {ENDPOINT_AMADEUS: profiles, ENDPOINT_SKYSCANNER: profiles}
+        for profile in profiles.values():
+            if profile.latency not in LATENCY_MODELS:
+                raise ValueError(f"Modelo de latencia desconocido: {profile.latency}")
+        self.profiles = dict(profiles)
+        # El generador de NumPy no es seguro entre hilos
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    def profile_for(self, endpoint: str) -> FaultProfile:
+        """Perfil del endpoint; el token de Amadeus usa el de Amadeus si no tiene uno propio"""
+        profile = self.profiles.get(endpoint)
+        if profile is None and endpoint == ENDPOINT_AMADEUS_AUTH:
+            profile = self.profiles.get(ENDPOINT_AMADEUS)
+        return profile or FaultProfile()
+
+    def decide(self, endpoint: str) -> Tuple[float, Union[int, str]]:
+        """(segundos de espera, 200 / 429 / 5xx / 'timeout') para una petición"""
+        profile = self.profile_for(endpoint)
+        with self._lock:
+            if profile.latency == 'uniform':
+                delay = profile.latency_ms * self._rng.uniform(1 - profile.spread, 1 + profile.spread)
+            elif profile.latency == 'lognormal':
+                delay = profile.latency_ms * self._rng.lognormal(0.0, profile.spread)
+            else:
+                delay = profile.latency_ms
+            draw = self._rng.random()
+            if draw < profile.rate_timeout:
+                outcome = 'timeout'
+            elif draw < profile.rate_timeout + profile.rate_429:
+                outcome = 429
+            elif draw < profile.rate_timeout + profile.rate_429 + profile.rate_5xx:
+                outcome = int(self._rng.choice(SERVER_ERRORS))
+            else:
+                outcome = 200
+        return max(delay, 0.0) / 1000.0, outcome
+
+    def record(self, endpoint: str, outcome):
+        with self._lock:
+            self.stats[f"{endpoint}:{outcome}"] += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.stats)
+
+
+def endpoint_for_path(path: str) -> Optional[str]:
+    if path == '/v1/security/oauth2/token':
+        return ENDPOINT_AMADEUS_AUTH
+    if path == '/v2/shopping/flight-offers':
+        return ENDPOINT_AMADEUS
+    if path.startswith('/apiservices/browsequotes/'):
+        return ENDPOINT_SKYSCANNER
+    return None
+
+
+def scale_price(value: float, round_number: int) -> float:
+    """Las copias de relleno son un 1% más caras por vuelta para no duplicar precios"""
+    return round(float(value) * (1.0 + 0.01 * round_number), 2)
+
+
+def pad_amadeus(payload: Dict, count: int) -> Dict:
+    """Ajusta una respuesta de flight-offers a `count` ofertas"""
+    data = payload['data']
+    if not data:
+        return payload
+    padded = []
+    for index in range(count):
+        offer = data[index % len(data)]
+        round_number = index // len(data)
+        if round_number:
+            offer = copy.deepcopy(offer)
+            offer['id'] = str(index + 1)
+            for field in ('total', 'base', 'grandTotal'):
+                offer['price'][field] = f"{scale_price(offer['price'][field], round_number):.2f}"
+        padded.append(offer)
+    return {'meta': {'count': count}, 'data': padded}
+
+
+def pad_skyscanner(payload: Dict, count: int) -> Dict:
+    """Ajusta una respuesta de browsequotes a `count` citas"""
+    quotes = payload['Quotes']
+    if not quotes:
+        return payload
+    padded = []
+    for index in range(count):
+        quote = quotes[index % len(quotes)]
+        round_number = index // len(quotes)
+        if round_number:
+            quote = copy.deepcopy(quote)
+            quote['QuoteId'] = index + 1
+            quote['MinPrice'] = scale_price(quote['MinPrice'], round_number)
+        padded.append(quote)
+    return dict(payload, Quotes=padded)
+
+
+class MockProviderHandler(SimulatedProviderHandler):
+    server_version = 'FlightMockProviders/1.0'
+
+    def inject(self) -> bool:
+        """Aplica latencia y fallos; True si la petición ya fue atendida"""
+        path = urlparse(self.path).path
+        endpoint = endpoint_for_path(path)
+        if endpoint is None:
+            if path == STATS_PATH:
+                self.send_json(200, self.server.faults.snapshot())
+                return True
+            return False
+
+        faults = self.server.faults
+        delay, outcome = faults.decide(endpoint)
+        faults.record(endpoint, outcome)
+        if delay:
+            time.sleep(delay)
+        if outcome == 'timeout':
+            # Sin respuesta: el cliente agota su timeout de lectura
+            time.sleep(faults.profile_for(endpoint).hang_seconds)
+            self.close_connection = True
+            return True
+        if outcome == 429:
+            self.send_json(429, {'errors': [{'status': 429, 'title': 'Too Many Requests'}]},
+                           headers={'Retry-After': str(faults.profile_for(endpoint).retry_after)})
+            return True
+        if outcome != 200:
+            self.send_json(outcome, {'errors': [{'status': outcome, 'title': 'Server Error'}]})
+            return True
+        return False
+
+    def amadeus_response(self, search_data: Dict, max_offers: Optional[int]) -> Dict:
+        offers = self.server.faults.profile_for(ENDPOINT_AMADEUS).offers
+        if offers is None:
+            return super().amadeus_response(search_data, max_offers)
+        # `max` de la petición sigue siendo el tope, como en el servidor real
+        if max_offers is not None:
+            offers = min(offers, max_offers)
+        return pad_amadeus(self.server.simulator.amadeus_payload(search_data), offers)
+
+    def skyscanner_response(self, search_data: Dict) -> Dict:
+        offers = self.server.faults.profile_for(ENDPOINT_SKYSCANNER).offers
+        payload = super().skyscanner_response(search_data)
+        return payload if offers is None else pad_skyscanner(payload, offers)
+
+    def do_GET(self):
+        if not self.inject():
+            super().do_GET()
+
+    def do_POST(self):
+        if not self.inject():
+            super().do_POST()
+
+
+def make_mock_server(profiles: Union[FaultProfile, Dict[str, FaultProfile]] = FaultProfile(),
+                     simulator: Optional[FlightSimulator] = None, host: str = '127.0.0.1',
+                     port: int = 0, seed: int = 0) -> ThreadingHTTPServer:
+    """
+    Servidor (sin iniciar) con un perfil de fallos común o uno por endpoint
+    ('amadeus_auth', 'amadeus', 'skyscanner'); port=0 elige uno libre.
+    """
+    server = make_stub_server(simulator or FlightSimulator(seed=seed), host, port, handler=MockProviderHandler)
+    server.faults = FaultInjector(profiles, seed=seed)
+    return server
+
+
+def start_mock_server(*args, **kwargs) -> Tuple[ThreadingHTTPServer, str]:
+    """Inicia el servidor en un hilo daemon y devuelve (servidor, URL base)"""
+    server = make_mock_server(*args, **kwargs)
+    threading.Thread(target=server.serve_forever, name='mock-providers', daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local tipo Amadeus/Skyscanner con fallos inyectados")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", choices=LATENCY_MODELS, default='fixed')
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latencia fija, media o mediana")
+    parser.add_argument("--spread", type=float, default=0.5, help="± fracción (uniforme) o sigma (lognormal)")
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-5xx", type=float, default=0.0)
+    parser.add_argument("--rate-timeout", type=float, default=0.0)
+    parser.add_argument("--hang-seconds", type=float, default=30.0, help="Espera de las peticiones sin respuesta")
+    parser.add_argument("--offers", type=int, help="Ofertas por respuesta (tamaño del payload)")
+    args = parser.parse_args()
+
+    profile = FaultProfile(latency=args.latency, latency_ms=args.latency_ms, spread=args.spread,
+                           rate_429=args.rate_429, rate_5xx=args.rate_5xx, rate_timeout=args.rate_timeout,
+                           hang_seconds=args.hang_seconds, offers=args.offers)
+    server = make_mock_server(profile, host=args.host, port=args.port, seed=args.seed)
+    base_url = f"http://{args.host}:{server.server_address[1]}"
+    print(f"Proveedores simulados en {base_url} (estadísticas en {base_url}{STATS_PATH})")
+    print(f"  AMADEUS_BASE_URL={base_url} SKYSCANNER_BASE_URL={base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,254 @@
+"""
+Reglas de alerta de precios
+Las reglas se guardan en la tabla alert_rules y se evalúan en bloque tras
+cada lote de chequeos: una consulta trae las reglas activas y el historial
+reciente de las búsquedas del lote, y todas las condiciones se calculan con
+operaciones vectorizadas de pandas/NumPy.
+"""
+
+import time
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# Tipos de regla y su descripción en la interfaz
+RULE_TARGET_PRICE = 'target_price'
+RULE_PERCENT_DROP = 'percent_drop'
+RULE_ALL_TIME_LOW = 'all_time_low'
+RULE_PERCENTILE = 'percentile'
+
+ALERT_RULE_TYPES = {
+    RULE_TARGET_PRICE: "Precio por debajo de un objetivo (USD)",
+    RULE_PERCENT_DROP: "Caída porcentual frente a la media móvil (%)",
+    RULE_ALL_TIME_LOW: "Nuevo mínimo histórico",
+    RULE_PERCENTILE: "Precio por debajo del percentil N del historial",
+}
+
+# Historial máximo considerado para percentiles y mínimo de chequeos para que tengan sentido
+PERCENTILE_LOOKBACK = 500
+MIN_PERCENTILE_HISTORY = 5
+
+DEFAULT_WINDOW = 10
+DEFAULT_COOLDOWN_MINUTES = 24 * 60
+
+ALERT_RULES_MIGRATION_SQL = [
+    '''
+    CREATE TABLE IF NOT EXISTS alert_rules (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        search_id INTEGER NOT NULL,
+        rule_type TEXT NOT NULL,
+        threshold REAL,
+        window_size INTEGER NOT NULL DEFAULT 10,
+        email TEXT,
+        cooldown_minutes INTEGER NOT NULL DEFAULT 1440,
+        is_active BOOLEAN NOT NULL DEFAULT 1,
+        last_fired_at REAL,
+        fire_count INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (search_id) REFERENCES flight_searches (id)
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_alert_rules_search_active ON alert_rules (search_id, is_active)',
+]
+
+RULE_COLUMNS = ['id', 'search_id', 'rule_type', 'threshold', 'window_size', 'email',
+                'cooldown_minutes', 'last_fired_at']
+
+
+def add_alert_rule(conn, search_id: int, rule_type: str, threshold: Optional[float] = None,
+                   email: Optional[str] = None, window_size: int = DEFAULT_WINDOW,
+                   cooldown_minutes: int = DEFAULT_COOLDOWN_MINUTES) -> int:
+    """Crea una regla de alerta y devuelve su ID"""
+    if rule_type not in ALERT_RULE_TYPES:
+        raise ValueError(f"Tipo de regla desconocido: {rule_type}")
+    if rule_type != RULE_ALL_TIME_LOW and (threshold is None or threshold <= 0):
+        raise ValueError("La regla necesita un umbral positivo")
+    if rule_type == RULE_PERCENTILE and threshold >= 100:
+        raise ValueError("El percentil debe estar entre 0 y 100")
+    if window_size < 1:
+        raise ValueError("La ventana debe ser de al menos 1 chequeo")
+
+    with conn:
+        cursor = conn.execute('''
+            INSERT INTO alert_rules (search_id, rule_type, threshold, window_size, email, cooldown_minutes)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (int(search_id), rule_type, threshold, int(window_size), email or None, int(cooldown_minutes)))
+    return cursor.lastrowid
+
+
+def list_alert_rules(conn, search_id: Optional[int] = None) -> pd.DataFrame:
+    """Reglas (activas e inactivas) de una búsqueda o de todas"""
+    query = 'SELECT * FROM alert_rules'
+    params = ()
+    if search_id is not None:
+        query += ' WHERE search_id = ?'
+        params = (int(search_id),)
+    return pd.read_sql_query(query + ' ORDER BY search_id, id', conn, params=params)
+
+
+def set_alert_rule_active(conn, rule_id: int, active: bool):
+    with conn:
+        conn.execute('UPDATE alert_rules SET is_active = ? WHERE id = ?', (1 if active else 0, int(rule_id)))
+
+
+def delete_alert_rule(conn, rule_id: int):
+    with conn:
+        conn.execute('DELETE FROM alert_rules WHERE id = ?', (int(rule_id),))
+
+
+def _stage_search_ids(conn, search_ids: Iterable[int]):
+    """Tabla temporal con los IDs del lote en lugar de un IN con miles de parámetros"""
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS alert_batch_ids (id INTEGER PRIMARY KEY)')
+    conn.execute('DELETE FROM alert_batch_ids')
+    conn.executemany('INSERT OR IGNORE INTO alert_batch_ids (id) VALUES (?)',
+                     [(int(search_id),) for search_id in search_ids])
+    conn.commit()
+
+
+def load_active_rules(conn) -> pd.DataFrame:
+    """Reglas activas de las búsquedas del lote (requiere _stage_search_ids)"""
+    return pd.read_sql_query(f'''
+        SELECT {', '.join(RULE_COLUMNS)} FROM alert_rules
+        WHERE is_active = 1 AND search_id IN (SELECT id FROM alert_batch_ids)
+    ''', conn)
+
+
+def load_recent_prices(conn, limit: int) -> pd.DataFrame:
+    """
+    Últimos `limit` precios anteriores al chequeo más reciente de cada búsqueda
+    del lote, con lag 1 = el anterior al actual (requiere _stage_search_ids).
+    """
+    return pd.read_sql_query('''
+        SELECT search_id, price, rn - 1 AS lag FROM (
+            SELECT search_id, price,
+                   ROW_NUMBER() OVER (PARTITION BY search_id ORDER BY checked_at DESC, id DESC) AS rn
+            FROM price_history
+            WHERE search_id IN (SELECT id FROM alert_batch_ids)
+        )
+        WHERE rn BETWEEN 2 AND ?
+    ''', conn, params=(int(limit) + 1,))
+
+
+def evaluate_alert_rules(conn, batch: pd.DataFrame, now: Optional[float] = None) -> pd.DataFrame:
+    """
+    Evalúa todas las reglas activas contra un lote de precios nuevos.
+
+    `batch` tiene una fila por búsqueda chequeada con search_id, price y
+    previous_min (mínimo antes del chequeo), y opcionalmente datos de la
+    búsqueda para los mensajes. Los precios ya deben estar guardados en
+    price_history. Devuelve las reglas disparadas (fuera de su periodo de
+    espera) con el valor de referencia. No toca last_fired_at: eso lo hace
+    mark_rules_fired una vez encolados los avisos.
+    """
+    if batch.empty:
+        return pd.DataFrame()
+    now = now or time.time()
+
+    _stage_search_ids(conn, batch['search_id'].unique().tolist())
+    rules = load_active_rules(conn)
+    if rules.empty:
+        return pd.DataFrame()
+
+    candidates = rules.merge(batch, on='search_id', how='inner')
+    if 'previous_min' not in candidates:
+        candidates['previous_min'] = np.nan
+    candidates['previous_min'] = candidates['previous_min'].astype(float)
+    candidates['reference'] = np.nan
+
+    lookback = int(candidates['window_size'].max())
+    if (candidates['rule_type'] == RULE_PERCENTILE).any():
+        lookback = max(lookback, PERCENTILE_LOOKBACK)
+    history = load_recent_prices(conn, lookback)
+
+    # Media móvil de los `window_size` chequeos previos (una agregación por ventana distinta)
+    is_drop = candidates['rule_type'] == RULE_PERCENT_DROP
+    for window in candidates.loc[is_drop, 'window_size'].unique():
+        means = history[history['lag'] <= window].groupby('search_id')['price'].mean()
+        mask = is_drop & (candidates['window_size'] == window)
+        candidates.loc[mask, 'reference'] = candidates.loc[mask, 'search_id'].map(means)
+
+    # Rango percentil del precio nuevo dentro de su historial
+    is_percentile = candidates['rule_type'] == RULE_PERCENTILE
+    if is_percentile.any():
+        window_history = history[history['lag'] <= PERCENTILE_LOOKBACK].merge(
+            batch[['search_id', 'price']].rename(columns={'price': 'new_price'}), on='search_id')
+        below = (window_history['price'] < window_history['new_price']).groupby(window_history['search_id'])
+        percentile_rank = below.mean() * 100.0
+        history_count = below.size()
+        candidates.loc[is_percentile, 'reference'] = candidates.loc[is_percentile, 'search_id'].map(percentile_rank)
+        candidates['history_count'] = candidates['search_id'].map(history_count).fillna(0)
+    else:
+        candidates['history_count'] = 0
+
+    is_target = candidates['rule_type'] == RULE_TARGET_PRICE
+    is_low = candidates['rule_type'] == RULE_ALL_TIME_LOW
+    candidates.loc[is_target, 'reference'] = candidates.loc[is_target, 'threshold']
+    candidates.loc[is_low, 'reference'] = candidates.loc[is_low, 'previous_min']
+
+    price = candidates['price'].astype(float)
+    threshold = candidates['threshold'].astype(float)
+    reference = candidates['reference'].astype(float)
+    condition = np.select(
+        [is_target, is_drop, is_low, is_percentile],
+        [
+            price <= threshold,
+            reference.notna() & (price <= reference * (1.0 - threshold / 100.0)),
+            reference.notna() & (price < reference),
+            (candidates['history_count'] >= MIN_PERCENTILE_HISTORY) & (reference < threshold),
+        ],
+        default=False
+    ).astype(bool)
+
+    cooled_down = (candidates['last_fired_at'].isna() |
+                   (now - candidates['last_fired_at'].astype(float) >= candidates['cooldown_minutes'] * 60))
+    fired = candidates[condition & cooled_down.to_numpy()].rename(columns={'id': 'rule_id'})
+    return fired.reset_index(drop=True)
+
+
+def mark_rules_fired(conn, rule_ids: List[int], now: Optional[float] = None):
+    """Inicia el periodo de espera de las reglas cuyo aviso ya está en la bandeja de salida"""
+    if not rule_ids:
+        return
+    now = now or time.time()
+    with conn:
+        conn.executemany(
+            'UPDATE alert_rules SET last_fired_at = ?, fire_count = fire_count + 1 WHERE id = ?',
+            [(now, int(rule_id)) for rule_id in rule_ids]
+        )
+
+
+def describe_fired_rule(rule: Dict) -> str:
+    """Frase que explica por qué se disparó una regla"""
+    price = rule['price']
+    reference = rule.get('reference')
+    rule_type = rule['rule_type']
+    if rule_type == RULE_TARGET_PRICE:
+        return f"El precio bajó a ${price:.2f} USD (objetivo ${reference:.2f} USD)"
+    if rule_type == RULE_PERCENT_DROP:
+        drop = (1.0 - price / reference) * 100.0
+        return (f"El precio de ${price:.2f} USD está {drop:.1f}% por debajo de la media "
+                f"de los últimos {int(rule['window_size'])} chequeos (${reference:.2f} USD)")
+    if rule_type == RULE_ALL_TIME_LOW:
+        return f"Nuevo mínimo histórico: ${price:.2f} USD (anterior ${reference:.2f} USD)"
+    return (f"El precio de ${price:.2f} USD está por debajo del percentil {rule['threshold']:.0f} "
+            f"del historial (percentil {reference:.0f})")
+
+
+def alert_notifications(fired: pd.DataFrame) -> List[Dict]:
+    """Notificaciones para la bandeja de salida a partir de las reglas disparadas"""
+    notifications = []
+    for rule in fired.to_dict('records'):
+        recipient = rule.get('email') or rule.get('email_notification')
+        if not recipient:
+            continue
+        route = f"{rule.get('origin', '')} → {rule.get('destination', '')} ({rule.get('departure_date', '')})"
+        notifications.append({
+            'rule_id': rule['rule_id'],
+            'search_id': rule['search_id'],
+            'notification_type': f"rule:{rule['rule_type']}",
+            'recipient': recipient,
+            'subject': f"🔔 Alerta de precio: {rule.get('search_name') or route}",
+            'message': f"{describe_fired_rule(rule)}\n\n{route}",
+        })
+    return notifications
@@ -0,0 +1,159 @@
+"""
+Analítica vectorizada del historial de precios
+Calcula estadísticas móviles, tendencias y perfiles por anticipación para
+muchas búsquedas a la vez con operaciones agrupadas de pandas/NumPy
+sobre una sola consulta masiva.
+"""
+
+import numpy as np
+import pandas as pd
+from typing import Iterable, Optional
+
+# Tramos de días hasta la salida
+DAYS_TO_DEPARTURE_BINS = [-np.inf, 7, 14, 30, 60, 90, 180, np.inf]
+DAYS_TO_DEPARTURE_LABELS = ['0-7', '8-14', '15-30', '31-60', '61-90', '91-180', '180+']
+
+
+def load_price_history(conn, search_ids: Optional[Iterable[int]] = None) -> pd.DataFrame:
+    """
+    Carga el historial de varias búsquedas en una sola consulta,
+    ordenado por búsqueda y fecha de chequeo.
+    """
+    query = '''
+        SELECT p.search_id, p.price, p.airline, p.checked_at,
+               s.search_name, s.origin, s.destination, s.departure_date, s.target_price
+        FROM price_history p
+        JOIN flight_searches s ON s.id = p.search_id
+    '''
+    if search_ids is not None:
+        search_ids = [int(search_id) for search_id in search_ids]
+        if not search_ids:
+            return pd.DataFrame(columns=['search_id', 'price', 'airline', 'checked_at', 'search_name',
+                                         'origin', 'destination', 'departure_date', 'target_price'])
+        # Tabla temporal en lugar de un IN con miles de parámetros
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS analytics_ids (id INTEGER PRIMARY KEY)')
+        conn.execute('DELETE FROM analytics_ids')
+        conn.executemany('INSERT OR IGNORE INTO analytics_ids (id) VALUES (?)', [(i,) for i in search_ids])
+        # Cerrar la transacción implícita para no congelar la instantánea de lectura
+        conn.commit()
+        query += ' WHERE p.search_id IN (SELECT id FROM analytics_ids)'
+    query += ' ORDER BY p.search_id, p.checked_at, p.id'
+
+    df = pd.read_sql_query(query, conn)
+    df['checked_at'] = pd.to_datetime(df['checked_at'])
+    df['departure_date'] = pd.to_datetime(df['departure_date'])
+    return df
+
+
+def add_rolling_features(df: pd.DataFrame, window: int = 5, span: int = 5) -> pd.DataFrame:
+    """
+    Añade columnas por búsqueda: media móvil, EWMA, pico acumulado,
+    caída desde el pico y días hasta la salida. Espera el orden de
+    load_price_history (search_id, checked_at).
+    """
+    df = df.copy()
+    grouped = df.groupby('search_id', sort=False)['price']
+
+    df['rolling_mean'] = grouped.rolling(window, min_periods=1).mean().reset_index(level=0, drop=True)
+    df['ewma'] = grouped.ewm(span=span, adjust=False).mean().reset_index(level=0, drop=True)
+    df['running_peak'] = grouped.cummax()
+    df['drawdown'] = df['price'] / df['running_peak'] - 1.0
+    df['price_change'] = grouped.diff()
+
+    days = (df['departure_date'] - df['checked_at'].dt.normalize()).dt.days
+    df['days_to_departure'] = days
+    df['dtd_bucket'] = pd.cut(days, bins=DAYS_TO_DEPARTURE_BINS, labels=DAYS_TO_DEPARTURE_LABELS)
+    return df
+
+
+def trend_slopes(df: pd.DataFrame) -> pd.Series:
+    """
+    Pendiente de la recta de mínimos cuadrados (USD por día) de cada búsqueda,
+    calculada con sumas agrupadas en lugar de un ajuste por búsqueda.
+    """
+    first_check = df.groupby('search_id')['checked_at'].transform('min')
+    x = (df['checked_at'] - first_check).dt.total_seconds().to_numpy() / 86400.0
+    y = df['price'].to_numpy(dtype=float)
+
+    sums = pd.DataFrame({
+        'search_id': df['search_id'].to_numpy(),
+        'n': 1.0,
+        'x': x,
+        'y': y,
+        'xx': x * x,
+        'xy': x * y,
+    }).groupby('search_id').sum()
+
+    denominator = sums['n'] * sums['xx'] - sums['x'] ** 2
+    numerator = sums['n'] * sums['xy'] - sums['x'] * sums['y']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slopes = numerator / denominator
+    # Sin variación temporal (un solo chequeo o todos a la vez) no hay tendencia
+    return slopes.where(denominator.abs() > 1e-12, 0.0).rename('trend_slope')
+
+
+def summarize_routes(df: pd.DataFrame) -> pd.DataFrame:
+    """Resumen por búsqueda: precios, percentiles, caída máxima y tendencia"""
+    if df.empty:
+        return pd.DataFrame()
+
+    grouped = df.groupby('search_id', sort=False)
+    summary = grouped.agg(
+        search_name=('search_name', 'first'),
+        origin=('origin', 'first'),
+        destination=('destination', 'first'),
+        target_price=('target_price', 'first'),
+        checks=('price', 'size'),
+        current_price=('price', 'last'),
+        min_price=('price', 'min'),
+        max_price=('price', 'max'),
+        mean_price=('price', 'mean'),
+        std_price=('price', 'std'),
+        last_checked=('checked_at', 'max'),
+    )
+
+    percentiles = grouped['price'].quantile([0.1, 0.5, 0.9]).unstack()
+    percentiles.columns = ['p10', 'p50', 'p90']
+    summary = summary.join(percentiles)
+
+    if 'drawdown' not in df:
+        df = add_rolling_features(df)
+    summary['max_drawdown'] = df.groupby('search_id', sort=False)['drawdown'].min()
+    summary['trend_slope'] = trend_slopes(df)
+    summary['vs_mean'] = summary['current_price'] / summary['mean_price'] - 1.0
+    summary['below_target'] = summary['current_price'] <= summary['target_price']
+    return summary.reset_index()
+
+
+def days_to_departure_profile(df: pd.DataFrame) -> pd.DataFrame:
+    """Precio medio por tramo de días hasta la salida y ruta"""
+    if 'dtd_bucket' not in df:
+        df = add_rolling_features(df)
+    df = df.assign(route=df['origin'] + '→' + df['destination'])
+    return df.pivot_table(index='route', columns='dtd_bucket', values='price',
+                          aggfunc='mean', observed=False)
+
+
+def compute_route_analytics(monitor, search_ids: Optional[Iterable[int]] = None,
+                            window: int = 5, span: int = 5):
+    """
+    Analítica completa de todas las rutas (o de las indicadas).
+    Devuelve (historial con columnas derivadas, resumen por búsqueda).
+    """
+    history = load_price_history(monitor.get_connection(), search_ids)
+    if history.empty:
+        return history, pd.DataFrame()
+    history = add_rolling_features(history, window=window, span=span)
+    return history, summarize_routes(history)
+
+
+def describe_trend(slope: float, mean_price: float, threshold: float = 0.001) -> str:
+    """Describe una pendiente relativa al precio medio (umbral por día)"""
+    if not mean_price or np.isnan(slope):
+        return "➡️ Estable"
+    relative = slope / mean_price
+    if relative > threshold:
+        return "📈 Subiendo"
+    if relative < -threshold:
+        return "📉 Bajando"
+    return "➡️ Estable"
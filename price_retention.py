@@ -0,0 +1,333 @@
+"""
+Retención y compactación del historial de precios
+Mantiene las filas crudas de una ventana reciente y resume los datos más
+antiguos en tablas horarias y diarias tipo OHLC (mín/máx/primero/último/conteo).
+Los gráficos leen la resolución adecuada según el rango visible.
+
+Uso como proceso independiente:
+    python price_retention.py --raw-days 30 --hourly-days 180
+"""
+
+import argparse
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+import pandas as pd
+
+from raw_payloads import prune_payloads
+
+# Formatos strftime de SQLite para cada tamaño de bucket
+HOUR_FORMAT = '%Y-%m-%d %H:00:00'
+DAY_FORMAT = '%Y-%m-%d 00:00:00'
+
+# Resolución según el rango visible del gráfico
+RESOLUTION_THRESHOLDS = (
+    (timedelta(days=3), 'raw'),
+    (timedelta(days=60), 'hour'),
+)
+
+ROLLUP_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS {table} (
+        search_id INTEGER NOT NULL,
+        bucket_start TEXT NOT NULL,
+        min_price REAL NOT NULL,
+        max_price REAL NOT NULL,
+        first_price REAL NOT NULL,
+        last_price REAL NOT NULL,
+        sum_price REAL NOT NULL,
+        price_count INTEGER NOT NULL,
+        PRIMARY KEY (search_id, bucket_start)
+    ) WITHOUT ROWID
+'''
+
+# Fecha del primer y último precio de cada bucket, para fusionar en orden
+# filas que llegan tarde (importaciones con fechas ya compactadas). En los
+# buckets previos se asume lo conservador: primero al inicio y último al final.
+ROLLUP_BOUNDS_MIGRATION_SQL = [
+    statement
+    for table, bucket_seconds in (('price_rollup_hourly', 3599), ('price_rollup_daily', 86399))
+    for statement in (
+        f'ALTER TABLE {table} ADD COLUMN first_at TEXT',
+        f'ALTER TABLE {table} ADD COLUMN last_at TEXT',
+        f"UPDATE {table} SET first_at = bucket_start, "
+        f"last_at = datetime(bucket_start, '+{bucket_seconds} seconds')",
+    )
+]
+
+# Suma de cuadrados por bucket: con ella search_stats se puede reconstruir
+# exactamente desde los rollups. Los buckets previos quedan con NULL.
+ROLLUP_SUM_SQ_MIGRATION_SQL = [
+    'ALTER TABLE price_rollup_hourly ADD COLUMN sum_sq_price REAL',
+    'ALTER TABLE price_rollup_daily ADD COLUMN sum_sq_price REAL',
+]
+
+# Fusión de un bucket ya existente con otro del mismo periodo: primero y
+# último se eligen por fecha, no por orden de llegada
+MERGE_ON_CONFLICT_SQL = '''
+    ON CONFLICT(search_id, bucket_start) DO UPDATE SET
+        min_price = MIN(min_price, excluded.min_price),
+        max_price = MAX(max_price, excluded.max_price),
+        first_price = CASE WHEN excluded.first_at < first_at THEN excluded.first_price ELSE first_price END,
+        last_price = CASE WHEN excluded.last_at >= last_at THEN excluded.last_price ELSE last_price END,
+        first_at = MIN(first_at, excluded.first_at),
+        last_at = MAX(last_at, excluded.last_at),
+        sum_price = sum_price + excluded.sum_price,
+        sum_sq_price = COALESCE(sum_sq_price, sum_price * sum_price / price_count) + excluded.sum_sq_price,
+        price_count = price_count + excluded.price_count
+'''
+
+
+def format_cutoff(moment: datetime) -> str:
+    """Fecha de corte alineada al inicio del día, en formato de CURRENT_TIMESTAMP"""
+    return moment.strftime('%Y-%m-%d 00:00:00')
+
+
+def compact_raw_history(conn: sqlite3.Connection, cutoff: str) -> int:
+    """Resume en price_rollup_hourly las filas de price_history anteriores a `cutoff`"""
+    conn.execute(f'''
+        INSERT INTO price_rollup_hourly
+            (search_id, bucket_start, min_price, max_price, first_price, last_price,
+             sum_price, price_count, first_at, last_at, sum_sq_price)
+        SELECT search_id, bucket_start, MIN(price), MAX(price),
+               MIN(first_price), MIN(last_price), SUM(price), COUNT(*), MIN(checked_at), MAX(checked_at),
+               SUM(price * price)
+        FROM (
+            SELECT search_id, price, checked_at,
+                   strftime('{HOUR_FORMAT}', checked_at) AS bucket_start,
+                   FIRST_VALUE(price) OVER bucket AS first_price,
+                   LAST_VALUE(price) OVER bucket AS last_price
+            FROM price_history
+            WHERE checked_at < ? AND search_id IS NOT NULL
+            WINDOW bucket AS (
+                PARTITION BY search_id, strftime('{HOUR_FORMAT}', checked_at)
+                ORDER BY checked_at, id
+                ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+            )
+        )
+        GROUP BY search_id, bucket_start
+        ORDER BY search_id, bucket_start
+        {MERGE_ON_CONFLICT_SQL}
+    ''', (cutoff,))
+    # Las ofertas detalladas no se resumen: se descartan con sus filas crudas
+    conn.execute('''
+        DELETE FROM offers WHERE price_history_id IN (SELECT id FROM price_history WHERE checked_at < ?)
+    ''', (cutoff,))
+    deleted = conn.execute('DELETE FROM price_history WHERE checked_at < ?', (cutoff,)).rowcount
+    # Y las respuestas crudas que solo referenciaban esas filas
+    prune_payloads(conn)
+    return deleted
+
+
+def compact_hourly_rollups(conn: sqlite3.Connection, cutoff: str) -> int:
+    """Resume en price_rollup_daily los buckets horarios anteriores a `cutoff`"""
+    conn.execute(f'''
+        INSERT INTO price_rollup_daily
+            (search_id, bucket_start, min_price, max_price, first_price, last_price,
+             sum_price, price_count, first_at, last_at, sum_sq_price)
+        SELECT search_id, day_start, MIN(min_price), MAX(max_price),
+               MIN(first_of_day), MIN(last_of_day), SUM(sum_price), SUM(price_count),
+               MIN(first_at), MAX(last_at), SUM(sum_sq_price)
+        FROM (
+            SELECT search_id, min_price, max_price, sum_price, price_count, first_at, last_at,
+                   COALESCE(sum_sq_price, sum_price * sum_price / price_count) AS sum_sq_price,
+                   strftime('{DAY_FORMAT}', bucket_start) AS day_start,
+                   FIRST_VALUE(first_price) OVER (day ORDER BY first_at) AS first_of_day,
+                   LAST_VALUE(last_price) OVER (day ORDER BY last_at
+                       ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING) AS last_of_day
+            FROM price_rollup_hourly
+            WHERE bucket_start < ?
+            WINDOW day AS (PARTITION BY search_id, strftime('{DAY_FORMAT}', bucket_start))
+        )
+        GROUP BY search_id, day_start
+        ORDER BY search_id, day_start
+        {MERGE_ON_CONFLICT_SQL}
+    ''', (cutoff,))
+    return conn.execute('DELETE FROM price_rollup_hourly WHERE bucket_start < ?', (cutoff,)).rowcount
+
+
+def apply_retention(monitor, raw_days: int = 30, hourly_days: int = 180,
+                    now: Optional[datetime] = None, vacuum: bool = False) -> Dict[str, int]:
+    """
+    Compacta el historial: filas crudas más antiguas que `raw_days` pasan a
+    buckets horarios y buckets horarios más antiguos que `hourly_days` a diarios.
+    Todo ocurre en una transacción. search_stats no se toca aquí: los rollups
+    conservan mín/máx, suma, suma de cuadrados y conteo, así que
+    FlightPriceMonitor.rebuild_search_stats (p. ej. tras importar) obtiene los
+    mismos agregados que antes de compactar.
+    """
+    if hourly_days < raw_days:
+        raise ValueError("hourly_days debe ser mayor o igual que raw_days")
+
+    now = now or datetime.utcnow()
+    raw_cutoff = format_cutoff(now - timedelta(days=raw_days))
+    hourly_cutoff = format_cutoff(now - timedelta(days=hourly_days))
+
+    conn = monitor.get_connection()
+    with conn:
+        raw_deleted = compact_raw_history(conn, raw_cutoff)
+        hourly_deleted = compact_hourly_rollups(conn, hourly_cutoff)
+
+    if vacuum:
+        conn.execute('VACUUM')
+
+    return {
+        'raw_rows_compacted': raw_deleted,
+        'hourly_buckets_compacted': hourly_deleted,
+    }
+
+
+def count_at_or_below(conn: sqlite3.Connection, search_id: int, price: float) -> Tuple[int, int]:
+    """
+    Chequeos con precio <= `price` como (mínimo, máximo). Las filas crudas
+    cuentan exacto; de un bucket compactado solo se sabe que el mínimo está
+    por debajo y el máximo por encima, así que el resto queda en el rango.
+    """
+    search_id = int(search_id)
+    raw = conn.execute('SELECT COUNT(*) FROM price_history WHERE search_id = ? AND price <= ?',
+                       (search_id, price)).fetchone()[0]
+    low, high = conn.execute('''
+        SELECT COALESCE(SUM(CASE WHEN max_price <= :price THEN price_count
+                                 WHEN min_price <= :price THEN 1 ELSE 0 END), 0),
+               COALESCE(SUM(CASE WHEN max_price <= :price THEN price_count
+                                 WHEN min_price <= :price THEN price_count - 1 ELSE 0 END), 0)
+        FROM (
+            SELECT min_price, max_price, price_count FROM price_rollup_hourly WHERE search_id = :search_id
+            UNION ALL
+            SELECT min_price, max_price, price_count FROM price_rollup_daily WHERE search_id = :search_id
+        )
+    ''', {'search_id': search_id, 'price': price}).fetchone()
+    return raw + low, raw + high
+
+
+def choose_resolution(start: datetime, end: datetime) -> str:
+    """Resolución ('raw', 'hour' o 'day') para un rango visible"""
+    span = end - start
+    for threshold, resolution in RESOLUTION_THRESHOLDS:
+        if span <= threshold:
+            return resolution
+    return 'day'
+
+
+def load_price_series(conn: sqlite3.Connection, search_id: int,
+                      start: Optional[datetime] = None, end: Optional[datetime] = None,
+                      resolution: Optional[str] = None) -> pd.DataFrame:
+    """
+    Serie de precios de una búsqueda combinando filas crudas y rollups.
+
+    Devuelve columnas checked_at, price (último del bucket), min_price,
+    max_price y price_count, ordenadas por fecha. Con `resolution=None` se
+    elige según el rango pedido (o el rango total disponible).
+    """
+    search_id = int(search_id)
+    if start is None or end is None:
+        bounds = conn.execute('''
+            SELECT MIN(first_seen), MAX(last_seen) FROM (
+                SELECT MIN(checked_at) AS first_seen, MAX(checked_at) AS last_seen
+                FROM price_history WHERE search_id = ?
+                UNION ALL
+                SELECT MIN(bucket_start), MAX(bucket_start) FROM price_rollup_hourly WHERE search_id = ?
+                UNION ALL
+                SELECT MIN(bucket_start), MAX(bucket_start) FROM price_rollup_daily WHERE search_id = ?
+            )
+        ''', (search_id, search_id, search_id)).fetchone()
+        if not bounds or bounds[0] is None:
+            return pd.DataFrame(columns=['checked_at', 'price', 'min_price', 'max_price', 'price_count'])
+        start = start or datetime.strptime(bounds[0][:19], '%Y-%m-%d %H:%M:%S')
+        end = end or datetime.strptime(bounds[1][:19], '%Y-%m-%d %H:%M:%S')
+
+    resolution = resolution or choose_resolution(start, end)
+    start_text = start.strftime('%Y-%m-%d %H:%M:%S')
+    end_text = end.strftime('%Y-%m-%d %H:%M:%S')
+
+    if resolution == 'raw':
+        raw_select = '''
+            SELECT checked_at AS bucket_start, price AS last_price, price AS min_price,
+                   price AS max_price, 1 AS price_count
+            FROM price_history WHERE search_id = ? AND checked_at BETWEEN ? AND ?
+        '''
+        hourly_select = '''
+            SELECT bucket_start, last_price, min_price, max_price, price_count
+            FROM price_rollup_hourly WHERE search_id = ? AND bucket_start BETWEEN ? AND ?
+        '''
+    else:
+        bucket_format = HOUR_FORMAT if resolution == 'hour' else DAY_FORMAT
+        # Último precio del bucket con LAST_VALUE, como en la compactación
+        raw_select = f'''
+            SELECT bucket_start, MIN(last_price) AS last_price, MIN(price) AS min_price,
+                   MAX(price) AS max_price, COUNT(*) AS price_count
+            FROM (
+                SELECT price, strftime('{bucket_format}', checked_at) AS bucket_start,
+                       LAST_VALUE(price) OVER bucket AS last_price
+                FROM price_history WHERE search_id = ? AND checked_at BETWEEN ? AND ?
+                WINDOW bucket AS (
+                    PARTITION BY strftime('{bucket_format}', checked_at)
+                    ORDER BY checked_at, id
+                    ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+                )
+            )
+            GROUP BY bucket_start
+        '''
+        if resolution == 'hour':
+            hourly_select = '''
+                SELECT bucket_start, last_price, min_price, max_price, price_count
+                FROM price_rollup_hourly WHERE search_id = ? AND bucket_start BETWEEN ? AND ?
+            '''
+        else:
+            hourly_select = f'''
+                SELECT day_start AS bucket_start, MIN(last_of_day) AS last_price,
+                       MIN(min_price) AS min_price, MAX(max_price) AS max_price,
+                       SUM(price_count) AS price_count
+                FROM (
+                    SELECT min_price, max_price, price_count,
+                           strftime('{DAY_FORMAT}', bucket_start) AS day_start,
+                           LAST_VALUE(last_price) OVER (
+                               PARTITION BY strftime('{DAY_FORMAT}', bucket_start)
+                               ORDER BY last_at, bucket_start
+                               ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING
+                           ) AS last_of_day
+                    FROM price_rollup_hourly WHERE search_id = ? AND bucket_start BETWEEN ? AND ?
+                )
+                GROUP BY day_start
+            '''
+
+    daily_select = '''
+        SELECT bucket_start, last_price, min_price, max_price, price_count
+        FROM price_rollup_daily WHERE search_id = ? AND bucket_start BETWEEN ? AND ?
+    '''
+
+    params = (search_id, start_text, end_text)
+    df = pd.read_sql_query(f'''
+        SELECT bucket_start AS checked_at, last_price AS price, min_price, max_price, price_count
+        FROM (
+            {raw_select}
+            UNION ALL
+            {hourly_select}
+            UNION ALL
+            {daily_select}
+        )
+        ORDER BY checked_at
+    ''', conn, params=params * 3)
+    df['checked_at'] = pd.to_datetime(df['checked_at'])
+    df.attrs['resolution'] = resolution
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compacta el historial de precios en rollups horarios y diarios")
+    parser.add_argument("--db", default="flight_prices.db", help="Ruta a la base de datos SQLite")
+    parser.add_argument("--raw-days", type=int, default=30, help="Días de historial crudo a conservar")
+    parser.add_argument("--hourly-days", type=int, default=180, help="Días de buckets horarios a conservar")
+    parser.add_argument("--vacuum", action="store_true", help="Ejecuta VACUUM al terminar")
+    args = parser.parse_args()
+
+    from flight_storage import FlightPriceMonitor
+    monitor = FlightPriceMonitor(db_path=args.db)
+    result = apply_retention(monitor, raw_days=args.raw_days,
+                             hourly_days=args.hourly_days, vacuum=args.vacuum)
+    print(f"Filas crudas compactadas: {result['raw_rows_compacted']}")
+    print(f"Buckets horarios compactados: {result['hourly_buckets_compacted']}")
+
+
+if __name__ == "__main__":
+    main()
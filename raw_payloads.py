@@ -0,0 +1,167 @@
+"""
+Respuestas crudas de los proveedores, comprimidas y sin duplicados
+Cada chequeo puede guardar el JSON original de la oferta elegida
+(`raw_data` del conector) para reprocesarlo más tarde sin gastar cuota de
+la API. El JSON se serializa de forma canónica, se identifica por su hash
+y se guarda una sola vez comprimido con zstd (si está instalado) o zlib;
+price_history solo guarda la referencia (payload_hash).
+"""
+
+import hashlib
+import json
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODEC_ZLIB = 'zlib'
+CODEC_ZSTD = 'zstd'
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 10
+
+# Proveedor por chequeo (indexado para los conteos agrupados) y referencia a
+# la respuesta cruda. Las filas previas quedan con source NULL.
+RAW_PAYLOADS_MIGRATION_SQL = [
+    'ALTER TABLE price_history ADD COLUMN source TEXT',
+    'ALTER TABLE price_history ADD COLUMN payload_hash TEXT',
+    'CREATE INDEX IF NOT EXISTS idx_price_history_source ON price_history (source)',
+    '''
+    CREATE INDEX IF NOT EXISTS idx_price_history_payload ON price_history (payload_hash)
+    WHERE payload_hash IS NOT NULL
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS raw_payloads (
+        hash TEXT PRIMARY KEY,
+        codec TEXT NOT NULL,
+        raw_size INTEGER NOT NULL,
+        payload BLOB NOT NULL
+    ) WITHOUT ROWID
+    ''',
+]
+
+# Si el chequeo llamó al proveedor (1) o reutilizó una respuesta de la caché
+# o de otra búsqueda del mismo lote (0). Las filas previas quedan con NULL.
+PROVIDER_CALL_MIGRATION_SQL = [
+    'ALTER TABLE price_history ADD COLUMN provider_call INTEGER',
+]
+
+
+def canonical_json(raw) -> bytes:
+    """Serialización estable: el mismo contenido siempre produce los mismos bytes"""
+    return json.dumps(raw, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str).encode()
+
+
+def payload_hash(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def compress_payload(data: bytes) -> Tuple[str, bytes]:
+    """(codec, bytes comprimidos)"""
+    if zstandard is not None:
+        return CODEC_ZSTD, zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return CODEC_ZLIB, zlib.compress(data, ZLIB_LEVEL)
+
+
+def decompress_payload(codec: str, blob: bytes) -> bytes:
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(blob)
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise ImportError("Las respuestas comprimidas con zstd requieren zstandard (pip install zstandard)")
+        return zstandard.ZstdDecompressor().decompress(blob)
+    raise ValueError(f"Códec desconocido: {codec}")
+
+
+def encode_payload(raw) -> Optional[Tuple[str, str, int, bytes]]:
+    """Fila de raw_payloads (hash, codec, tamaño original, blob) o None si no hay respuesta"""
+    if raw is None:
+        return None
+    data = canonical_json(raw)
+    codec, blob = compress_payload(data)
+    return payload_hash(data), codec, len(data), blob
+
+
+def store_payloads(conn, rows: Iterable[Optional[Tuple[str, str, int, bytes]]]):
+    """Inserta filas de encode_payload (dentro de la transacción del chequeo); las repetidas se ignoran"""
+    rows = list({row[0]: row for row in rows if row}.values())
+    if rows:
+        conn.executemany('''
+            INSERT OR IGNORE INTO raw_payloads (hash, codec, raw_size, payload)
+            VALUES (?, ?, ?, ?)
+        ''', rows)
+
+
+def load_payload(conn, price_history_id: int) -> Optional[Dict]:
+    """Respuesta cruda guardada de un chequeo, o None"""
+    row = conn.execute('''
+        SELECT r.codec, r.payload FROM price_history p
+        JOIN raw_payloads r ON r.hash = p.payload_hash
+        WHERE p.id = ?
+    ''', (int(price_history_id),)).fetchone()
+    if not row:
+        return None
+    return json.loads(decompress_payload(row[0], row[1]))
+
+
+def iter_payloads(conn, search_id: Optional[int] = None, source: Optional[str] = None):
+    """
+    (price_history_id, checked_at, source, respuesta) de los chequeos con
+    respuesta guardada, en orden cronológico. Cada respuesta repetida se
+    descomprime una sola vez.
+    """
+    query = '''
+        SELECT p.id, p.checked_at, p.source, r.hash, r.codec, r.payload FROM price_history p
+        JOIN raw_payloads r ON r.hash = p.payload_hash
+        WHERE 1 = 1
+    '''
+    params = []
+    if search_id is not None:
+        query += ' AND p.search_id = ?'
+        params.append(int(search_id))
+    if source:
+        query += ' AND p.source = ?'
+        params.append(source)
+    decoded = {}
+    for price_history_id, checked_at, row_source, digest, codec, blob in conn.execute(
+            query + ' ORDER BY p.checked_at, p.id', params):
+        if digest not in decoded:
+            decoded[digest] = decompress_payload(codec, blob)
+        yield price_history_id, checked_at, row_source, json.loads(decoded[digest])
+
+
+def prune_payloads(conn) -> int:
+    """Borra las respuestas que ya no referencia ningún chequeo"""
+    return conn.execute('''
+        DELETE FROM raw_payloads WHERE NOT EXISTS (
+            SELECT 1 FROM price_history p WHERE p.payload_hash = raw_payloads.hash
+        )
+    ''').rowcount
+
+
+def payload_stats(conn) -> Dict:
+    """Respuestas guardadas, chequeos que las referencian y bytes originales/comprimidos"""
+    payloads, raw_bytes, stored_bytes = conn.execute('''
+        SELECT COUNT(*), COALESCE(SUM(raw_size), 0), COALESCE(SUM(LENGTH(payload)), 0) FROM raw_payloads
+    ''').fetchone()
+    references = conn.execute(
+        'SELECT COUNT(*) FROM price_history WHERE payload_hash IS NOT NULL').fetchone()[0]
+    return {
+        'payloads': payloads,
+        'references': references,
+        'raw_bytes': raw_bytes,
+        'stored_bytes': stored_bytes,
+    }
+
+
+def source_counts(conn) -> List[Tuple[Optional[str], int, int]]:
+    """
+    (proveedor, chequeos, consultas reales al proveedor) del historial crudo.
+    Las filas anteriores al registro de provider_call cuentan como consultas.
+    """
+    return conn.execute('''
+        SELECT source, COUNT(*), SUM(COALESCE(provider_call, 1)) AS calls
+        FROM price_history GROUP BY source ORDER BY calls DESC
+    ''').fetchall()
@@ -0,0 +1,46 @@
+"""
+Importación de historial: las filas importadas no cuentan como consultas a la API
+"""
+
+import csv
+
+import pytest
+
+from data_import import import_prices
+from flight_storage import FlightPriceMonitor
+from raw_payloads import source_counts
+
+
+@pytest.fixture
+def monitor(tmp_path):
+    return FlightPriceMonitor(db_path=str(tmp_path / 'flight_prices.db'))
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as handle:
+        writer = csv.DictWriter(handle, fieldnames=['origin', 'destination', 'departure_date',
+                                                    'price', 'checked_at', 'source'])
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def test_import_does_not_change_provider_call_totals(tmp_path, monitor):
+    search_id = monitor.add_search({'name': 'Viaje', 'origin': 'BOG', 'destination': 'MIA',
+                                    'departure_date': '2030-01-01', 'passengers': 1,
+                                    'target_price': 300.0, 'email': ''})
+    monitor.check_flights_and_update(search_id)
+    before = {source: (checks, calls) for source, checks, calls in source_counts(monitor.get_connection())}
+
+    path = tmp_path / 'historico.csv'
+    write_csv(path, [
+        {'origin': 'BOG', 'destination': 'MIA', 'departure_date': '2030-01-01',
+         'price': 300 + i, 'checked_at': f'2029-12-{1 + i:02d} 10:00:00', 'source': source}
+        for i, source in enumerate(['Amadeus', 'Amadeus', 'Skyscanner', 'Simulación'])
+    ])
+    report = import_prices(monitor, str(path))
+    assert report['rows_imported'] == 4
+
+    after = {source: (checks, calls) for source, checks, calls in source_counts(monitor.get_connection())}
+    assert sum(checks for checks, _ in after.values()) == sum(checks for checks, _ in before.values()) + 4
+    assert sum(calls for _, calls in after.values()) == sum(calls for _, calls in before.values())
+    assert after['Amadeus'] == (2, 0)
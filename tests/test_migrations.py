@@ -0,0 +1,178 @@
+"""
+Migraciones de esquema y rollups
+Parte de una base con el esquema original (sin user_version), la lleva a la
+última versión conservando los datos, comprueba que volver a migrar no cambia
+nada (tampoco con varios arranques a la vez) y que la compactación guarda el
+mínimo, máximo, primer y último precio de cada bucket.
+"""
+
+import sqlite3
+import threading
+
+import pytest
+
+from flight_notifications import STATUS_SENT
+from flight_storage import MIGRATIONS, FlightPriceMonitor
+from price_retention import compact_hourly_rollups, compact_raw_history
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+BASELINE_SCHEMA = '''
+    CREATE TABLE flight_searches (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        search_name TEXT NOT NULL,
+        origin TEXT NOT NULL,
+        destination TEXT NOT NULL,
+        departure_date TEXT NOT NULL,
+        return_date TEXT,
+        passengers INTEGER DEFAULT 1,
+        email_notification TEXT,
+        target_price REAL,
+        is_active BOOLEAN DEFAULT 1,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE price_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        search_id INTEGER,
+        price REAL NOT NULL,
+        currency TEXT DEFAULT 'USD',
+        airline TEXT,
+        flight_details TEXT,
+        checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (search_id) REFERENCES flight_searches (id)
+    );
+    CREATE TABLE notifications (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        search_id INTEGER,
+        notification_type TEXT,
+        message TEXT,
+        sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (search_id) REFERENCES flight_searches (id)
+    );
+'''
+
+BASELINE_PRICES = [
+    (1, 320.0, 'Avianca', '2029-01-01 10:00:00'),
+    (1, 280.0, 'LATAM', '2029-01-02 10:00:00'),
+    (1, 300.0, 'Avianca', '2029-01-03 10:00:00'),
+    (2, 150.0, 'JetBlue', '2029-01-01 12:00:00'),
+]
+
+
+@pytest.fixture
+def baseline_db(tmp_path):
+    db_path = str(tmp_path / 'flight_prices.db')
+    conn = sqlite3.connect(db_path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.executemany('''
+        INSERT INTO flight_searches (search_name, origin, destination, departure_date, target_price)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [('Vacaciones', 'BOG', 'MIA', '2030-01-01', 250.0), ('Trabajo', 'JFK', 'BOS', '2030-02-01', None)])
+    conn.executemany('''
+        INSERT INTO price_history (search_id, price, airline, checked_at) VALUES (?, ?, ?, ?)
+    ''', BASELINE_PRICES)
+    conn.execute("INSERT INTO notifications (search_id, notification_type, message) "
+                 "VALUES (1, 'price_alert', 'Precio bajo')")
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+def schema_snapshot(conn):
+    return {
+        'version': conn.execute('PRAGMA user_version').fetchone()[0],
+        'schema': conn.execute('SELECT type, name, sql FROM sqlite_master ORDER BY type, name').fetchall(),
+        'prices': conn.execute('SELECT * FROM price_history ORDER BY id').fetchall(),
+        'stats': conn.execute('SELECT * FROM search_stats ORDER BY search_id').fetchall(),
+        'notifications': conn.execute('SELECT * FROM notifications ORDER BY id').fetchall(),
+    }
+
+
+def test_baseline_schema_migrates_to_latest_keeping_rows(baseline_db):
+    monitor = FlightPriceMonitor(db_path=baseline_db)
+    conn = monitor.get_connection()
+
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == LATEST_VERSION
+    # provider_call queda NULL en las filas previas (se cuentan como llamadas)
+    assert conn.execute('''
+        SELECT search_id, price, airline, checked_at, provider_call FROM price_history ORDER BY id
+    ''').fetchall() == [row + (None,) for row in BASELINE_PRICES]
+    assert conn.execute('SELECT search_name FROM flight_searches ORDER BY id').fetchall() == [
+        ('Vacaciones',), ('Trabajo',)]
+    assert conn.execute('''
+        SELECT search_id, current_price, min_price, max_price, check_count FROM search_stats ORDER BY search_id
+    ''').fetchall() == [(1, 300.0, 280.0, 320.0, 3), (2, 150.0, 150.0, 150.0, 1)]
+    # Los avisos anteriores a la bandeja de salida no se vuelven a enviar
+    assert conn.execute('SELECT message, status FROM notifications').fetchall() == [
+        ('Precio bajo', STATUS_SENT)]
+
+
+def test_run_migrations_twice_changes_nothing(baseline_db):
+    monitor = FlightPriceMonitor(db_path=baseline_db)
+    conn = monitor.get_connection()
+    before = schema_snapshot(conn)
+
+    assert monitor.run_migrations(conn) == LATEST_VERSION
+    FlightPriceMonitor(db_path=baseline_db)
+
+    assert schema_snapshot(conn) == before
+
+
+def test_concurrent_startups_apply_each_migration_once(baseline_db):
+    barrier = threading.Barrier(4)
+    errors, versions = [], []
+
+    def start():
+        try:
+            barrier.wait()
+            monitor = FlightPriceMonitor(db_path=baseline_db)
+            versions.append(monitor.get_connection().execute('PRAGMA user_version').fetchone()[0])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=start) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert versions == [LATEST_VERSION] * 4
+
+
+def test_rollups_keep_min_max_first_and_last_per_bucket(tmp_path):
+    monitor = FlightPriceMonitor(db_path=str(tmp_path / 'flight_prices.db'))
+    conn = monitor.get_connection()
+    search_id = monitor.add_search({
+        'name': 'Vacaciones', 'origin': 'BOG', 'destination': 'MIA',
+        'departure_date': '2030-01-01', 'passengers': 1,
+    })
+    # Insertadas fuera de orden: el primero y el último dependen de checked_at
+    prices = [
+        (300.0, '2029-01-01 10:20:00'),
+        (200.0, '2029-01-01 10:00:00'),
+        (150.0, '2029-01-01 10:45:00'),
+        (100.0, '2029-01-01 10:10:00'),
+        (500.0, '2029-01-01 11:00:00'),
+        (120.0, '2029-01-01 11:30:00'),
+    ]
+    with conn:
+        conn.executemany('INSERT INTO price_history (search_id, price, checked_at) VALUES (?, ?, ?)',
+                         [(search_id, price, checked_at) for price, checked_at in prices])
+        compact_raw_history(conn, '2029-01-02 00:00:00')
+
+    assert conn.execute('''
+        SELECT bucket_start, min_price, max_price, first_price, last_price, price_count
+        FROM price_rollup_hourly WHERE search_id = ? ORDER BY bucket_start
+    ''', (search_id,)).fetchall() == [
+        ('2029-01-01 10:00:00', 100.0, 300.0, 200.0, 150.0, 4),
+        ('2029-01-01 11:00:00', 120.0, 500.0, 500.0, 120.0, 2),
+    ]
+
+    with conn:
+        compact_hourly_rollups(conn, '2029-01-02 00:00:00')
+
+    assert conn.execute('''
+        SELECT bucket_start, min_price, max_price, first_price, last_price, price_count
+        FROM price_rollup_daily WHERE search_id = ?
+    ''', (search_id,)).fetchall() == [('2029-01-01 00:00:00', 100.0, 500.0, 200.0, 120.0, 6)]
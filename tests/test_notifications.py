@@ -0,0 +1,167 @@
+"""
+Bandeja de salida contra un servidor SMTP local (aiosmtpd)
+Comprueba el resumen por destinatario en una sola conexión, el reintento
+tras un 4xx y la deduplicación del aviso de precio objetivo.
+"""
+
+import socket
+from email import message_from_bytes
+from email.header import decode_header, make_header
+
+import pytest
+
+pytest.importorskip("aiosmtpd")
+from aiosmtpd.controller import Controller
+from aiosmtpd.smtp import AuthResult
+
+from flight_notifications import (STATUS_FAILED, STATUS_PENDING, STATUS_SENT,
+                                  NotificationDispatcher, enqueue_notifications)
+from flight_storage import FlightPriceMonitor
+
+RECIPIENT = 'viajero@example.com'
+
+
+class RecordingHandler:
+    """Guarda cada mensaje con su sesión (una por conexión) y responde 4xx/5xx a demanda"""
+
+    def __init__(self):
+        self.messages = []
+        self.transient_failures = 0
+        self.refused = set()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.refused:
+            return '550 5.1.1 Buzón inexistente'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.transient_failures:
+            self.transient_failures -= 1
+            return '451 4.3.0 Inténtalo más tarde'
+        self.messages.append((session, envelope))
+        return '250 OK'
+
+    def connections(self) -> int:
+        sessions = []
+        for session, _ in self.messages:
+            if not any(session is seen for seen in sessions):
+                sessions.append(session)
+        return len(sessions)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    handler = RecordingHandler()
+    controller = Controller(handler, hostname='127.0.0.1', port=free_port(),
+                            authenticator=lambda *args: AuthResult(success=True),
+                            auth_require_tls=False)
+    controller.start()
+    try:
+        yield handler, controller
+    finally:
+        controller.stop()
+
+
+@pytest.fixture
+def monitor(tmp_path):
+    return FlightPriceMonitor(db_path=str(tmp_path / 'flight_prices.db'))
+
+
+def make_dispatcher(monitor, controller, **options) -> NotificationDispatcher:
+    return NotificationDispatcher(monitor.db_path, controller.hostname, controller.port,
+                                  'monitor@example.com', 'secreto', use_tls=False,
+                                  retry_base_seconds=0, **options)
+
+
+def statuses(monitor):
+    return monitor.get_connection().execute(
+        'SELECT status, attempts FROM notifications ORDER BY id').fetchall()
+
+
+def test_digest_per_recipient_over_one_connection(smtp_server, monitor):
+    handler, controller = smtp_server
+    queued = enqueue_notifications(monitor.get_connection(), [
+        {'recipient': RECIPIENT, 'subject': f'Alerta {i}', 'message': f'Precio {100 + i} USD'}
+        for i in range(3)
+    ])
+    assert queued == 3
+
+    result = make_dispatcher(monitor, controller).flush_all()
+
+    assert result == {'emails': 1, 'sent': 3, 'retried': 0, 'failed': 0}
+    assert len(handler.messages) == 1
+    assert handler.connections() == 1
+    _, envelope = handler.messages[0]
+    assert envelope.rcpt_tos == [RECIPIENT]
+    subject = make_header(decode_header(message_from_bytes(envelope.content)['Subject']))
+    assert str(subject) == '✈️ 3 alertas de precios de vuelos'
+    assert statuses(monitor) == [(STATUS_SENT, 0)] * 3
+
+
+def test_transient_4xx_is_retried(smtp_server, monitor):
+    handler, controller = smtp_server
+    handler.transient_failures = 1
+    enqueue_notifications(monitor.get_connection(), [
+        {'recipient': RECIPIENT, 'subject': 'Alerta', 'message': 'Precio 120 USD'},
+    ])
+    dispatcher = make_dispatcher(monitor, controller)
+
+    first = dispatcher.flush()
+    assert first == {'emails': 0, 'sent': 0, 'retried': 1, 'failed': 0}
+    assert statuses(monitor) == [(STATUS_PENDING, 1)]
+    assert '451' in dispatcher.last_error
+
+    second = dispatcher.flush()
+    assert second == {'emails': 1, 'sent': 1, 'retried': 0, 'failed': 0}
+    assert statuses(monitor) == [(STATUS_SENT, 1)]
+    assert len(handler.messages) == 1
+
+
+def test_refused_batch_does_not_stop_the_round(smtp_server, monitor):
+    handler, controller = smtp_server
+    handler.refused.add('baja@example.com')
+    enqueue_notifications(monitor.get_connection(), [
+        {'recipient': 'baja@example.com', 'subject': 'Alerta', 'message': 'Precio 120 USD'},
+        {'recipient': RECIPIENT, 'subject': 'Alerta', 'message': 'Precio 130 USD'},
+    ])
+
+    result = make_dispatcher(monitor, controller, batch_size=1).flush_all()
+
+    assert result == {'emails': 1, 'sent': 1, 'retried': 0, 'failed': 1}
+    assert statuses(monitor) == [(STATUS_FAILED, 1), (STATUS_SENT, 0)]
+    assert [envelope.rcpt_tos for _, envelope in handler.messages] == [[RECIPIENT]]
+
+
+def test_repeated_target_hit_is_sent_once(smtp_server, monitor):
+    handler, controller = smtp_server
+    search_id = monitor.add_search({
+        'name': 'Vacaciones', 'origin': 'BOG', 'destination': 'MIA',
+        'departure_date': '2030-01-01', 'passengers': 1, 'target_price': 300.0,
+        'email': RECIPIENT,
+    })
+    search_data = {
+        'search_name': 'Vacaciones', 'origin': 'BOG', 'destination': 'MIA',
+        'departure_date': '2030-01-01', 'target_price': 300.0, 'email_notification': RECIPIENT,
+    }
+
+    def hit(price):
+        return {search_id: {
+            'search_data': search_data,
+            'flight_result': {'price': price, 'airline': 'Avianca', 'source': 'Simulación'},
+            'meets_target': True, 'is_lowest': False, 'previous_min': None,
+        }}
+
+    assert monitor.queue_price_alerts(hit(280.0)) == 1
+    assert monitor.queue_price_alerts(hit(275.0)) == 0
+
+    result = make_dispatcher(monitor, controller).flush_all()
+
+    assert result['emails'] == 1
+    assert len(handler.messages) == 1